@@ -5,10 +5,17 @@ Sử dụng Isolation Forest để phát hiện doanh nghiệp có hành vi bấ
 
 import pandas as pd
 import numpy as np
-from typing import Dict, Any, List, Optional
+from typing import Callable, Dict, Any, List, Optional
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 import os
+from llm_client import get_llm_client
+from metrics import timed_stage, record_model_load
+from model_state import on_snapshot
+from training_store import TrainingStore
+from logging_config import get_logger
+
+logger = get_logger(__name__)
 
 
 class AnomalyDetectionSystem:
@@ -49,23 +56,61 @@ class AnomalyDetectionSystem:
             'X_14': 'Hiệu suất sử dụng tài sản'
         }
 
-    def train_model(self, df: pd.DataFrame) -> Dict[str, Any]:
+    def train_model(
+        self,
+        df: pd.DataFrame,
+        progress_callback: Optional[Callable[[int, str], None]] = None
+    ) -> Dict[str, Any]:
         """
         Train Isolation Forest model trên DN khỏe mạnh
 
         Args:
             df: DataFrame chứa 14 chỉ số (X_1 → X_14) + cột 'label' (0=khỏe mạnh, 1=vỡ nợ)
+            progress_callback: Hàm nhận (phần trăm, mô tả bước) để báo tiến độ (VD: job huấn luyện nền)
 
         Returns:
             Dict chứa:
             - feature_statistics: Thống kê 14 features (P5, P25, P50, P75, P95)
             - contamination_rate: Tỷ lệ contamination
         """
-        print("🔄 Bắt đầu train Anomaly Detection System...")
-
         # 1. LỌC DN KHỎE MẠNH (label == 0)
-        healthy_df = df[df['label'] == 0].copy()
-        print(f"✅ Có {len(healthy_df)} DN khỏe mạnh để train")
+        healthy_df = df[df['label'] == 0]
+        return self._fit_healthy(healthy_df, len(df), progress_callback)
+
+    def train_from_store(
+        self,
+        store: TrainingStore,
+        version: Optional[int] = None,
+        progress_callback: Optional[Callable[[int, str], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Train trên một phiên bản dữ liệu đã lưu: chỉ đọc row group label 0 (DN khỏe mạnh)
+
+        Args:
+            store: Kho dữ liệu DN có nhãn (phân vùng 'label')
+            version: Phiên bản dữ liệu (None = mới nhất)
+            progress_callback: Hàm nhận (phần trăm, mô tả bước) để báo tiến độ
+
+        Returns:
+            Dict như train_model, kèm data_version
+        """
+        version = store.resolve_version(version)
+        feature_names = [f'X_{i}' for i in range(1, 15)]
+        healthy_df = store.read(version, columns=feature_names, partitions=[0])
+        result = self._fit_healthy(healthy_df, store.count(version), progress_callback)
+        return {**result, 'data_version': version}
+
+    def _fit_healthy(
+        self,
+        healthy_df: pd.DataFrame,
+        num_total: int,
+        progress_callback: Optional[Callable[[int, str], None]] = None
+    ) -> Dict[str, Any]:
+        """Fit scaler, ngưỡng percentile, thống kê và Isolation Forest trên DN khỏe mạnh"""
+        logger.info("Bắt đầu train Anomaly Detection System")
+        progress = progress_callback or (lambda pct, message: None)
+        progress(10, "Tính thống kê DN khỏe mạnh")
+        logger.info("Có %d DN khỏe mạnh để train", len(healthy_df))
 
         # 2. CHUẨN BỊ FEATURES
         self.feature_names = [f'X_{i}' for i in range(1, 15)]
@@ -91,7 +136,8 @@ class AnomalyDetectionSystem:
             }
 
         # 6. TRAIN ISOLATION FOREST
-        print("📊 Training Isolation Forest...")
+        logger.info("Training Isolation Forest")
+        progress(50, "Huấn luyện Isolation Forest")
         self.model = IsolationForest(
             n_estimators=100,
             contamination=0.05,  # 5% DN bất thường
@@ -99,7 +145,7 @@ class AnomalyDetectionSystem:
             n_jobs=-1
         )
         self.model.fit(X_scaled)
-        print("✅ Train Isolation Forest hoàn tất!")
+        logger.info("Train Isolation Forest hoàn tất")
 
         # 7. CHUẨN BỊ KẾT QUẢ TRẢ VỀ
         feature_statistics = []
@@ -115,13 +161,17 @@ class AnomalyDetectionSystem:
                 'mean': round(self.healthy_stats[feature]['mean'], 4)
             })
 
+        record_model_load('anomaly', 'train')
+
         return {
             'feature_statistics': feature_statistics,
             'contamination_rate': 0.05,
             'num_healthy_samples': len(healthy_df),
-            'num_total_samples': len(df)
+            'num_total_samples': num_total
         }
 
+    @timed_stage('anomaly_score')
+    @on_snapshot
     def calculate_anomaly_score(self, indicators: Dict[str, float]) -> float:
         """
         Tính Anomaly Score (0-100) cho DN mới
@@ -151,6 +201,8 @@ class AnomalyDetectionSystem:
 
         return round(anomaly_score, 2)
 
+    @timed_stage('anomaly_features')
+    @on_snapshot
     def detect_abnormal_features(self, indicators: Dict[str, float]) -> List[Dict[str, Any]]:
         """
         Phát hiện các features bất thường (so với P5, P95)
@@ -264,11 +316,8 @@ class AnomalyDetectionSystem:
             explanation: Giải thích văn xuôi (tiếng Việt, 200-300 từ)
         """
         try:
-            import google.generativeai as genai
-
-            # Cấu hình Gemini API
-            genai.configure(api_key=gemini_api_key)
-            model = genai.GenerativeModel('gemini-2.0-flash')
+            # LLM client dùng chung (không configure lại Gemini mỗi request)
+            client = get_llm_client(gemini_api_key)
 
             # Tạo prompt chi tiết
             prompt = f"""
@@ -323,8 +372,7 @@ Hãy viết báo cáo phân tích chi tiết (200-300 từ, tiếng Việt) vớ
 """
 
             # Gọi Gemini API
-            response = model.generate_content(prompt)
-            explanation = response.text
+            explanation = client.generate(prompt, endpoint='anomaly_explanation')
 
             return explanation
 
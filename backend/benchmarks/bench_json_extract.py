@@ -0,0 +1,120 @@
+"""
+Benchmark & fuzz: trích xuất JSON từ response LLM
+
+So sánh regex cũ của fetch_industry_data với json_utils.extract_json_object trên
+các response đối kháng nhiều KB, và fuzz kiểm tra object lồng nhiều tầng được trích đúng.
+
+Chạy: python benchmarks/bench_json_extract.py [--fuzz 2000] [--repeat 20]
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_utils import extract_json_object  # noqa: E402
+
+LEGACY_PATTERN = re.compile(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', re.DOTALL)
+
+
+def legacy_extract(text):
+    """Cách trích xuất cũ (regex 2 tầng)"""
+    match = LEGACY_PATTERN.search(text)
+    if not match:
+        return None
+    try:
+        return json.loads(match.group(0))
+    except ValueError:
+        return None
+
+
+def industry_payload():
+    return {
+        "growth": {"gdp_growth": [3.5, 4.2, 5.1, 6.0, 5.8], "years": [2020, 2021, 2022, 2023, 2024],
+                   "revenue_growth": 5.5, "market_size_usd": 50.2},
+        "financial": {"roe": 12.5, "roa": 8.2, "gross_margin": 25.3, "debt_ratio": 45.6},
+        "credit_risk": {"npl_rates": [2.1, 2.0, 1.8, 1.5, 1.4], "default_rate": 1.2, "risk_rating": "Trung bình"},
+        "other": {"num_companies": 15000, "market_concentration": "Phân tán", "price_trend": "Tăng nhẹ",
+                  "segments": {"north": {"share": 0.4}, "south": {"share": 0.6}}}
+    }
+
+
+def adversarial_cases(size_kb):
+    """Các response đối kháng (kích thước ~size_kb KB)"""
+    n = size_kb * 1024
+    payload = json.dumps(industry_payload(), ensure_ascii=False)
+    prose = ("Phân tích ngành {tạm tính} cho thấy \"tăng trưởng\" ổn định. " * (n // 60 + 1))[:n]
+    return {
+        "prose_then_json": prose + "\n```json\n" + payload + "\n```",
+        "unclosed_braces": "{" * (n // 2) + payload,
+        "nested_open_no_close": ("{\"a\": " * (n // 6)) + "1",
+        "many_small_invalid": ("{x} " * (n // 4)) + payload,
+        "long_string_value": json.dumps({"note": "\\\"{}" * (n // 4), "data": industry_payload()}),
+        "no_json": "không có dữ liệu " * (n // 17),
+    }
+
+
+def time_call(fn, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(text)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def random_value(rng, depth):
+    kind = rng.random()
+    if depth <= 0 or kind < 0.3:
+        return rng.choice([rng.randint(-1000, 1000), round(rng.uniform(-100, 100), 3), True, None,
+                           "chuỗi {có} \"ngoặc\" \\ và } lẻ", ""])
+    if kind < 0.6:
+        return [random_value(rng, depth - 1) for _ in range(rng.randint(0, 4))]
+    return {f"k{i}": random_value(rng, depth - 1) for i in range(rng.randint(0, 4))}
+
+
+def fuzz(iterations, seed=0):
+    """Nhúng object ngẫu nhiên (lồng tới 6 tầng) giữa lời dẫn nhiễu, kiểm tra trích xuất đúng"""
+    rng = random.Random(seed)
+    noise = ["Kết quả: ", "```json\n", "\n```", " {chú thích", " [1, 2] ", "\"trích dẫn\" ", "} ", "\n"]
+    failures = 0
+    legacy_misses = 0
+    for _ in range(iterations):
+        obj = {"root": random_value(rng, rng.randint(1, 6))}
+        prefix = "".join(rng.choice(noise[:-2]) for _ in range(rng.randint(0, 4))).replace("}", "")
+        suffix = "".join(rng.choice(noise) for _ in range(rng.randint(0, 4)))
+        text = prefix + json.dumps(obj, ensure_ascii=rng.random() < 0.5) + suffix
+        if extract_json_object(text) != obj:
+            failures += 1
+        if legacy_extract(text) != obj:
+            legacy_misses += 1
+    return failures, legacy_misses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fuzz", type=int, default=2000, help="Số lần fuzz")
+    parser.add_argument("--repeat", type=int, default=20, help="Số lần lặp mỗi phép đo")
+    parser.add_argument("--sizes", default="4,16,64", help="Kích thước response (KB)")
+    args = parser.parse_args()
+
+    print(f"{'case':<24}{'KB':>5}{'legacy ms':>12}{'scanner ms':>12}  legacy ok  scanner ok")
+    for size_kb in [int(s) for s in args.sizes.split(",")]:
+        for name, text in adversarial_cases(size_kb).items():
+            expected = None if name in ("no_json", "nested_open_no_close") else True
+            legacy_ms = time_call(legacy_extract, text, args.repeat)
+            scanner_ms = time_call(extract_json_object, text, args.repeat)
+            legacy_ok = (legacy_extract(text) is not None) == bool(expected)
+            scanner_ok = (extract_json_object(text) is not None) == bool(expected)
+            print(f"{name:<24}{size_kb:>5}{legacy_ms:>12.3f}{scanner_ms:>12.3f}  {str(legacy_ok):<10} {scanner_ok}")
+
+    failures, legacy_misses = fuzz(args.fuzz)
+    print(f"\nFuzz {args.fuzz} lần: scanner sai {failures}, regex cũ sai {legacy_misses}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
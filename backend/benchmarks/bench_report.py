@@ -0,0 +1,77 @@
+"""
+Benchmark: tạo báo cáo Word (thời gian, bộ nhớ đỉnh, kích thước file) theo DPI biểu đồ
+
+Chạy: python benchmarks/bench_report.py [--dpi 150,300] [--repeat 5]
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from report_generator import ReportGenerator  # noqa: E402
+
+
+def sample_report_data():
+    """Dữ liệu báo cáo mẫu (giống payload của /export-report)"""
+    indicators_dict = {f'X_{i}': 0.05 * i - 0.2 for i in range(1, 15)}
+    return {
+        "prediction": {
+            "pd_stacking": 0.123, "pd_logistic": 0.2, "pd_random_forest": 0.08, "pd_xgboost": 0.11,
+            "prediction": 0, "prediction_label": "Non-Default (Không vỡ nợ)"
+        },
+        "indicators": [
+            {"code": key, "name": f"Chỉ số {key}", "value": value} for key, value in indicators_dict.items()
+        ],
+        "indicators_dict": indicators_dict,
+        "analysis": "\n".join(f"Đoạn phân tích {i}: doanh nghiệp có tình hình tài chính ổn định." for i in range(20))
+    }
+
+
+def run(dpi, repeat):
+    data = sample_report_data()
+
+    # Warm-up (import font cache, khởi tạo matplotlib)
+    ReportGenerator(chart_dpi=dpi).generate_report(data, io.BytesIO())
+
+    timings = []
+    peak_bytes = 0
+    size_bytes = 0
+    for _ in range(repeat):
+        buffer = io.BytesIO()
+        tracemalloc.start()
+        start = time.perf_counter()
+        ReportGenerator(chart_dpi=dpi).generate_report(data, buffer)
+        timings.append(time.perf_counter() - start)
+        peak_bytes = max(peak_bytes, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        size_bytes = buffer.getbuffer().nbytes
+
+    timings.sort()
+    return {
+        "dpi": dpi,
+        "median_ms": round(timings[len(timings) // 2] * 1000, 1),
+        "min_ms": round(timings[0] * 1000, 1),
+        "peak_mem_mb": round(peak_bytes / 1024 / 1024, 2),
+        "docx_kb": round(size_bytes / 1024, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dpi", default="150,300", help="Danh sách DPI cần đo")
+    parser.add_argument("--repeat", type=int, default=5, help="Số lần lặp mỗi DPI")
+    args = parser.parse_args()
+
+    print(f"{'dpi':>5}{'median ms':>12}{'min ms':>10}{'peak MB':>10}{'docx KB':>10}")
+    for dpi in [int(d) for d in args.dpi.split(",")]:
+        r = run(dpi, args.repeat)
+        print(f"{r['dpi']:>5}{r['median_ms']:>12}{r['min_ms']:>10}{r['peak_mem_mb']:>10}{r['docx_kb']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Microbenchmark: thời gian mỗi báo cáo khi dựng styles/header/footer từ đầu so với clone template
+
+Chạy: python benchmarks/bench_report_template.py [--repeat 50] [--full 5]
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from docx import Document  # noqa: E402
+from bench_report import sample_report_data  # noqa: E402
+from report_generator import ReportGenerator  # noqa: E402
+
+
+def skeleton_from_scratch():
+    """Cách cũ: Document() mới + styles + header + footer cho mỗi báo cáo"""
+    generator = ReportGenerator.__new__(ReportGenerator)
+    generator.doc = Document()
+    generator.setup_styles()
+    generator.add_header()
+    generator.add_footer()
+    generator.doc.save(io.BytesIO())
+
+
+def skeleton_from_template():
+    """Cách mới: clone template dựng sẵn, điền ngày tạo, gắn footer"""
+    generator = ReportGenerator()
+    generator._fill_header()
+    generator._attach_footer()
+    generator.doc.save(io.BytesIO())
+
+
+def full_report(dpi):
+    ReportGenerator(chart_dpi=dpi).generate_report(sample_report_data(), io.BytesIO())
+
+
+def measure(fn, repeat, *args):
+    fn(*args)  # warm-up
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=50, help="Số lần lặp phần khung báo cáo")
+    parser.add_argument("--full", type=int, default=5, help="Số lần lặp báo cáo đầy đủ (có biểu đồ)")
+    parser.add_argument("--dpi", type=int, default=150, help="DPI biểu đồ cho báo cáo đầy đủ")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    ReportGenerator.build_template()
+    print(f"Dựng template (một lần / process): {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    scratch_ms = measure(skeleton_from_scratch, args.repeat)
+    template_ms = measure(skeleton_from_template, args.repeat)
+    print(f"Khung báo cáo, dựng từ đầu:  {scratch_ms:8.2f} ms / báo cáo")
+    print(f"Khung báo cáo, clone template: {template_ms:6.2f} ms / báo cáo")
+    print(f"Báo cáo đầy đủ (dpi {args.dpi}):    {measure(full_report, args.full, args.dpi):8.2f} ms / báo cáo")
+
+
+if __name__ == "__main__":
+    main()
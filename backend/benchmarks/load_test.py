@@ -0,0 +1,385 @@
+"""
+Load test: đo số người dùng đồng thời một worker FastAPI phục vụ được, với Gemini giả lập
+
+Script tự chạy server (uvicorn, 1 worker) với LLM_BACKEND=fake: độ trễ và tỷ lệ lỗi của Gemini giả lập
+cấu hình qua --llm-latency-ms / --llm-error-rate. Server chạy trong thư mục tạm nên model_stacking.pkl
+không ghi vào repo. Trước khi đo, script huấn luyện mô hình PD (/train) và Early Warning
+(/train-early-warning-model) từ DATASET.csv.
+
+Mỗi người dùng ảo là một vòng lặp asyncio: chọn endpoint theo tỷ trọng (--mix), gửi request, ghi độ trễ.
+Kết quả: throughput và p50/p95/p99 theo endpoint cho từng mức đồng thời (--users), in bảng + JSON.
+
+Chạy (trong thư mục backend):
+    python benchmarks/load_test.py --users 1,4,16 --duration 30 --llm-latency-ms 1500
+    python benchmarks/load_test.py --mix predict=5,early_warning=1 --llm-error-rate 0.2 --output load.json
+    python benchmarks/load_test.py --url http://localhost:8000   # server đang chạy sẵn (không tự train)
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+try:
+    import httpx
+except ImportError:
+    sys.exit("Thiếu thư viện httpx cho load test: pip install -r requirements.txt (hoặc pip install httpx)")
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_report import sample_report_data  # noqa: E402
+from workbooks import write_workbook  # noqa: E402
+
+DEFAULT_DATASET = os.path.join(os.path.dirname(BACKEND_DIR), "DATASET.csv")
+FEATURE_COLS = [f"X_{i}" for i in range(1, 15)]
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Tỷ trọng mặc định: phần lớn là dự báo, ít hơn là stress test / cảnh báo sớm / xuất báo cáo
+DEFAULT_MIX = {
+    "predict": 40,
+    "predict_xlsx": 15,
+    "simulate_scenario": 15,
+    "early_warning": 15,
+    "export_report": 10,
+    "analyze": 5,
+}
+
+
+class Workload:
+    """Dữ liệu request: các dòng DATASET.csv (để request khác nhau, không trúng cache Gemini) và file XLSX"""
+
+    def __init__(self, dataset_path: str, workbook_bytes: bytes, seed: int = 42):
+        self.rows = pd.read_csv(dataset_path)[FEATURE_COLS].to_dict(orient="records")
+        self.workbook_bytes = workbook_bytes
+        self.report_template = sample_report_data()
+        self.random = random.Random(seed)
+
+    def indicators(self) -> Dict[str, float]:
+        return self.random.choice(self.rows)
+
+    def xlsx_file(self) -> Dict[str, Tuple[str, bytes, str]]:
+        return {"file": ("bctc.xlsx", self.workbook_bytes, XLSX_MEDIA_TYPE)}
+
+
+# Mỗi endpoint: hàm nhận (client, workload) và trả về response
+async def _predict(client: httpx.AsyncClient, workload: Workload) -> httpx.Response:
+    return await client.post("/predict", json=workload.indicators())
+
+
+async def _predict_xlsx(client: httpx.AsyncClient, workload: Workload) -> httpx.Response:
+    return await client.post("/predict-from-xlsx", files=workload.xlsx_file())
+
+
+async def _simulate_scenario(client: httpx.AsyncClient, workload: Workload) -> httpx.Response:
+    scenario = workload.random.choice(["mild", "moderate", "crisis"])
+    return await client.post("/simulate-scenario", data={
+        "indicators_json": json.dumps(workload.indicators()), "scenario_type": scenario
+    })
+
+
+async def _early_warning(client: httpx.AsyncClient, workload: Workload) -> httpx.Response:
+    return await client.post("/early-warning-check", data={
+        "indicators_json": json.dumps(workload.indicators()), "industry_code": "manufacturing"
+    })
+
+
+async def _export_report(client: httpx.AsyncClient, workload: Workload) -> httpx.Response:
+    return await client.post("/export-report", json=workload.report_template)
+
+
+async def _analyze(client: httpx.AsyncClient, workload: Workload) -> httpx.Response:
+    indicators = workload.indicators()
+    return await client.post("/analyze", json={
+        "prediction": {"pd_stacking": workload.random.random(), "prediction_label": "Non-Default (Không vỡ nợ)"},
+        "indicators": indicators
+    })
+
+
+SCENARIOS: Dict[str, Tuple[str, Callable]] = {
+    "predict": ("POST /predict", _predict),
+    "predict_xlsx": ("POST /predict-from-xlsx", _predict_xlsx),
+    "simulate_scenario": ("POST /simulate-scenario", _simulate_scenario),
+    "early_warning": ("POST /early-warning-check", _early_warning),
+    "export_report": ("POST /export-report", _export_report),
+    "analyze": ("POST /analyze", _analyze),
+}
+
+
+def parse_mix(text: Optional[str]) -> Dict[str, float]:
+    """Đọc tỷ trọng dạng 'predict=40,early_warning=10' (bỏ trống = DEFAULT_MIX)"""
+    if not text:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Không có kịch bản '{name}'. Các kịch bản: {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Percentile theo nearest-rank trên danh sách đã sắp xếp"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Recorder:
+    """Ghi độ trễ / trạng thái của từng request trong pha đo"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.status_codes: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, name: str, latency: float, status: str, ok: bool):
+        self.latencies[name].append(latency)
+        self.status_codes[name][status] += 1
+        if not ok:
+            self.errors[name] += 1
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        endpoints = {}
+        all_latencies = []
+        for name, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            all_latencies.extend(values)
+            endpoints[name] = _stats(values, self.errors[name], elapsed)
+            endpoints[name]["status_codes"] = dict(self.status_codes[name])
+        overall = _stats(sorted(all_latencies), sum(self.errors.values()), elapsed)
+        return {"overall": overall, "endpoints": endpoints}
+
+
+def _stats(values: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "error_rate": round(errors / len(values), 4) if values else 0.0,
+        "throughput_rps": round(len(values) / elapsed, 2) if elapsed > 0 else 0.0,
+        "mean_ms": round(sum(values) / len(values) * 1000, 1) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 1),
+        "p95_ms": round(percentile(values, 95) * 1000, 1),
+        "p99_ms": round(percentile(values, 99) * 1000, 1),
+        "max_ms": round(values[-1] * 1000, 1) if values else 0.0,
+    }
+
+
+async def _virtual_user(
+    client: httpx.AsyncClient,
+    workload: Workload,
+    mix: Dict[str, float],
+    recorder: Recorder,
+    measure_from: float,
+    stop_at: float,
+    think_time: float
+):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    while time.perf_counter() < stop_at:
+        name = workload.random.choices(names, weights)[0]
+        label, send = SCENARIOS[name]
+        start = time.perf_counter()
+        try:
+            response = await send(client, workload)
+            await response.aread()
+            status, ok = str(response.status_code), response.status_code < 400
+        except httpx.HTTPError as e:
+            status, ok = type(e).__name__, False
+        end = time.perf_counter()
+
+        # Chỉ tính request bắt đầu sau warm-up và kết thúc trong thời gian đo
+        if start >= measure_from and end <= stop_at:
+            recorder.record(label, end - start, status, ok)
+        if think_time > 0:
+            await asyncio.sleep(workload.random.expovariate(1 / think_time))
+
+
+async def run_level(
+    base_url: str,
+    workload: Workload,
+    mix: Dict[str, float],
+    users: int,
+    duration: float,
+    warmup: float,
+    think_time: float,
+    timeout: float
+) -> Dict[str, Any]:
+    """
+    Chạy một mức tải: `users` người dùng ảo trong warmup + duration giây
+
+    Returns:
+        Kết quả tổng hợp của mức tải (overall + theo endpoint)
+    """
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        now = time.perf_counter()
+        measure_from = now + warmup
+        stop_at = measure_from + duration
+        await asyncio.gather(*(
+            _virtual_user(client, workload, mix, recorder, measure_from, stop_at, think_time)
+            for _ in range(users)
+        ))
+    result = recorder.summary(duration)
+    result["users"] = users
+    return result
+
+
+# ================================================================================================
+# SERVER CỤC BỘ
+# ================================================================================================
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workdir: str, llm_latency_ms: float, llm_error_rate: float, extra_env: Dict[str, str]) -> Tuple[subprocess.Popen, str]:
+    """
+    Chạy uvicorn (1 worker) với Gemini giả lập, cwd là thư mục tạm
+
+    Returns:
+        (process, base_url)
+    """
+    port = _free_port()
+    env = {
+        **os.environ,
+        "LLM_BACKEND": "fake",
+        "LLM_FAKE_LATENCY_MS": str(llm_latency_ms),
+        "LLM_FAKE_ERROR_RATE": str(llm_error_rate),
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+        **extra_env,
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR,
+         "--host", "127.0.0.1", "--port", str(port), "--workers", "1", "--log-level", "warning", "--no-access-log"],
+        cwd=workdir, env=env
+    )
+    base_url = f"http://127.0.0.1:{port}"
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server dừng khi khởi động (mã {process.returncode})")
+        try:
+            if httpx.get(base_url + "/", timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError("Server không khởi động được sau 60 giây")
+
+
+def train_models(base_url: str, dataset_path: str):
+    """Huấn luyện mô hình PD và Early Warning trên server (cần cho /predict, /early-warning-check)"""
+    with open(dataset_path, "rb") as f:
+        dataset_bytes = f.read()
+    with httpx.Client(base_url=base_url, timeout=300) as client:
+        response = client.post("/train", files={"file": ("DATASET.csv", dataset_bytes, "text/csv")})
+        response.raise_for_status()
+
+        labeled = pd.read_csv(io.BytesIO(dataset_bytes)).rename(columns={"default": "label"})
+        response = client.post("/train-early-warning-model", files={
+            "file": ("ews.csv", labeled.to_csv(index=False).encode("utf-8"), "text/csv")
+        })
+        response.raise_for_status()
+
+
+def print_report(levels: List[Dict[str, Any]]):
+    """In bảng kết quả theo mức tải và endpoint"""
+    header = f"{'users':>5}  {'endpoint':28s} {'req':>6} {'err%':>6} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9}"
+    print(header, file=sys.stderr)
+    print("-" * len(header), file=sys.stderr)
+    for level in levels:
+        rows = list(level["endpoints"].items()) + [("TỔNG", level["overall"])]
+        for name, stats in rows:
+            print(
+                f"{level['users']:>5}  {name:28s} {stats['requests']:>6} {stats['error_rate'] * 100:>5.1f}% "
+                f"{stats['throughput_rps']:>8.2f} {stats['p50_ms']:>7.0f}ms {stats['p95_ms']:>7.0f}ms {stats['p99_ms']:>7.0f}ms",
+                file=sys.stderr
+            )
+        print(file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Dùng server đang chạy thay vì tự chạy (mô hình phải được train sẵn)")
+    parser.add_argument("--users", default="1,4,16", help="Các mức người dùng đồng thời, VD: 1,4,16")
+    parser.add_argument("--duration", type=float, default=20, help="Thời gian đo mỗi mức (giây)")
+    parser.add_argument("--warmup", type=float, default=3, help="Thời gian warm-up mỗi mức, không tính (giây)")
+    parser.add_argument("--think-time", type=float, default=0, help="Thời gian nghỉ trung bình giữa 2 request (giây)")
+    parser.add_argument("--mix", help="Tỷ trọng endpoint, VD: predict=40,early_warning=10 (mặc định: DEFAULT_MIX)")
+    parser.add_argument("--llm-latency-ms", type=float, default=800, help="Độ trễ Gemini giả lập (ms)")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Tỷ lệ lỗi Gemini giả lập (0-1)")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Biến môi trường thêm cho server, VD: LLM_MAX_CONCURRENCY=4 (lặp lại được)")
+    parser.add_argument("--timeout", type=float, default=120, help="Timeout mỗi request (giây)")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="File CSV để train và lấy chỉ số mẫu")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file (mặc định in ra stdout)")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    user_levels = [int(value) for value in args.users.split(",") if value.strip()]
+    extra_env = dict(item.split("=", 1) for item in args.server_env)
+
+    with tempfile.TemporaryDirectory(prefix="loadtest_") as workdir:
+        with open(write_workbook(os.path.join(workdir, "bctc.xlsx")), "rb") as f:
+            workload = Workload(args.dataset, f.read(), args.seed)
+
+        process = None
+        try:
+            if args.url:
+                base_url = args.url.rstrip("/")
+            else:
+                process, base_url = start_server(workdir, args.llm_latency_ms, args.llm_error_rate, extra_env)
+                print(f"Server: {base_url} (Gemini giả lập {args.llm_latency_ms:.0f} ms, lỗi {args.llm_error_rate:.0%})", file=sys.stderr)
+                train_models(base_url, args.dataset)
+
+            levels = []
+            for users in user_levels:
+                print(f"Đang chạy {users} người dùng trong {args.warmup:.0f}+{args.duration:.0f}s ...", file=sys.stderr)
+                levels.append(asyncio.run(run_level(
+                    base_url, workload, mix, users, args.duration, args.warmup, args.think_time, args.timeout
+                )))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=30)
+
+    print_report(levels)
+    result = {
+        "config": {
+            "url": args.url, "duration_s": args.duration, "warmup_s": args.warmup, "think_time_s": args.think_time,
+            "mix": mix, "llm_latency_ms": args.llm_latency_ms, "llm_error_rate": args.llm_error_rate,
+            "server_env": extra_env,
+        },
+        "levels": levels,
+    }
+    payload = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+"""
+Bộ benchmark cho các đường xử lý chính của backend, xuất kết quả JSON để so sánh giữa các commit
+
+Đo: CreditRiskModel.train và predict (1 dòng / lô), ExcelProcessor.read_excel + calculate_14_indicators,
+simulate_scenario_full_propagation, EarlyWarningSystem.calculate_health_score + get_cluster_position,
+chấm điểm bất thường (AnomalyDetectionSystem) và ReportGenerator.generate_report.
+Dữ liệu: DATASET.csv (gốc repo) và file XLSX CDKT/BCTN/LCTT giả lập (benchmarks/workbooks.py).
+
+Chạy (trong thư mục backend):
+    python benchmarks/run_benchmarks.py --output bench_<commit>.json
+    python benchmarks/run_benchmarks.py --filter excel --compare bench_<commit_cũ>.json
+"""
+
+import argparse
+import copy
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd  # noqa: E402
+
+from anomaly_detection import AnomalyDetectionSystem  # noqa: E402
+from bench_report import sample_report_data  # noqa: E402
+from early_warning import EarlyWarningSystem  # noqa: E402
+from excel_processor import ExcelProcessor  # noqa: E402
+from model import CreditRiskModel, MODEL_COLS  # noqa: E402
+from report_generator import ReportGenerator  # noqa: E402
+from workbooks import write_workbook  # noqa: E402
+
+DEFAULT_DATASET = os.path.join(os.path.dirname(BACKEND_DIR), "DATASET.csv")
+BATCH_SIZE = 256
+
+# Mỗi benchmark: (tên, hàm chuẩn bị trả về callable cần đo, số vòng tối đa)
+BENCHMARKS: List[Tuple[str, Callable[["BenchContext"], Callable[[], Any]], int]] = []
+
+
+def benchmark(name: str, rounds: int = 20):
+    """Đăng ký một benchmark (hàm nhận BenchContext, trả về callable cần đo)"""
+    def decorator(setup):
+        BENCHMARKS.append((name, setup, rounds))
+        return setup
+    return decorator
+
+
+class BenchContext:
+    """Dữ liệu dùng chung giữa các benchmark (chỉ tạo khi cần, tạo một lần)"""
+
+    def __init__(self, dataset_path: str, workdir: str, report_dpi: Optional[int]):
+        self.dataset_path = dataset_path
+        self.workdir = workdir
+        self.report_dpi = report_dpi
+        self._cache: Dict[str, Any] = {}
+
+    def _get(self, key: str, factory: Callable[[], Any]) -> Any:
+        if key not in self._cache:
+            self._cache[key] = factory()
+        return self._cache[key]
+
+    @property
+    def dataset(self) -> pd.DataFrame:
+        return self._get("dataset", lambda: pd.read_csv(self.dataset_path))
+
+    @property
+    def labeled_dataset(self) -> pd.DataFrame:
+        """DATASET.csv theo định dạng của /train-early-warning-model, /train-anomaly-model (cột 'label')"""
+        return self._get("labeled", lambda: self.dataset.rename(columns={"default": "label"}))
+
+    @property
+    def workbook_path(self) -> str:
+        return self._get("workbook", lambda: write_workbook(os.path.join(self.workdir, "bctc_gia_lap.xlsx")))
+
+    @property
+    def indicators(self) -> Dict[str, float]:
+        def factory():
+            processor = ExcelProcessor()
+            processor.read_excel(self.workbook_path)
+            return processor.calculate_14_indicators()
+        return self._get("indicators", factory)
+
+    @property
+    def credit_model(self) -> CreditRiskModel:
+        def factory():
+            model = CreditRiskModel()
+            model.train(self.dataset_path)
+            return model
+        return self._get("credit_model", factory)
+
+    @property
+    def early_warning(self) -> EarlyWarningSystem:
+        def factory():
+            system = EarlyWarningSystem()
+            system.train_models(self.labeled_dataset)
+            return system
+        return self._get("early_warning", factory)
+
+    @property
+    def anomaly(self) -> AnomalyDetectionSystem:
+        def factory():
+            system = AnomalyDetectionSystem()
+            system.train_model(self.labeled_dataset)
+            return system
+        return self._get("anomaly", factory)
+
+
+# ================================================================================================
+# CÁC BENCHMARK
+# ================================================================================================
+
+@benchmark("model.train", rounds=3)
+def bench_model_train(ctx: BenchContext):
+    return lambda: CreditRiskModel().train(ctx.dataset_path)
+
+
+@benchmark("model.predict_single")
+def bench_model_predict_single(ctx: BenchContext):
+    model = ctx.credit_model
+    X_new = pd.DataFrame([ctx.indicators])[MODEL_COLS]
+    return lambda: model.predict(X_new)
+
+
+@benchmark("model.predict_batch")
+def bench_model_predict_batch(ctx: BenchContext):
+    model = ctx.credit_model
+    X_batch = ctx.dataset[MODEL_COLS].sample(BATCH_SIZE, replace=True, random_state=42).reset_index(drop=True)
+    return lambda: model.predict(X_batch)
+
+
+@benchmark("model.explain_batch", rounds=5)
+def bench_model_explain_batch(ctx: BenchContext):
+    model = ctx.credit_model
+    X_batch = ctx.dataset[MODEL_COLS].sample(BATCH_SIZE, replace=True, random_state=42).reset_index(drop=True)
+    return lambda: model.predict_batch(X_batch, explain=True)
+
+
+@benchmark("model.refit_meta")
+def bench_model_refit_meta(ctx: BenchContext):
+    model = copy.copy(ctx.credit_model)  # Không thay meta-model của mô hình dùng chung
+    return lambda: model.refit_meta({'C': 1.0})
+
+
+@benchmark("excel.read_excel")
+def bench_excel_read(ctx: BenchContext):
+    path = ctx.workbook_path
+    return lambda: ExcelProcessor().read_excel(path)
+
+
+@benchmark("excel.calculate_14_indicators")
+def bench_excel_indicators(ctx: BenchContext):
+    processor = ExcelProcessor()
+    processor.read_excel(ctx.workbook_path)
+    return processor.calculate_14_indicators
+
+
+@benchmark("excel.read_and_calculate")
+def bench_excel_end_to_end(ctx: BenchContext):
+    path = ctx.workbook_path
+
+    def run():
+        processor = ExcelProcessor()
+        processor.read_excel(path)
+        return processor.calculate_14_indicators()
+    return run
+
+
+@benchmark("scenario.full_propagation")
+def bench_scenario(ctx: BenchContext):
+    processor = ExcelProcessor()
+    indicators = ctx.indicators
+    return lambda: processor.simulate_scenario_full_propagation(
+        indicators, revenue_change_pct=-15, interest_rate_change_pct=20,
+        cogs_change_pct=8, liquidity_shock_pct=-10
+    )
+
+
+@benchmark("early_warning.health_score")
+def bench_ews_health_score(ctx: BenchContext):
+    system = ctx.early_warning
+    indicators = ctx.indicators
+    return lambda: system.calculate_health_score(indicators)
+
+
+@benchmark("early_warning.weaknesses_batch")
+def bench_ews_weaknesses_batch(ctx: BenchContext):
+    system = ctx.early_warning
+    rows = ctx.dataset[MODEL_COLS].sample(BATCH_SIZE, replace=True, random_state=42).to_dict('records')
+    return lambda: system.detect_weaknesses_batch(rows)
+
+
+@benchmark("early_warning.cluster_position", rounds=5)
+def bench_ews_cluster_position(ctx: BenchContext):
+    system = ctx.early_warning
+    indicators = ctx.indicators
+    return lambda: system.get_cluster_position(indicators)
+
+
+@benchmark("anomaly.score")
+def bench_anomaly_score(ctx: BenchContext):
+    system = ctx.anomaly
+    indicators = ctx.indicators
+    return lambda: system.calculate_anomaly_score(indicators)
+
+
+@benchmark("anomaly.abnormal_features")
+def bench_anomaly_features(ctx: BenchContext):
+    system = ctx.anomaly
+    indicators = ctx.indicators
+    return lambda: system.detect_abnormal_features(indicators)
+
+
+@benchmark("report.generate", rounds=5)
+def bench_report(ctx: BenchContext):
+    data = sample_report_data()
+    dpi = ctx.report_dpi
+    return lambda: ReportGenerator(chart_dpi=dpi).generate_report(data, io.BytesIO())
+
+
+# ================================================================================================
+# ĐO VÀ XUẤT KẾT QUẢ
+# ================================================================================================
+
+def measure(fn: Callable[[], Any], rounds: int, min_round_time: float) -> Dict[str, Any]:
+    """
+    Đo một callable: tự chọn số lần lặp mỗi vòng để vòng đủ dài (giảm nhiễu đồng hồ), rồi chạy nhiều vòng
+
+    Args:
+        fn: Hàm cần đo
+        rounds: Số vòng đo
+        min_round_time: Thời gian tối thiểu mỗi vòng (giây)
+
+    Returns:
+        Thống kê thời gian mỗi lần gọi (ms)
+    """
+    start = time.perf_counter()
+    fn()  # warm-up + ước lượng
+    single = time.perf_counter() - start
+    iterations = max(1, int(min_round_time / single)) if single > 0 else 1000
+
+    per_call = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        per_call.append((time.perf_counter() - start) / iterations)
+
+    return {
+        "median_ms": round(statistics.median(per_call) * 1000, 4),
+        "mean_ms": round(statistics.fmean(per_call) * 1000, 4),
+        "min_ms": round(min(per_call) * 1000, 4),
+        "max_ms": round(max(per_call) * 1000, 4),
+        "stddev_ms": round(statistics.stdev(per_call) * 1000, 4) if len(per_call) > 1 else 0.0,
+        "rounds": rounds,
+        "iterations": iterations,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    ctx: BenchContext,
+    name_filter: Optional[str] = None,
+    rounds: Optional[int] = None,
+    min_round_time: float = 0.05
+) -> Dict[str, Any]:
+    """
+    Chạy các benchmark đã đăng ký
+
+    Args:
+        ctx: Dữ liệu dùng chung
+        name_filter: Chỉ chạy benchmark có tên chứa chuỗi này
+        rounds: Ghi đè số vòng (None = theo từng benchmark)
+        min_round_time: Thời gian tối thiểu mỗi vòng (giây)
+
+    Returns:
+        Kết quả dạng dict (ghi ra JSON)
+    """
+    results = {}
+    for name, setup, default_rounds in BENCHMARKS:
+        if name_filter and name_filter not in name:
+            continue
+        fn = setup(ctx)
+        results[name] = measure(fn, rounds or default_rounds, min_round_time)
+        print(f"{name:34s} {results[name]['median_ms']:12.3f} ms  (x{results[name]['iterations']})", file=sys.stderr)
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "benchmarks": results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    So sánh median với kết quả cũ
+
+    Args:
+        current: Kết quả lần chạy này
+        baseline: Kết quả đọc từ file JSON cũ
+        threshold: Tỷ lệ chậm hơn được coi là regression (VD: 0.1 = chậm hơn 10%)
+
+    Returns:
+        Danh sách tên benchmark bị regression
+    """
+    regressions = []
+    print(f"\nSo với {baseline.get('commit') or 'baseline'}:", file=sys.stderr)
+    for name, result in current["benchmarks"].items():
+        old = baseline.get("benchmarks", {}).get(name)
+        if old is None:
+            print(f"  {name:34s} (mới)", file=sys.stderr)
+            continue
+        ratio = result["median_ms"] / old["median_ms"] if old["median_ms"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  << CHẬM HƠN"
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = "  nhanh hơn"
+        print(f"  {name:34s} {old['median_ms']:10.3f} → {result['median_ms']:10.3f} ms  x{ratio:.2f}{flag}", file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="File CSV huấn luyện (mặc định DATASET.csv)")
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file (mặc định in ra stdout)")
+    parser.add_argument("--filter", help="Chỉ chạy benchmark có tên chứa chuỗi này (VD: excel)")
+    parser.add_argument("--rounds", type=int, help="Ghi đè số vòng đo của mọi benchmark")
+    parser.add_argument("--min-round-time", type=float, default=0.05, help="Thời gian tối thiểu mỗi vòng (giây)")
+    parser.add_argument("--report-dpi", type=int, help="DPI biểu đồ cho report.generate (mặc định như production)")
+    parser.add_argument("--compare", help="File JSON kết quả cũ để so sánh")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Ngưỡng regression khi --compare (mặc định 10%%)")
+    parser.add_argument("--list", action="store_true", help="Liệt kê các benchmark")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, _, rounds in BENCHMARKS:
+            print(f"{name}  (rounds={rounds})")
+        return 0
+
+    # Cảnh báo hội tụ của sklearn/xgboost khi train lặp lại không liên quan tới kết quả đo
+    warnings.filterwarnings("ignore")
+
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        ctx = BenchContext(args.dataset, workdir, args.report_dpi)
+        result = run_benchmarks(ctx, args.filter, args.rounds, args.min_round_time)
+
+    payload = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(result, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+Tạo file XLSX báo cáo tài chính giả lập (3 sheets CDKT, BCTN, LCTT) cho benchmark
+Cấu trúc giống file thật: cột đầu là tên chỉ tiêu, các cột sau là giá trị đầu kỳ / cuối kỳ
+"""
+
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Các chỉ tiêu mà ExcelProcessor.calculate_14_indicators tìm kiếm (tên, giá trị cuối kỳ - tỷ đồng)
+CDKT_ITEMS: List[Tuple[str, float]] = [
+    ("A. Tài sản ngắn hạn", 520.0),
+    ("1. Tiền và các khoản tương đương tiền", 85.0),
+    ("2. Các khoản phải thu ngắn hạn", 160.0),
+    ("3. Hàng tồn kho", 210.0),
+    ("B. Tài sản dài hạn", 480.0),
+    ("TỔNG TÀI SẢN", 1000.0),
+    ("C. Nợ phải trả", 600.0),
+    ("1. Nợ ngắn hạn", 380.0),
+    ("2. Nợ dài hạn", 220.0),
+    ("D. Vốn chủ sở hữu", 400.0),
+]
+BCTN_ITEMS: List[Tuple[str, float]] = [
+    ("1. Doanh thu bán hàng và cung cấp dịch vụ", 1250.0),
+    ("3. Doanh thu thuần về bán hàng và cung cấp dịch vụ", 1200.0),
+    ("4. Giá vốn hàng bán", 930.0),
+    ("5. Lợi nhuận gộp về bán hàng và cung cấp dịch vụ", 270.0),
+]
+LCTT_ITEMS: List[Tuple[str, float]] = [
+    ("1. Lợi nhuận trước thuế", 95.0),
+    ("2. Khấu hao TSCĐ và BĐSĐT", 48.0),
+    ("3. Chi phí lãi vay", 32.0),
+]
+
+
+def _sheet(items: List[Tuple[str, float]], filler_rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    """Một sheet: các chỉ tiêu chính xen giữa các dòng chi tiết (để việc tìm kiếm giống file thật)"""
+    names = []
+    dau_ky = []
+    cuoi_ky = []
+    filler_per_item = max(filler_rows // max(len(items), 1), 0)
+    for index, (name, value) in enumerate(items):
+        names.append(name)
+        cuoi_ky.append(value)
+        dau_ky.append(round(value * rng.uniform(0.85, 1.05), 2))
+        for j in range(filler_per_item):
+            names.append(f"   - Chi tiết {index + 1}.{j + 1}")
+            detail = round(value * rng.uniform(0.01, 0.2), 2)
+            cuoi_ky.append(detail)
+            dau_ky.append(round(detail * rng.uniform(0.85, 1.05), 2))
+    return pd.DataFrame({"Chỉ tiêu": names, "Đầu kỳ": dau_ky, "Cuối kỳ": cuoi_ky})
+
+
+def build_workbook_frames(filler_rows: int = 60, seed: int = 42) -> Dict[str, pd.DataFrame]:
+    """
+    Dữ liệu 3 sheets của một báo cáo tài chính giả lập
+
+    Args:
+        filler_rows: Số dòng chi tiết chèn thêm mỗi sheet (file thật có khoảng 50-150 dòng)
+        seed: Seed ngẫu nhiên (cùng seed → cùng file)
+
+    Returns:
+        Dict tên sheet → DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    return {
+        "CDKT": _sheet(CDKT_ITEMS, filler_rows, rng),
+        "BCTN": _sheet(BCTN_ITEMS, filler_rows, rng),
+        "LCTT": _sheet(LCTT_ITEMS, filler_rows, rng),
+    }
+
+
+def write_workbook(path: str, filler_rows: int = 60, seed: int = 42) -> str:
+    """
+    Ghi file XLSX giả lập ra đĩa
+
+    Args:
+        path: Đường dẫn file .xlsx
+        filler_rows: Số dòng chi tiết mỗi sheet
+        seed: Seed ngẫu nhiên
+
+    Returns:
+        Đường dẫn file đã ghi
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        for sheet_name, df in build_workbook_frames(filler_rows, seed).items():
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+    return path
@@ -0,0 +1,158 @@
+"""
+Calibration Module - Hiệu chỉnh xác suất vỡ nợ (PD) của mô hình Stacking
+- Isotonic (bảng điểm gãy) hoặc Platt (2 tham số sigmoid), fit trên PD out-of-fold (dữ liệu mô hình chưa thấy);
+  giữ nguyên PD thô (identity) nếu hiệu chỉnh không cải thiện Brier cross-validation
+- Lưu dạng mảng tra cứu nhỏ, áp dụng vector hóa bằng np.interp / sigmoid: gần như không tốn thêm thời gian dự báo
+- Đánh giá bằng reliability curve: Brier, ECE, MCE, log loss theo bin
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sklearn.isotonic import IsotonicRegression
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import brier_score_loss, log_loss
+
+CALIBRATION_METHODS = ('identity', 'isotonic', 'platt')
+RELIABILITY_BINS = 10
+_EPS = 1e-6
+
+
+def _logit(proba: np.ndarray) -> np.ndarray:
+    proba = np.clip(proba, _EPS, 1 - _EPS)
+    return np.log(proba / (1 - proba))
+
+
+class ProbabilityCalibrator:
+    """Hàm hiệu chỉnh PD thô → PD đã hiệu chỉnh, lưu dạng mảng tra cứu"""
+
+    def __init__(self, method: str = 'isotonic'):
+        """
+        Args:
+            method: 'identity' (giữ nguyên PD), 'isotonic' hoặc 'platt'
+        """
+        if method not in CALIBRATION_METHODS:
+            raise ValueError(f"Phương pháp hiệu chỉnh không hợp lệ: {method}. Chọn: {', '.join(CALIBRATION_METHODS)}")
+        self.method = method
+        self.breakpoints_x: Optional[np.ndarray] = None  # isotonic
+        self.breakpoints_y: Optional[np.ndarray] = None
+        self.slope = 1.0  # platt: sigmoid(slope * logit(p) + intercept)
+        self.intercept = 0.0
+
+    def fit(self, proba: np.ndarray, y: np.ndarray) -> "ProbabilityCalibrator":
+        """
+        Fit trên PD thô của dữ liệu mô hình chưa thấy (out-of-fold hoặc tập giữ lại)
+
+        Args:
+            proba: PD thô (0-1)
+            y: Nhãn thực tế (0/1)
+        """
+        proba = np.asarray(proba, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if self.method == 'identity':
+            return self
+        if self.method == 'isotonic':
+            isotonic = IsotonicRegression(y_min=0.0, y_max=1.0, out_of_bounds='clip').fit(proba, y)
+            self.breakpoints_x = isotonic.X_thresholds_.astype(np.float64)
+            self.breakpoints_y = isotonic.y_thresholds_.astype(np.float64)
+        else:
+            platt = LogisticRegression(C=1e6, max_iter=1000).fit(_logit(proba).reshape(-1, 1), y.astype(int))
+            self.slope = float(platt.coef_[0, 0])
+            self.intercept = float(platt.intercept_[0])
+        return self
+
+    def transform(self, proba) -> np.ndarray:
+        """PD đã hiệu chỉnh cho mảng PD thô (vector hóa)"""
+        proba = np.asarray(proba, dtype=np.float64)
+        if self.method == 'identity':
+            return proba
+        if self.method == 'isotonic':
+            # np.interp giữ nguyên giá trị ở 2 đầu = out_of_bounds='clip' của IsotonicRegression
+            return np.interp(proba, self.breakpoints_x, self.breakpoints_y)
+        return 1.0 / (1.0 + np.exp(-(self.slope * _logit(proba) + self.intercept)))
+
+    def to_dict(self) -> Dict[str, Any]:
+        if self.method == 'identity':
+            return {'method': 'identity'}
+        if self.method == 'isotonic':
+            return {'method': 'isotonic', 'num_breakpoints': int(len(self.breakpoints_x))}
+        return {'method': 'platt', 'slope': round(self.slope, 6), 'intercept': round(self.intercept, 6)}
+
+
+def reliability_metrics(y: np.ndarray, proba: np.ndarray, n_bins: int = RELIABILITY_BINS) -> Dict[str, Any]:
+    """
+    Reliability curve (bin đều 0-1) và các chỉ số hiệu chỉnh
+
+    Args:
+        y: Nhãn thực tế (0/1)
+        proba: PD dự báo (0-1)
+        n_bins: Số bin
+
+    Returns:
+        Dict chứa brier, log_loss, ece (sai lệch trung bình có trọng số), mce (sai lệch lớn nhất), bins
+    """
+    y = np.asarray(y, dtype=np.float64)
+    proba = np.asarray(proba, dtype=np.float64)
+    bin_ids = np.clip((proba * n_bins).astype(int), 0, n_bins - 1)
+    counts = np.bincount(bin_ids, minlength=n_bins)
+    predicted_sum = np.bincount(bin_ids, weights=proba, minlength=n_bins)
+    observed_sum = np.bincount(bin_ids, weights=y, minlength=n_bins)
+
+    bins: List[Dict[str, Any]] = []
+    gaps = np.zeros(n_bins)
+    for b in np.flatnonzero(counts):
+        mean_predicted = predicted_sum[b] / counts[b]
+        observed_rate = observed_sum[b] / counts[b]
+        gaps[b] = abs(mean_predicted - observed_rate)
+        bins.append({
+            'range': [round(b / n_bins, 2), round((b + 1) / n_bins, 2)],
+            'count': int(counts[b]),
+            'mean_predicted': round(float(mean_predicted), 4),
+            'observed_rate': round(float(observed_rate), 4),
+        })
+
+    return {
+        'brier': round(float(brier_score_loss(y, proba)), 5),
+        'log_loss': round(float(log_loss(y, np.clip(proba, _EPS, 1 - _EPS), labels=[0, 1])), 5),
+        'ece': round(float(np.dot(counts, gaps) / max(len(y), 1)), 5),
+        'mce': round(float(gaps.max()), 5),
+        'bins': bins,
+    }
+
+
+def select_calibrator(proba: np.ndarray, y: np.ndarray, fold_ids: np.ndarray) -> Tuple[ProbabilityCalibrator, Dict[str, Any]]:
+    """
+    Chọn identity, isotonic hoặc Platt theo Brier cross-validation (fit trên các fold còn lại), rồi fit lại trên toàn bộ
+
+    Args:
+        proba: PD thô out-of-fold
+        y: Nhãn thực tế
+        fold_ids: Fold của từng dòng
+
+    Returns:
+        (calibrator đã fit, báo cáo: phương pháp được chọn + reliability trước/sau hiệu chỉnh theo cross-validation)
+    """
+    proba = np.asarray(proba, dtype=np.float64)
+    y = np.asarray(y)
+    cv_calibrated = {}
+    for method in CALIBRATION_METHODS:
+        calibrated = np.empty(len(y), dtype=np.float64)
+        for fold in np.unique(fold_ids):
+            train_mask = fold_ids != fold
+            calibrator = ProbabilityCalibrator(method).fit(proba[train_mask], y[train_mask])
+            calibrated[~train_mask] = calibrator.transform(proba[~train_mask])
+        cv_calibrated[method] = calibrated
+
+    cv_brier = {method: float(brier_score_loss(y, values)) for method, values in cv_calibrated.items()}
+    best = min(cv_brier, key=cv_brier.get)
+    calibrator = ProbabilityCalibrator(best).fit(proba, y)
+
+    report = {
+        **calibrator.to_dict(),
+        'cv_brier': {method: round(value, 5) for method, value in cv_brier.items()},
+        'reliability_cv': {
+            'raw': reliability_metrics(y, proba),
+            'calibrated': reliability_metrics(y, cv_calibrated[best]),
+        },
+    }
+    return calibrator, report
@@ -0,0 +1,135 @@
+"""
+Chart Renderer Module - Render biểu đồ báo cáo bằng API hướng đối tượng của matplotlib
+Dùng Figure + FigureCanvasAgg trực tiếp (không qua pyplot) nên an toàn khi nhiều thread cùng tạo báo cáo.
+Mỗi thread giữ sẵn template biểu đồ (axes, màu, tiêu đề); mỗi báo cáo chỉ cập nhật chiều cao/độ dài cột và nhãn.
+"""
+
+import io
+import threading
+from typing import Dict, List
+
+PD_MODELS = ['Stacking', 'Logistic', 'Random Forest', 'XGBoost']
+PD_COLORS = ['#00a651', '#4CAF50', '#8BC34A', '#CDDC39']
+
+INDICATORS_GROUP1 = ['X_1', 'X_2', 'X_3', 'X_4', 'X_5', 'X_6']
+INDICATORS_GROUP2 = ['X_7', 'X_8', 'X_9', 'X_10', 'X_11', 'X_12', 'X_13', 'X_14']
+
+
+class _PDComparisonTemplate:
+    """Template biểu đồ so sánh PD từ 4 models"""
+
+    def __init__(self):
+        # Import lười: matplotlib chỉ được nạp khi tạo báo cáo đầu tiên
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.fig = Figure(figsize=(10, 6))
+        FigureCanvasAgg(self.fig)
+        ax = self.fig.add_subplot(111)
+
+        self.bars = ax.bar(PD_MODELS, [0] * len(PD_MODELS), color=PD_COLORS)
+        ax.set_ylabel('Xác suất Vỡ nợ (%)', fontsize=12)
+        ax.set_title('So sánh PD từ 4 Models', fontsize=14, fontweight='bold')
+        ax.set_ylim(0, 100)
+
+        # Nhãn giá trị trên các cột (vị trí và nội dung cập nhật theo từng báo cáo)
+        self.labels = [
+            ax.text(bar.get_x() + bar.get_width() / 2., 0, '', ha='center', va='bottom', fontsize=10)
+            for bar in self.bars
+        ]
+        self.fig.tight_layout()
+
+    def update(self, pd_values: List[float]):
+        for bar, label, value in zip(self.bars, self.labels, pd_values):
+            bar.set_height(value)
+            label.set_y(value)
+            label.set_text(f'{value:.2f}%')
+
+
+class _IndicatorsTemplate:
+    """Template biểu đồ 14 chỉ số tài chính (2 nhóm)"""
+
+    def __init__(self):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.fig = Figure(figsize=(14, 6))
+        FigureCanvasAgg(self.fig)
+        self.ax1, self.ax2 = self.fig.subplots(1, 2)
+
+        self.bars1 = self.ax1.barh(INDICATORS_GROUP1, [0] * len(INDICATORS_GROUP1), color='#FFB6C1')
+        self.ax1.set_xlabel('Giá trị', fontsize=10)
+        self.ax1.set_title('Nhóm 1: Sinh lời & Đòn bẩy (X1-X6)', fontsize=11, fontweight='bold')
+        self.ax1.grid(axis='x', alpha=0.3)
+
+        self.bars2 = self.ax2.barh(INDICATORS_GROUP2, [0] * len(INDICATORS_GROUP2), color='#ADD8E6')
+        self.ax2.set_xlabel('Giá trị', fontsize=10)
+        self.ax2.set_title('Nhóm 2: Thanh toán & Hiệu quả (X7-X14)', fontsize=11, fontweight='bold')
+        self.ax2.grid(axis='x', alpha=0.3)
+
+    def update(self, values_group1: List[float], values_group2: List[float]):
+        for ax, bars, values in ((self.ax1, self.bars1, values_group1), (self.ax2, self.bars2, values_group2)):
+            for bar, value in zip(bars, values):
+                bar.set_width(value)
+            # Trục x phụ thuộc dữ liệu → tính lại giới hạn và bố cục
+            ax.relim()
+            ax.autoscale_view()
+        self.fig.tight_layout()
+
+
+class ChartRenderer:
+    """Render biểu đồ báo cáo ra PNG trong bộ nhớ, template riêng cho từng thread"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _template(self, name: str, factory):
+        template = getattr(self._local, name, None)
+        if template is None:
+            template = factory()
+            setattr(self._local, name, template)
+        return template
+
+    @staticmethod
+    def _to_png(fig, dpi: int) -> io.BytesIO:
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', dpi=dpi, bbox_inches='tight')
+        buffer.seek(0)
+        return buffer
+
+    def render_pd_comparison(self, pd_values: List[float], dpi: int = 300) -> io.BytesIO:
+        """
+        Render biểu đồ so sánh PD
+
+        Args:
+            pd_values: PD (%) theo thứ tự Stacking, Logistic, Random Forest, XGBoost
+            dpi: Độ phân giải ảnh
+
+        Returns:
+            Buffer PNG đã tua về đầu
+        """
+        template = self._template('pd_comparison', _PDComparisonTemplate)
+        template.update(pd_values)
+        return self._to_png(template.fig, dpi)
+
+    def render_indicators(self, indicators_dict: Dict[str, float], dpi: int = 300) -> io.BytesIO:
+        """
+        Render biểu đồ 14 chỉ số tài chính
+
+        Args:
+            indicators_dict: Dict X_1..X_14 -> giá trị (thiếu = 0)
+            dpi: Độ phân giải ảnh
+
+        Returns:
+            Buffer PNG đã tua về đầu
+        """
+        template = self._template('indicators', _IndicatorsTemplate)
+        template.update(
+            [indicators_dict.get(key, 0) for key in INDICATORS_GROUP1],
+            [indicators_dict.get(key, 0) for key in INDICATORS_GROUP2]
+        )
+        return self._to_png(template.fig, dpi)
+
+
+# Khởi tạo instance global
+chart_renderer = ChartRenderer()
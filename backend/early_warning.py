@@ -5,7 +5,7 @@ Sử dụng ML (Stacking + K-Means + Gemini AI) để chẩn đoán sức khỏe
 
 import pandas as pd
 import numpy as np
-from typing import Dict, Any, List, Optional
+from typing import Callable, Dict, Any, List, Optional
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import StackingClassifier
@@ -13,6 +13,21 @@ from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
 import xgboost as xgb
 import os
+from llm_client import get_llm_client, is_llm_available
+from model import fit_stacking_with_oof, stacking_oof_pd
+from calibration import ProbabilityCalibrator, select_calibrator
+from metrics import timed_stage, record_model_load
+from model_state import on_snapshot
+from training_store import TrainingStore
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+def _clip_0_100(values: np.ndarray) -> np.ndarray:
+    """max(0.0, min(100.0, x)) của Python cho từng phần tử (kể cả NaN: min(100.0, NaN) = 100.0)"""
+    values = np.where(values < 100.0, values, 100.0)
+    return np.where(values > 0.0, values, 0.0)
 
 
 class EarlyWarningSystem:
@@ -36,8 +51,12 @@ class EarlyWarningSystem:
         self.scaler = StandardScaler()
         self.thresholds = {}  # Ngưỡng an toàn cho 14 chỉ số
         self.feature_importances = {}
-        self.training_data = None
-        self.cluster_info = {}
+        self.cluster_info = {}  # size, center, avg_values, avg_pd, median_indicators theo cluster (nhóm label=0)
+        # Bảng tra cứu tính khi train (không giữ DataFrame huấn luyện): percentile chỉ số và vị trí Health Score
+        self.healthy_sorted: Optional[np.ndarray] = None  # 14 × số DN label=0: mỗi dòng là một chỉ số đã sắp xếp
+        self.healthy_health_scores: Optional[np.ndarray] = None  # Health Score của DN label=0, đã sắp xếp
+        self.calibrator: Optional[ProbabilityCalibrator] = None  # Hiệu chỉnh PD Stacking (fit trên PD out-of-fold)
+        self.calibration_report: Optional[Dict[str, Any]] = None
 
         # Tên đầy đủ của 14 chỉ số
         self.indicator_names = {
@@ -57,12 +76,17 @@ class EarlyWarningSystem:
             'X_14': 'Hiệu suất sử dụng tài sản'
         }
 
-    def train_models(self, df: pd.DataFrame) -> Dict[str, Any]:
+    def train_models(
+        self,
+        df: pd.DataFrame,
+        progress_callback: Optional[Callable[[int, str], None]] = None
+    ) -> Dict[str, Any]:
         """
         Train Stacking model và K-Means clustering
 
         Args:
             df: DataFrame chứa 14 chỉ số (X_1 → X_14) + cột 'label' (0=không vỡ nợ, 1=vỡ nợ)
+            progress_callback: Hàm nhận (phần trăm, mô tả bước) để báo tiến độ (VD: job huấn luyện nền)
 
         Returns:
             Dict chứa thông tin về training:
@@ -70,18 +94,18 @@ class EarlyWarningSystem:
             - feature_importances: Feature importances từ RandomForest
             - cluster_distribution: Phân bố các cluster
         """
-        print("🔄 Bắt đầu train Early Warning System...")
-
-        # Lưu training data
-        self.training_data = df.copy()
+        logger.info("Bắt đầu train Early Warning System")
+        progress = progress_callback or (lambda pct, message: None)
 
-        # Tách features và labels
+        # Tách features và labels (không giữ lại df: chỉ lưu các bảng tra cứu cần cho inference)
         feature_cols = [f'X_{i}' for i in range(1, 15)]
         X = df[feature_cols].values
         y = df['label'].values
+        df_healthy = df[df['label'] == 0]
 
         # 1. TRAIN STACKING MODEL (RF + XGB + GB, meta=LogisticRegression)
-        print("📊 Training Stacking Classifier...")
+        logger.info("Training Stacking Classifier")
+        progress(10, "Huấn luyện Stacking (RF + XGB + GB, 5-fold)")
 
         # Base models
         rf_model = RandomForestClassifier(
@@ -109,7 +133,7 @@ class EarlyWarningSystem:
         # Meta model
         meta_model = LogisticRegression(max_iter=1000)
 
-        # Stacking
+        # Stacking (cv='prefit' + fit_stacking_with_oof: kết quả như cv=5, giữ lại dự báo OOF để hiệu chỉnh PD)
         self.stacking_model = StackingClassifier(
             estimators=[
                 ('rf', rf_model),
@@ -117,11 +141,17 @@ class EarlyWarningSystem:
                 ('gb', gb_model)
             ],
             final_estimator=meta_model,
-            cv=5
+            cv='prefit',
+            stack_method='predict_proba'
         )
 
-        self.stacking_model.fit(X, y)
-        print("✅ Stacking model trained!")
+        oof, fold_ids = fit_stacking_with_oof(self.stacking_model, X, y, meta_model)
+        logger.info("Stacking model trained")
+
+        # Hiệu chỉnh PD (isotonic/Platt) trên PD Stacking out-of-fold
+        oof_pd = stacking_oof_pd(oof, y, fold_ids, lambda: LogisticRegression(max_iter=1000))
+        self.calibrator, self.calibration_report = select_calibrator(oof_pd, y, fold_ids)
+        logger.info("PD calibration: %s", self.calibration_report['method'])
 
         # Extract feature importances từ RandomForest layer
         rf_estimator = self.stacking_model.named_estimators_['rf']
@@ -132,15 +162,15 @@ class EarlyWarningSystem:
             for i in range(len(feature_cols))
         }
 
-        print("📈 Feature Importances:")
         for feature, importance in sorted(self.feature_importances.items(), key=lambda x: x[1], reverse=True):
-            print(f"   {feature}: {importance:.4f}")
+            logger.debug("Feature importance %s: %.4f", feature, importance)
 
         # 2. TRAIN K-MEANS CLUSTERING (4 clusters)
-        print("🔍 Training K-Means (4 clusters)...")
+        logger.info("Training K-Means (4 clusters)")
+        progress(75, "Phân cụm K-Means")
 
         # Chỉ cluster nhóm không vỡ nợ (label=0)
-        X_healthy = df[df['label'] == 0][feature_cols].values
+        X_healthy = df_healthy[feature_cols].values
 
         self.kmeans = KMeans(n_clusters=4, random_state=42, n_init=10)
         self.kmeans.fit(X_healthy)
@@ -155,16 +185,20 @@ class EarlyWarningSystem:
             self.cluster_info[cluster_id] = {
                 'size': int(np.sum(cluster_mask)),
                 'center': self.kmeans.cluster_centers_[cluster_id].tolist(),
-                'avg_values': np.mean(cluster_data, axis=0).tolist()
+                'avg_values': np.mean(cluster_data, axis=0).tolist(),
+                # PD trung bình (%) và trung vị 14 chỉ số của cluster (get_cluster_position)
+                'avg_pd': float(np.mean(self._stacking_pd(cluster_data))) if len(cluster_data) > 0 else 0.0,
+                'median_indicators': {
+                    col: float(value)
+                    for col, value in pd.DataFrame(cluster_data, columns=feature_cols).median().items()
+                }
             }
 
-        print("✅ K-Means trained!")
-        print(f"   Cluster sizes: {[self.cluster_info[i]['size'] for i in range(4)]}")
+        logger.info("K-Means trained, cluster sizes: %s", [self.cluster_info[i]['size'] for i in range(4)])
 
         # 3. TÍNH NGƯỠNG AN TOÀN (percentile P40, P50, P60 của nhóm label=0)
-        print("📏 Calculating safety thresholds...")
-
-        df_healthy = df[df['label'] == 0]
+        logger.info("Calculating safety thresholds")
+        progress(90, "Tính ngưỡng an toàn")
 
         for col in feature_cols:
             # Một số chỉ số càng cao càng tốt (sinh lời, thanh toán)
@@ -190,7 +224,11 @@ class EarlyWarningSystem:
                     'direction': 'higher_is_better'
                 }
 
-        print("✅ Thresholds calculated!")
+        logger.info("Thresholds calculated")
+
+        # Bảng tra cứu percentile (detect_weaknesses) và Health Score của nhóm label=0 (get_cluster_position)
+        self.healthy_sorted = np.sort(df_healthy[feature_cols].to_numpy(dtype=np.float64).T, axis=1)
+        self.healthy_health_scores = np.sort(self._health_scores(X_healthy))
 
         # 4. Trả về thông tin training
         result = {
@@ -201,12 +239,44 @@ class EarlyWarningSystem:
             'cluster_distribution': {
                 f'cluster_{i}': self.cluster_info[i]['size']
                 for i in range(4)
-            }
+            },
+            'calibration': self.calibration_report
         }
 
-        print("✅ Early Warning System trained successfully!")
+        logger.info("Early Warning System trained successfully")
+        record_model_load('early_warning', 'train')
         return result
 
+    def train_from_store(
+        self,
+        store: TrainingStore,
+        version: Optional[int] = None,
+        progress_callback: Optional[Callable[[int, str], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Train trên một phiên bản dữ liệu đã lưu (không cần upload lại)
+
+        Args:
+            store: Kho dữ liệu DN có nhãn (phân vùng 'label')
+            version: Phiên bản dữ liệu (None = mới nhất)
+            progress_callback: Hàm nhận (phần trăm, mô tả bước) để báo tiến độ
+
+        Returns:
+            Dict như train_models, kèm data_version
+        """
+        version = store.resolve_version(version)
+        result = self.train_models(store.read(version), progress_callback)
+        return {**result, 'data_version': version}
+
+    def _stacking_pd(self, X) -> np.ndarray:
+        """PD (%) từ Stacking cho nhiều dòng, đã hiệu chỉnh nếu có calibrator"""
+        probs = self.stacking_model.predict_proba(X)[:, 1]
+        if self.calibrator is not None:
+            probs = self.calibrator.transform(probs)
+        return probs * 100
+
+    @timed_stage('ews_health_score')
+    @on_snapshot
     def calculate_health_score(self, indicators: Dict[str, float]) -> float:
         """
         Tính Health Score (0-100) dựa trên 60% PD + 40% Statistical
@@ -219,7 +289,7 @@ class EarlyWarningSystem:
 
         Công thức:
             1. Tính Statistical Score dựa trên thresholds và feature importances
-            2. Tính PD Score từ stacking_model
+            2. Tính PD Score từ stacking_model (PD đã hiệu chỉnh)
             3. Health Score = 60% * (100 - PD) + 40% * Statistical Score
         """
         if not self.feature_importances:
@@ -228,64 +298,61 @@ class EarlyWarningSystem:
         if self.stacking_model is None:
             raise ValueError("Stacking model chưa được train. Vui lòng gọi train_models() trước.")
 
+        feature_cols = [f'X_{i}' for i in range(1, 15)]
+        X_input = [[indicators[col] for col in feature_cols]]
+        return self._health_scores(X_input)[0]
+
+    def _health_scores(self, X) -> List[float]:
+        """
+        Health Score (làm tròn 2 chữ số) cho nhiều dòng 14 chỉ số (X_1 → X_14), vector hóa theo dòng
+
+        Cùng công thức và thứ tự phép tính với calculate_health_score: dùng chung cho một DN (request)
+        và toàn bộ nhóm label=0 (bảng vị trí tính khi train)
+        """
+        X = np.asarray(X, dtype=np.float64)
+        feature_cols = [f'X_{i}' for i in range(1, 15)]
+
         # 1. TÍNH STATISTICAL SCORE (40%)
-        total_score = 0.0
+        total_score = np.zeros(len(X))
         total_weight = 0.0
 
-        for indicator, value in indicators.items():
+        for j, indicator in enumerate(feature_cols):
             if indicator not in self.thresholds:
                 continue
 
             threshold_info = self.thresholds[indicator]
             importance = self.feature_importances.get(indicator, 0.0)
+            value = X[:, j]
+            safe = threshold_info['safe_zone']
+            warning = threshold_info['warning_zone']
 
             # Normalize về [0, 1]
-            if threshold_info['direction'] == 'higher_is_better':
-                # Càng cao càng tốt
-                safe = threshold_info['safe_zone']
-                warning = threshold_info['warning_zone']
-
-                if value >= safe:
-                    normalized = 1.0
-                elif value <= warning:
-                    normalized = 0.0
-                else:
-                    normalized = (value - warning) / (safe - warning) if safe != warning else 0.5
-            else:
-                # Càng thấp càng tốt
-                safe = threshold_info['safe_zone']
-                warning = threshold_info['warning_zone']
-
-                if value <= safe:
-                    normalized = 1.0
-                elif value >= warning:
-                    normalized = 0.0
+            with np.errstate(divide='ignore', invalid='ignore'):
+                if threshold_info['direction'] == 'higher_is_better':
+                    # Càng cao càng tốt
+                    between = (value - warning) / (safe - warning) if safe != warning else 0.5
+                    normalized = np.where(value >= safe, 1.0, np.where(value <= warning, 0.0, between))
                 else:
-                    normalized = (warning - value) / (warning - safe) if warning != safe else 0.5
+                    # Càng thấp càng tốt
+                    between = (warning - value) / (warning - safe) if warning != safe else 0.5
+                    normalized = np.where(value <= safe, 1.0, np.where(value >= warning, 0.0, between))
 
             # Weighted sum
             total_score += normalized * importance
             total_weight += importance
 
         # Statistical score (0-100)
-        statistical_score = (total_score / total_weight * 100) if total_weight > 0 else 50.0
-        statistical_score = max(0.0, min(100.0, statistical_score))
-
-        # 2. TÍNH PD SCORE (60%)
-        feature_cols = [f'X_{i}' for i in range(1, 15)]
-        X_input = [[indicators[col] for col in feature_cols]]
-        pd_value = self.stacking_model.predict_proba(X_input)[0, 1] * 100  # PD in %
+        statistical_score = (total_score / total_weight * 100) if total_weight > 0 else np.full(len(X), 50.0)
+        statistical_score = _clip_0_100(statistical_score)
 
-        # PD Score: 100 - PD (PD càng thấp → score càng cao)
-        pd_score = max(0.0, min(100.0, 100 - pd_value))
+        # 2. TÍNH PD SCORE (60%): 100 - PD (PD càng thấp → score càng cao), PD in % (đã hiệu chỉnh)
+        pd_score = _clip_0_100(100 - self._stacking_pd(X))
 
-        # 3. KẾT HỢP: 60% PD + 40% Statistical
-        health_score = 0.6 * pd_score + 0.4 * statistical_score
+        # 3. KẾT HỢP: 60% PD + 40% Statistical, giới hạn trong [0, 100]
+        health_score = _clip_0_100(0.6 * pd_score + 0.4 * statistical_score)
 
-        # Giới hạn trong [0, 100]
-        health_score = max(0.0, min(100.0, health_score))
-
-        return round(health_score, 2)
+        # round() của Python (không dùng np.round) để giống hệt kết quả làm tròn từng DN
+        return [round(float(score), 2) for score in health_score]
 
     def classify_risk_level(self, health_score: float) -> Dict[str, str]:
         """
@@ -326,6 +393,31 @@ class EarlyWarningSystem:
                 'risk_level_text': 'Nguy hiểm'
             }
 
+    @on_snapshot
+    def healthy_percentiles(self, X) -> np.ndarray:
+        """
+        Percentile của từng chỉ số trong nhóm label=0: tỷ lệ DN khỏe mạnh có giá trị nhỏ hơn (%)
+
+        Tìm nhị phân (np.searchsorted) trên ma trận đã sắp xếp khi train, mỗi chỉ số một lần cho cả N DN;
+        kết quả giống hệt đếm (giá trị nhóm label=0 < value) / số DN label=0 (giá trị NaN = 0%)
+
+        Args:
+            X: Ma trận N × 14 chỉ số (X_1 → X_14)
+
+        Returns:
+            Ma trận N × 14 percentile
+        """
+        if self.healthy_sorted is None:
+            raise ValueError("Model chưa được train. Vui lòng gọi train_models() trước.")
+
+        X = np.asarray(X, dtype=np.float64)
+        below = np.empty(X.shape, dtype=np.int64)
+        for j, healthy_values in enumerate(self.healthy_sorted):
+            below[:, j] = np.searchsorted(healthy_values, X[:, j], side='left')
+        below[np.isnan(X)] = 0
+        return below / self.healthy_sorted.shape[1] * 100
+
+    @timed_stage('ews_weaknesses')
     def detect_weaknesses(self, indicators: Dict[str, float]) -> List[Dict[str, Any]]:
         """
         Phát hiện điểm yếu (top 3 chỉ số xa ngưỡng an toàn nhất)
@@ -336,51 +428,71 @@ class EarlyWarningSystem:
         Returns:
             List top 3 chỉ số yếu nhất
         """
-        weaknesses = []
+        return self.detect_weaknesses_batch([indicators])[0]
 
-        for indicator, value in indicators.items():
-            if indicator not in self.thresholds:
-                continue
+    @on_snapshot
+    def detect_weaknesses_batch(self, indicators_list: List[Dict[str, float]]) -> List[List[Dict[str, Any]]]:
+        """
+        Phát hiện điểm yếu cho nhiều DN, percentile tính một lần cho cả lô (healthy_percentiles)
 
-            threshold_info = self.thresholds[indicator]
-            safe_threshold = threshold_info['safe_zone']
-            direction = threshold_info['direction']
+        Args:
+            indicators_list: Danh sách dict 14 chỉ số
 
-            # Tính gap (khoảng cách so với ngưỡng an toàn)
-            if direction == 'higher_is_better':
-                gap = value - safe_threshold
-                severity = 'critical' if gap < -safe_threshold * 0.3 else 'moderate' if gap < 0 else 'low'
-            else:
-                gap = safe_threshold - value
-                severity = 'critical' if gap < -safe_threshold * 0.3 else 'moderate' if gap < 0 else 'low'
-
-            # Tính percentile
-            if self.training_data is not None:
-                healthy_data = self.training_data[self.training_data['label'] == 0]
-                if indicator in healthy_data.columns:
-                    percentile = (healthy_data[indicator] < value).sum() / len(healthy_data) * 100
+        Returns:
+            Danh sách (theo DN) top 3 chỉ số yếu nhất
+        """
+        feature_cols = [f'X_{i}' for i in range(1, 15)]
+        column_index = {col: j for j, col in enumerate(feature_cols)}
+        percentiles = None
+        if self.healthy_sorted is not None and indicators_list:
+            X = [[indicators.get(col, np.nan) for col in feature_cols] for indicators in indicators_list]
+            percentiles = self.healthy_percentiles(X)
+
+        results = []
+        for row, indicators in enumerate(indicators_list):
+            weaknesses = []
+
+            for indicator, value in indicators.items():
+                if indicator not in self.thresholds:
+                    continue
+
+                threshold_info = self.thresholds[indicator]
+                safe_threshold = threshold_info['safe_zone']
+                direction = threshold_info['direction']
+
+                # Tính gap (khoảng cách so với ngưỡng an toàn)
+                if direction == 'higher_is_better':
+                    gap = value - safe_threshold
+                    severity = 'critical' if gap < -safe_threshold * 0.3 else 'moderate' if gap < 0 else 'low'
                 else:
-                    percentile = 50.0
-            else:
-                percentile = 50.0
-
-            weaknesses.append({
-                'indicator': indicator,
-                'name': self.indicator_names.get(indicator, indicator),
-                'current_value': round(value, 4),
-                'safe_threshold': round(safe_threshold, 4),
-                'gap': round(gap, 4),
-                'percentile': round(percentile, 1),
-                'severity': severity,
-                'direction': direction
-            })
-
-        # Sắp xếp theo gap (âm nhất = yếu nhất)
-        weaknesses.sort(key=lambda x: x['gap'])
+                    gap = safe_threshold - value
+                    severity = 'critical' if gap < -safe_threshold * 0.3 else 'moderate' if gap < 0 else 'low'
 
-        # Trả về top 3
-        return weaknesses[:3]
+                # Percentile trong nhóm label=0 (đã tính cho cả lô)
+                if percentiles is not None and indicator in column_index:
+                    percentile = percentiles[row, column_index[indicator]]
+                else:
+                    percentile = 50.0
 
+                weaknesses.append({
+                    'indicator': indicator,
+                    'name': self.indicator_names.get(indicator, indicator),
+                    'current_value': round(value, 4),
+                    'safe_threshold': round(safe_threshold, 4),
+                    'gap': round(gap, 4),
+                    'percentile': round(percentile, 1),
+                    'severity': severity,
+                    'direction': direction
+                })
+
+            # Sắp xếp theo gap (âm nhất = yếu nhất), giữ top 3
+            weaknesses.sort(key=lambda x: x['gap'])
+            results.append(weaknesses[:3])
+
+        return results
+
+    @timed_stage('ews_cluster_position')
+    @on_snapshot
     def get_cluster_position(self, indicators: Dict[str, float]) -> Dict[str, Any]:
         """
         Xác định vị trí DN trong cluster
@@ -401,25 +513,11 @@ class EarlyWarningSystem:
         # Predict cluster
         cluster_id = int(self.kmeans.predict(X_input)[0])
 
-        # Tính percentile trong toàn dataset
-        if self.training_data is not None:
-            healthy_data = self.training_data[self.training_data['label'] == 0]
-
-            # Tính khoảng cách đến center của cluster
-            center = self.kmeans.cluster_centers_[cluster_id]
-            distances = np.linalg.norm(healthy_data[feature_cols].values - center, axis=1)
-            current_distance = np.linalg.norm(X_input[0] - center)
-
-            # Percentile: vị trí của DN trong toàn bộ healthy dataset
-            # Tính dựa trên health score
-            health_scores = []
-            for _, row in healthy_data.iterrows():
-                row_indicators = {col: row[col] for col in feature_cols}
-                hs = self.calculate_health_score(row_indicators)
-                health_scores.append(hs)
-
+        # Percentile: vị trí Health Score của DN trong toàn bộ nhóm label=0 (Health Score tính sẵn khi train, đã sắp xếp)
+        if self.healthy_health_scores is not None:
             current_health_score = self.calculate_health_score(indicators)
-            position_percentile = (np.array(health_scores) < current_health_score).sum() / len(health_scores) * 100
+            below = np.searchsorted(self.healthy_health_scores, current_health_score, side='left')
+            position_percentile = below / len(self.healthy_health_scores) * 100
         else:
             position_percentile = 50.0
 
@@ -433,33 +531,10 @@ class EarlyWarningSystem:
         else:
             cluster_name = "🔴 Nhóm D - Rất yếu"
 
-        # Tính cluster avg PD (nếu có stacking model)
-        cluster_avg_pd = 0.0
-        if self.stacking_model is not None and self.training_data is not None:
-            # Lấy tất cả DN trong cluster này
-            cluster_mask = self.kmeans.predict(healthy_data[feature_cols].values) == cluster_id
-            cluster_data = healthy_data[cluster_mask]
-
-            if len(cluster_data) > 0:
-                # Dự báo PD cho cluster
-                X_cluster = cluster_data[feature_cols].values
-                cluster_pds = self.stacking_model.predict_proba(X_cluster)[:, 1] * 100
-                cluster_avg_pd = float(np.mean(cluster_pds))
-
-        # Tính median indicators của cluster
-        if self.training_data is not None:
-            healthy_data = self.training_data[self.training_data['label'] == 0]
-            cluster_mask = self.kmeans.predict(healthy_data[feature_cols].values) == cluster_id
-            cluster_data = healthy_data[cluster_mask]
-
-            cluster_median_indicators = {}
-            for col in feature_cols:
-                if col in cluster_data.columns:
-                    cluster_median_indicators[col] = float(cluster_data[col].median())
-                else:
-                    cluster_median_indicators[col] = 0.0
-        else:
-            cluster_median_indicators = {col: 0.0 for col in feature_cols}
+        # PD trung bình và trung vị 14 chỉ số của cluster (tính sẵn khi train)
+        summary = self.cluster_info.get(cluster_id, {})
+        cluster_avg_pd = summary.get('avg_pd', 0.0)
+        cluster_median_indicators = dict(summary.get('median_indicators') or {col: 0.0 for col in feature_cols})
 
         return {
             'cluster_id': cluster_id,
@@ -469,6 +544,8 @@ class EarlyWarningSystem:
             'cluster_median_indicators': cluster_median_indicators
         }
 
+    @timed_stage('ews_pd_projection')
+    @on_snapshot
     def project_future_pd(
         self,
         indicators: Dict[str, float],
@@ -549,7 +626,7 @@ class EarlyWarningSystem:
         feature_cols = [f'X_{i}' for i in range(1, 15)]
         X_future = np.array([[indicators_after[col] for col in feature_cols]])
 
-        pd_future = self.stacking_model.predict_proba(X_future)[0, 1] * 100
+        pd_future = self._stacking_pd(X_future)[0]
 
         return round(pd_future, 2)
 
@@ -582,17 +659,14 @@ class EarlyWarningSystem:
         if gemini_api_key is None:
             gemini_api_key = os.getenv('GEMINI_API_KEY')
 
-        if not gemini_api_key:
+        if not is_llm_available(gemini_api_key):
             return self._generate_fallback_diagnosis(
                 health_score, risk_info, weaknesses, cluster_info, pd_projections, current_pd
             )
 
         try:
-            import google.generativeai as genai
-
-            # Configure Gemini
-            genai.configure(api_key=gemini_api_key)
-            model = genai.GenerativeModel('gemini-2.0-flash')
+            # LLM client dùng chung (không configure lại Gemini mỗi request)
+            client = get_llm_client(gemini_api_key)
 
             # Tạo prompt
             prompt = f"""
@@ -659,13 +733,12 @@ Hãy viết báo cáo chẩn đoán với cấu trúc sau (sử dụng Markdown)
 """
 
             # Gọi Gemini API
-            response = model.generate_content(prompt)
-            diagnosis = response.text
+            diagnosis = client.generate(prompt, endpoint='early_warning_diagnosis')
 
             return diagnosis
 
         except Exception as e:
-            print(f"⚠️ Lỗi khi gọi Gemini API: {str(e)}")
+            logger.warning("Lỗi khi gọi Gemini API, dùng báo cáo fallback: %s", e)
             return self._generate_fallback_diagnosis(
                 health_score, risk_info, weaknesses, cluster_info, pd_projections, current_pd
             )
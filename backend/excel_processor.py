@@ -7,6 +7,10 @@ import pandas as pd
 from typing import Dict, Any
 import numpy as np
 import re
+from metrics import timed_stage
+from logging_config import get_logger
+
+logger = get_logger(__name__)
 
 
 class ExcelProcessor:
@@ -18,6 +22,7 @@ class ExcelProcessor:
         self.lctt_df = None  # Lưu chuyển tiền tệ
         self.financial_indicators = {}
 
+    @timed_stage('parse')
     def read_excel(self, file_path: str) -> bool:
         """
         Đọc file XLSX với 3 sheets
@@ -152,18 +157,18 @@ class ExcelProcessor:
                     if is_negative:
                         float_value = -float_value
 
-                    print(f"✅ Tìm thấy '{indicator_name}': {float_value}")
+                    logger.debug("Tìm thấy '%s': %s", indicator_name, float_value)
                     return float_value
 
                 except (ValueError, AttributeError) as e:
-                    print(f"⚠️ Không thể chuyển đổi giá trị '{value}' cho '{indicator_name}': {str(e)}")
+                    logger.warning("Không thể chuyển đổi giá trị '%s' cho '%s': %s", value, indicator_name, e)
                     return 0.0
             else:
-                print(f"⚠️ Không tìm thấy chỉ tiêu '{indicator_name}' trong sheet")
+                logger.debug("Không tìm thấy chỉ tiêu '%s' trong sheet", indicator_name)
                 return 0.0
 
         except Exception as e:
-            print(f"❌ Lỗi khi lấy giá trị {indicator_name}: {str(e)}")
+            logger.warning("Lỗi khi lấy giá trị %s: %s", indicator_name, e)
             return 0.0
 
     def get_average_from_two_periods(self, df: pd.DataFrame, indicator_name: str) -> float:
@@ -186,10 +191,11 @@ class ExcelProcessor:
         # Tính bình quân
         binh_quan = (cuoi_ky + dau_ky) / 2
 
-        print(f"📊 {indicator_name}: Đầu kỳ={dau_ky:.2f}, Cuối kỳ={cuoi_ky:.2f}, Bình quân={binh_quan:.2f}")
+        logger.debug("%s: Đầu kỳ=%.2f, Cuối kỳ=%.2f, Bình quân=%.2f", indicator_name, dau_ky, cuoi_ky, binh_quan)
 
         return binh_quan
 
+    @timed_stage('indicators')
     def calculate_14_indicators(self) -> Dict[str, float]:
         """
         Tính toán 14 chỉ số tài chính từ 3 sheets
@@ -349,6 +355,7 @@ class ExcelProcessor:
 
         return result
 
+    @timed_stage('scenario')
     def simulate_scenario_indicators(
         self,
         original_indicators: Dict[str, float],
@@ -455,6 +462,7 @@ class ExcelProcessor:
 
         return new_indicators
 
+    @timed_stage('scenario')
     def simulate_scenario_full_propagation(
         self,
         original_indicators: Dict[str, float],
@@ -814,11 +822,11 @@ class ExcelProcessor:
             "liquidity_shock_pct": round(liquidity_shock_pct, 2)
         }
 
-        print(f"📊 Kênh truyền dẫn Macro → Micro:")
-        print(f"   - Doanh thu thay đổi: {result['revenue_change_pct']}%")
-        print(f"   - Giá vốn thay đổi: {result['cogs_change_pct']}%")
-        print(f"   - Lãi suất vay thay đổi: {result['interest_rate_change_pct']}%")
-        print(f"   - Thanh khoản sốc: {result['liquidity_shock_pct']}%")
+        logger.debug(
+            "Kênh truyền dẫn Macro → Micro: doanh thu %s%%, giá vốn %s%%, lãi suất vay %s%%, thanh khoản sốc %s%%",
+            result['revenue_change_pct'], result['cogs_change_pct'],
+            result['interest_rate_change_pct'], result['liquidity_shock_pct']
+        )
 
         return result
 
@@ -0,0 +1,268 @@
+"""
+Expected Loss Module - Tổn thất kỳ vọng EL = PD × LGD × EAD
+- Hồi quy LGD và EAD (XGBoost) từ 14 chỉ số, huấn luyện cùng lúc với mô hình PD (cột LGD, EAD của DATASET.csv)
+- Tính EL theo vector cho cả danh mục (không gọi API từng dòng) và tổng hợp: tổng, theo nhóm, top-N đóng góp
+"""
+
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_absolute_error, r2_score
+from xgboost import XGBRegressor
+
+from logging_config import get_logger
+from model_state import snapshot
+
+logger = get_logger(__name__)
+
+MODEL_COLS = [f'X_{i}' for i in range(1, 15)]
+TARGET_COLS = ['LGD', 'EAD']
+# Miền giá trị hợp lệ: LGD là tỷ lệ 0-1, EAD không âm (áp dụng cho cả giá trị dự báo và giá trị có sẵn)
+TARGET_BOUNDS = {'LGD': (0.0, 1.0), 'EAD': (0.0, None)}
+# Cột kết quả từng khoản vay (cột nhóm không được trùng tên, nếu không sẽ ghi đè)
+OUTPUT_COLS = ['id', 'PD', 'LGD', 'EAD', 'EL']
+
+
+def _build_regressor() -> XGBRegressor:
+    return XGBRegressor(
+        n_estimators=200,
+        max_depth=4,
+        learning_rate=0.05,
+        subsample=0.8,
+        random_state=42,
+        n_jobs=-1
+    )
+
+
+class ExpectedLossModel:
+    """Hai mô hình hồi quy LGD, EAD dùng cùng 14 chỉ số với mô hình PD"""
+
+    def __init__(self):
+        self.lgd_model: Optional[XGBRegressor] = None
+        self.ead_model: Optional[XGBRegressor] = None
+        self.metrics: Dict[str, Dict[str, float]] = {}
+
+    @staticmethod
+    def has_targets(df: pd.DataFrame) -> bool:
+        """Dữ liệu có đủ cột LGD, EAD để huấn luyện hay không"""
+        return all(col in df.columns for col in TARGET_COLS)
+
+    def train(self, train_df: pd.DataFrame, test_df: pd.DataFrame) -> Dict[str, Dict[str, float]]:
+        """
+        Huấn luyện LGD, EAD trên cùng tập train/test với mô hình PD
+
+        Args:
+            train_df: Dữ liệu train (14 chỉ số + LGD + EAD)
+            test_df: Dữ liệu test để đánh giá
+
+        Returns:
+            Dict metrics (r2, mae) của LGD và EAD trên tập test; None nếu không đủ dòng để tính
+            (r2 cần ít nhất 2 dòng test có giá trị, mae cần 1). Mục tiêu không có dòng train nào được bỏ qua
+        """
+        logger.info("Đang huấn luyện mô hình LGD/EAD")
+        models = {}
+        for target in TARGET_COLS:
+            train_rows = train_df[train_df[target].notna()]
+            if train_rows.empty:
+                logger.warning("Không có dòng train nào có giá trị %s, bỏ qua mô hình %s", target, target)
+                models[target] = None
+                self.metrics[target] = {"r2": None, "mae": None}
+                continue
+            regressor = _build_regressor()
+            regressor.fit(train_rows[MODEL_COLS], train_rows[target])
+            models[target] = regressor
+
+            test_rows = test_df[test_df[target].notna()]
+            predicted = regressor.predict(test_rows[MODEL_COLS]) if len(test_rows) else None
+            self.metrics[target] = {
+                "r2": float(r2_score(test_rows[target], predicted)) if len(test_rows) >= 2 else None,
+                "mae": float(mean_absolute_error(test_rows[target], predicted)) if len(test_rows) else None,
+            }
+
+        self.lgd_model = models['LGD']
+        self.ead_model = models['EAD']
+        return self.metrics
+
+    def predict(self, X: pd.DataFrame, targets: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+        """
+        Dự báo LGD (giới hạn 0-1) và EAD (không âm) cho nhiều dòng
+
+        Args:
+            X: DataFrame 14 chỉ số
+            targets: Các mục tiêu cần dự báo. None = cả LGD và EAD
+
+        Returns:
+            Dict {mục tiêu: array}
+        """
+        targets = targets or TARGET_COLS
+        models = {'LGD': self.lgd_model, 'EAD': self.ead_model}
+        untrained = [target for target in targets if models[target] is None]
+        if untrained:
+            raise ValueError(
+                f"Mô hình {'/'.join(untrained)} chưa được huấn luyện. Vui lòng huấn luyện với file có cột LGD, EAD."
+            )
+        X = X[MODEL_COLS]
+        return {target: np.clip(models[target].predict(X), *TARGET_BOUNDS[target]) for target in targets}
+
+
+def compute_expected_loss(pd_values: np.ndarray, lgd: np.ndarray, ead: np.ndarray) -> np.ndarray:
+    """EL = PD × LGD × EAD theo từng dòng (vector hóa)"""
+    return np.asarray(pd_values, dtype=float) * np.asarray(lgd, dtype=float) * np.asarray(ead, dtype=float)
+
+
+def resolve_lgd_ead(exposures: pd.DataFrame, el_model: Optional[ExpectedLossModel]) -> Dict[str, np.ndarray]:
+    """
+    LGD/EAD cho từng khoản vay: dùng giá trị có sẵn trong dữ liệu, còn thiếu thì dùng mô hình dự báo
+    Giá trị có sẵn được giới hạn cùng miền với giá trị dự báo (LGD 0-1, EAD không âm)
+
+    Args:
+        exposures: DataFrame 14 chỉ số, tùy chọn cột LGD, EAD
+        el_model: Mô hình LGD/EAD (None nếu chưa huấn luyện)
+
+    Returns:
+        Dict {'LGD': array, 'EAD': array,
+              'predicted_counts': số dòng dùng giá trị dự báo theo LGD/EAD,
+              'clipped_counts': số dòng có giá trị có sẵn nằm ngoài miền hợp lệ bị giới hạn lại}
+    """
+    values = {}
+    missing = {}
+    clipped = {}
+    for target in TARGET_COLS:
+        given = pd.to_numeric(exposures[target], errors='coerce') if target in exposures.columns else None
+        raw = given.to_numpy(dtype=float) if given is not None else np.full(len(exposures), np.nan)
+        missing[target] = np.isnan(raw)
+        values[target] = np.clip(raw, *TARGET_BOUNDS[target])
+        clipped[target] = int((values[target] != raw)[~missing[target]].sum())
+
+    needed = [target for target in TARGET_COLS if missing[target].any()]
+    if needed:
+        predicted = (el_model or ExpectedLossModel()).predict(exposures, needed)
+        for target in needed:
+            values[target] = np.where(missing[target], predicted[target], values[target])
+
+    return {
+        'LGD': values['LGD'],
+        'EAD': values['EAD'],
+        'predicted_counts': {target: int(missing[target].sum()) for target in TARGET_COLS},
+        'clipped_counts': clipped,
+    }
+
+
+def aggregate_portfolio(frame: pd.DataFrame, segment_col: Optional[str] = None, top_n: int = 10) -> Dict[str, Any]:
+    """
+    Tổng hợp EL của danh mục
+
+    Args:
+        frame: DataFrame có cột id, PD, LGD, EAD, EL (và cột nhóm nếu có)
+        segment_col: Cột nhóm để tổng hợp (VD: segment, industry). None = không tổng hợp theo nhóm
+        top_n: Số khoản vay đóng góp EL lớn nhất cần trả về
+
+    Returns:
+        Dict chứa summary, by_segment, top_contributors
+    """
+    el = frame['EL'].to_numpy()
+    ead = frame['EAD'].to_numpy()
+    total_el = float(el.sum())
+    total_ead = float(ead.sum())
+
+    summary = {
+        "num_exposures": int(len(frame)),
+        "total_el": total_el,
+        "total_ead": total_ead,
+        "el_rate": total_el / total_ead if total_ead > 0 else 0.0,
+        "avg_pd": float(frame['PD'].mean()) if len(frame) else 0.0,
+        "ead_weighted_pd": float(np.dot(frame['PD'].to_numpy(), ead) / total_ead) if total_ead > 0 else 0.0,
+        "avg_lgd": float(frame['LGD'].mean()) if len(frame) else 0.0,
+    }
+
+    by_segment = []
+    if segment_col and segment_col in frame.columns:
+        grouped = frame.groupby(segment_col, sort=False).agg(
+            num_exposures=('EL', 'size'), total_el=('EL', 'sum'), total_ead=('EAD', 'sum'), avg_pd=('PD', 'mean')
+        )
+        grouped['el_rate'] = np.where(grouped['total_ead'] > 0, grouped['total_el'] / grouped['total_ead'], 0.0)
+        grouped['el_share'] = grouped['total_el'] / total_el if total_el > 0 else 0.0
+        grouped = grouped.sort_values('total_el', ascending=False)
+        by_segment = [
+            {"segment": str(segment), **{key: float(value) for key, value in row.items()}}
+            for segment, row in grouped.iterrows()
+        ]
+        for item in by_segment:
+            item["num_exposures"] = int(item["num_exposures"])
+
+    # Top-N: argpartition O(n) rồi chỉ sắp xếp N phần tử
+    top_n = max(0, min(top_n, len(frame)))
+    top_contributors = []
+    if top_n:
+        top_idx = np.argpartition(-el, top_n - 1)[:top_n]
+        top_idx = top_idx[np.argsort(-el[top_idx])]
+        columns = OUTPUT_COLS + ([segment_col] if segment_col in frame.columns else [])
+        for record in frame.iloc[top_idx][columns].to_dict(orient='records'):
+            record['el_share'] = record['EL'] / total_el if total_el > 0 else 0.0
+            top_contributors.append(record)
+
+    return {"summary": summary, "by_segment": by_segment, "top_contributors": top_contributors}
+
+
+def evaluate_portfolio(
+    credit_model,
+    exposures: pd.DataFrame,
+    segment_col: Optional[str] = 'segment',
+    top_n: int = 10,
+    include_rows: bool = False
+) -> Dict[str, Any]:
+    """
+    Tính EL cho cả danh mục: PD (Stacking đã hiệu chỉnh, một lần predict_proba cho mọi dòng) × LGD × EAD
+
+    Args:
+        credit_model: CreditRiskModel đã huấn luyện (PD + mô hình LGD/EAD)
+        exposures: DataFrame 14 chỉ số, tùy chọn cột id, LGD, EAD và cột nhóm
+        segment_col: Cột nhóm để tổng hợp (không được trùng cột kết quả id, PD, LGD, EAD, EL)
+        top_n: Số khoản vay đóng góp EL lớn nhất
+        include_rows: True = trả về PD/LGD/EAD/EL của từng dòng
+
+    Returns:
+        Dict chứa summary, by_segment, top_contributors, lgd_ead_source, pd_calibrated (và rows nếu include_rows)
+
+    Raises:
+        ValueError: Thiếu cột, chỉ số không hợp lệ, danh mục rỗng hoặc cột nhóm trùng cột kết quả
+    """
+    if segment_col in OUTPUT_COLS:
+        raise ValueError(f"Cột nhóm '{segment_col}' trùng cột kết quả ({', '.join(OUTPUT_COLS)}), hãy chọn cột khác")
+    missing = [col for col in MODEL_COLS if col not in exposures.columns]
+    if missing:
+        raise ValueError(f"Thiếu cột: {', '.join(missing)}")
+    if len(exposures) == 0:
+        raise ValueError("Danh mục không có khoản vay nào")
+
+    X = exposures[MODEL_COLS].apply(pd.to_numeric, errors='coerce')
+    if X.isna().any().any():
+        bad_rows = X.index[X.isna().any(axis=1)][:5].tolist()
+        raise ValueError(f"Chỉ số không hợp lệ (trống hoặc không phải số) ở các dòng: {bad_rows}")
+
+    # Một bản chụp cho PD, calibrator và mô hình LGD/EAD: job huấn luyện publish giữa chừng không trộn hai mô hình
+    state = snapshot(credit_model)
+    # EL cần PD là tần suất vỡ nợ thực tế → dùng PD đã hiệu chỉnh nếu mô hình có calibrator
+    pd_values = state.predict_pd_batch(X, calibrated=True)
+    lgd_ead = resolve_lgd_ead(exposures, state.el_model)
+
+    frame = pd.DataFrame({
+        'id': exposures['id'].astype(str).to_numpy() if 'id' in exposures.columns else np.arange(len(exposures)).astype(str),
+        'PD': pd_values,
+        'LGD': lgd_ead['LGD'],
+        'EAD': lgd_ead['EAD'],
+    })
+    frame['EL'] = compute_expected_loss(frame['PD'].to_numpy(), frame['LGD'].to_numpy(), frame['EAD'].to_numpy())
+    if segment_col and segment_col in exposures.columns:
+        frame[segment_col] = exposures[segment_col].fillna('Không xác định').astype(str).to_numpy()
+
+    result = aggregate_portfolio(frame, segment_col, top_n)
+    result["lgd_ead_source"] = {
+        **{f"{target}_predicted": count for target, count in lgd_ead['predicted_counts'].items()},
+        **{f"{target}_clipped": count for target, count in lgd_ead['clipped_counts'].items()},
+    }
+    result["pd_calibrated"] = state.calibrator is not None
+    if include_rows:
+        result["rows"] = frame.to_dict(orient='records')
+    return result
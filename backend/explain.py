@@ -0,0 +1,170 @@
+"""
+Explain Module - Giải thích PD: đóng góp của từng chỉ số vào mỗi dự báo, tính theo lô (vector hóa)
+- XGBoost: TreeSHAP gốc của XGBoost (pred_contribs), theo log-odds
+- Random Forest: phân rã theo đường đi trên cây (chính xác, cộng tính), một phép nhân ma trận thưa cho mọi cây
+- Logistic Regression: đóng góp tuyến tính chính xác w_j × (x_j - trung bình tập train)
+- Kết hợp qua meta-model (logit tuyến tính theo PD của base models): tổng đóng góp = PD Stacking - PD nền
+"""
+
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from scipy import sparse
+from sklearn.ensemble import StackingClassifier
+
+MODEL_COLS = [f'X_{i}' for i in range(1, 15)]
+
+INDICATOR_NAMES = {
+    'X_1': 'Biên lợi nhuận gộp',
+    'X_2': 'Biên lợi nhuận trước thuế',
+    'X_3': 'ROA (Lợi nhuận/Tài sản)',
+    'X_4': 'ROE (Lợi nhuận/VCSH)',
+    'X_5': 'Nợ/Tài sản',
+    'X_6': 'Nợ/Vốn chủ sở hữu',
+    'X_7': 'Thanh toán hiện hành',
+    'X_8': 'Thanh toán nhanh',
+    'X_9': 'Khả năng trả lãi',
+    'X_10': 'Khả năng trả nợ gốc',
+    'X_11': 'Tạo tiền/VCSH',
+    'X_12': 'Vòng quay hàng tồn kho',
+    'X_13': 'Kỳ thu tiền bình quân',
+    'X_14': 'Hiệu suất sử dụng tài sản'
+}
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+def _to_probability(margin_contribs: np.ndarray, base_margin) -> Dict[str, np.ndarray]:
+    """
+    Đổi đóng góp theo log-odds sang đóng góp theo xác suất, giữ tính cộng tính:
+    mỗi đóng góp nhân cùng hệ số (p - p0) / tổng log-odds của dòng
+
+    Returns:
+        Dict {'contributions': n × số chỉ số, 'base': xác suất nền p0}
+    """
+    total = margin_contribs.sum(axis=1)
+    p0 = _sigmoid(base_margin)
+    p = _sigmoid(base_margin + total)
+    nonzero = np.abs(total) > 1e-12
+    # Tổng log-odds = 0: dùng đạo hàm sigmoid tại p0
+    scale = np.where(nonzero, (p - p0) / np.where(nonzero, total, 1.0), p0 * (1 - p0))
+    return {'contributions': margin_contribs * scale[:, None], 'base': p0}
+
+
+class StackingExplainer:
+    """Đóng góp của 14 chỉ số vào PD Stacking (Logistic + Random Forest + XGBoost, meta LogisticRegression)"""
+
+    def __init__(self, model: StackingClassifier, feature_means: Optional[np.ndarray] = None):
+        """
+        Args:
+            model: StackingClassifier đã fit với base models 'logistic', 'random_forest', 'xgboost'
+            feature_means: Trung bình 14 chỉ số trên tập train (mốc so sánh của Logistic Regression).
+                           None = mốc 0 (mô hình cũ không lưu trung bình)
+        """
+        self.model = model
+        logistic = model.named_estimators_['logistic']
+        rf = model.named_estimators_['random_forest']
+        self._booster = model.named_estimators_['xgboost'].get_booster()
+        self._rf = rf
+
+        # Logistic Regression: logit = b + Σ w_j x_j
+        means = np.zeros(len(MODEL_COLS)) if feature_means is None else np.asarray(feature_means, dtype=np.float64)
+        self._lr_weights = logistic.coef_[0].astype(np.float64)
+        self._lr_means = means
+        self._lr_base = float(logistic.intercept_[0] + self._lr_weights @ means)
+
+        # Random Forest: mỗi nút (trừ gốc) đóng góp (p_nút - p_nút cha) cho chỉ số dùng để tách ở nút cha.
+        # Ma trận (tổng số nút của mọi cây × 14): đóng góp của một dòng = decision_path(dòng) @ ma trận
+        blocks = []
+        root_total = 0.0
+        for tree in rf.estimators_:
+            t = tree.tree_
+            value = t.value[:, 0, :]
+            node_p = value[:, 1] / value.sum(axis=1)
+            internal = np.flatnonzero(t.children_left >= 0)
+            parent = np.full(t.node_count, -1)
+            parent[t.children_left[internal]] = internal
+            parent[t.children_right[internal]] = internal
+            nodes = np.flatnonzero(parent >= 0)
+            blocks.append(sparse.csr_matrix(
+                (node_p[nodes] - node_p[parent[nodes]], (nodes, t.feature[parent[nodes]])),
+                shape=(t.node_count, len(MODEL_COLS))
+            ))
+            root_total += node_p[0]
+        self._rf_matrix = sparse.vstack(blocks).tocsr() / len(rf.estimators_)
+        self._rf_base = root_total / len(rf.estimators_)
+
+        # Meta-model: logit Stacking = b + w_lr × PD_lr + w_rf × PD_rf + w_xgb × PD_xgb
+        meta = model.final_estimator_
+        self._meta_weights = meta.coef_[0].astype(np.float64)
+        self._meta_intercept = float(meta.intercept_[0])
+
+    def explain(self, X: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """
+        Đóng góp của từng chỉ số cho nhiều dòng
+
+        Args:
+            X: DataFrame 14 chỉ số
+
+        Returns:
+            Dict:
+            - pd: PD Stacking của từng dòng
+            - base_pd: PD nền (mọi chỉ số ở mức tham chiếu)
+            - contributions: n × 14 đóng góp theo PD (tổng theo dòng = pd - base_pd)
+            - logit_contributions: n × 14 đóng góp theo log-odds của Stacking
+        """
+        X = X[MODEL_COLS]
+        values = X.to_numpy(dtype=np.float64)
+        n = len(values)
+
+        lr = _to_probability((values - self._lr_means) * self._lr_weights, np.full(n, self._lr_base))
+        rf = {
+            'contributions': (self._rf.decision_path(X)[0] @ self._rf_matrix).toarray(),
+            'base': np.full(n, self._rf_base),
+        }
+        xgb_margin = self._booster.predict(xgb.DMatrix(X), pred_contribs=True)
+        xgb_part = _to_probability(xgb_margin[:, :-1].astype(np.float64), xgb_margin[:, -1].astype(np.float64))
+
+        parts = (lr, rf, xgb_part)
+        logit_contributions = sum(w * part['contributions'] for w, part in zip(self._meta_weights, parts))
+        base_logit = self._meta_intercept + sum(w * part['base'] for w, part in zip(self._meta_weights, parts))
+        stacked = _to_probability(logit_contributions, base_logit)
+
+        return {
+            'pd': _sigmoid(base_logit + logit_contributions.sum(axis=1)),
+            'base_pd': stacked['base'],
+            'contributions': stacked['contributions'],
+            'logit_contributions': logit_contributions,
+        }
+
+
+def top_contributions(values: np.ndarray, contributions: np.ndarray, top_k: int) -> List[List[Dict[str, Any]]]:
+    """
+    Top-k chỉ số có đóng góp lớn nhất (theo trị tuyệt đối) của từng dòng
+
+    Args:
+        values: n × 14 giá trị chỉ số
+        contributions: n × 14 đóng góp theo PD
+        top_k: Số chỉ số mỗi dòng (>= 14 = tất cả)
+
+    Returns:
+        Danh sách theo dòng, mỗi phần tử: indicator, name, value, contribution (dương = làm tăng PD)
+    """
+    top_k = max(1, min(top_k, len(MODEL_COLS)))
+    order = np.argsort(-np.abs(contributions), axis=1)[:, :top_k]
+    return [
+        [
+            {
+                'indicator': MODEL_COLS[j],
+                'name': INDICATOR_NAMES[MODEL_COLS[j]],
+                'value': float(values[i, j]),
+                'contribution': float(contributions[i, j]),
+            }
+            for j in row
+        ]
+        for i, row in enumerate(order)
+    ]
@@ -3,31 +3,89 @@ Gemini API Module - Tích hợp Google Gemini để phân tích kết quả dự
 """
 
 import os
-from typing import Dict, Any
-import google.generativeai as genai
+from typing import Dict, Any, Optional
 from dotenv import load_dotenv
+from gemini_cache import gemini_cache, make_prompt_key
+from llm_client import get_llm_client, DEFAULT_MODEL_NAME
+from single_flight import gemini_single_flight
+from json_utils import extract_json_object
 
 load_dotenv()  # Tải biến môi trường từ file .env
 
 class GeminiAnalyzer:
     """Class để tích hợp Gemini API phân tích kết quả dự báo rủi ro tín dụng"""
 
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, cache=None):
         """
         Khởi tạo Gemini API
 
         Args:
             api_key: API key của Google Gemini. Nếu không truyền, sẽ lấy từ biến môi trường GEMINI_API_KEY
+            cache: GeminiResponseCache dùng cho các prompt phân tích ngành. Mặc định dùng cache global
         """
         self.api_key = api_key or os.getenv("GEMINI_API_KEY")
-        if not self.api_key:
-            raise ValueError("Không tìm thấy GEMINI_API_KEY. Vui lòng cung cấp API key hoặc set biến môi trường.")
 
-        # Cấu hình Gemini
-        genai.configure(api_key=self.api_key)
+        # Dùng LLM client chung (Gemini chỉ được configure lại khi API key đổi)
+        # Ném ValueError nếu không có API key
+        self.client = get_llm_client(self.api_key)
 
         # ✅ Sử dụng Gemini 2.0 Flash (stable)
-        self.model = genai.GenerativeModel('gemini-2.0-flash')
+        self.model_name = self.client.model_name
+
+        # Cache response cho các prompt xác định (phân tích ngành)
+        self.cache = cache if cache is not None else gemini_cache
+
+        # Gộp các prompt giống nhau đang chạy đồng thời thành một lời gọi Gemini
+        self.single_flight = gemini_single_flight
+
+    def _generate_cached(self, prompt: str, bypass_cache: bool = False, endpoint: str = 'default') -> str:
+        """
+        Gọi Gemini có cache theo hash của prompt
+
+        Các request đồng thời cùng prompt (cache miss) được gộp thành một lời gọi Gemini.
+
+        Args:
+            prompt: Prompt gửi tới Gemini
+            bypass_cache: True = bỏ qua cache, luôn gọi Gemini (kết quả mới vẫn được lưu lại)
+            endpoint: Tên loại lời gọi (để chọn ngân sách độ trễ)
+
+        Returns:
+            Response text từ Gemini (hoặc từ cache)
+        """
+        key = make_prompt_key(prompt, self.model_name)
+
+        if bypass_cache:
+            self.cache.record_bypass()
+        else:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        def call_and_store() -> str:
+            # Lỗi được ném ra cho caller xử lý như trước, không cache lỗi
+            text = self.generate(prompt, endpoint=endpoint)
+            self.cache.set(key, text)
+            return text
+
+        return self.single_flight.do(key, call_and_store)
+
+    def generate(self, prompt: str, endpoint: str = 'default') -> str:
+        """
+        Gọi Gemini (không cache) qua LLM client dùng chung
+
+        Args:
+            prompt: Prompt gửi tới Gemini
+            endpoint: Tên loại lời gọi (để chọn ngân sách độ trễ)
+
+        Returns:
+            Response text từ Gemini
+
+        Raises:
+            CircuitOpenError: Gemini đang lỗi liên tục, lời gọi bị từ chối ngay
+            LLMTimeoutError: Gemini phản hồi quá ngân sách độ trễ của endpoint
+        """
+        return self.client.generate(prompt, endpoint=endpoint)
+
     def analyze_credit_risk(self, prediction_data: Dict[str, Any]) -> str:
         """
         Phân tích kết quả dự báo rủi ro tín dụng bằng Gemini
@@ -42,15 +100,18 @@ class GeminiAnalyzer:
         prompt = self._create_analysis_prompt(prediction_data)
 
         try:
-            # Gọi Gemini API với self.model
-            response = self.model.generate_content(prompt)
-            result = response.text
-            return result
+            # Gọi Gemini API qua LLM client dùng chung
+            analysis = self.generate(prompt, endpoint='analyze_credit_risk')
+
+            # Luôn gọi mới cho /analyze, nhưng lưu lại để xuất báo cáo hàng loạt dùng lại
+            self.cache.set(make_prompt_key(prompt, self.model_name), analysis)
+            return analysis
 
         except Exception as e:
             return f"❌ Lỗi khi gọi Gemini API: {str(e)}"
 
-    def _create_analysis_prompt(self, data: Dict[str, Any]) -> str:
+    @staticmethod
+    def _create_analysis_prompt(data: Dict[str, Any]) -> str:
         """
         Tạo prompt chi tiết để gửi tới Gemini
 
@@ -165,13 +226,14 @@ Hãy trình bày rõ ràng, dễ hiểu, có cấu trúc. Tối đa 500 từ.
 
         return prompt
 
-    def fetch_industry_data(self, industry: str, industry_name: str) -> Dict[str, Any]:
+    def fetch_industry_data(self, industry: str, industry_name: str, bypass_cache: bool = False) -> Dict[str, Any]:
         """
         Lấy dữ liệu ngành nghề mới nhất từ AI
 
         Args:
             industry: Mã ngành
             industry_name: Tên ngành đầy đủ
+            bypass_cache: True = bỏ qua cache, luôn gọi Gemini
 
         Returns:
             Dict chứa dữ liệu ngành nghề
@@ -233,18 +295,11 @@ Ví dụ format JSON:
 }}
 """
         try:
-            response = self.model.generate_content(prompt)
-            data_text = response.text
-
-            # Parse JSON từ response
-            import json
-            import re
-
-            # Tìm JSON block trong response
-            json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', data_text, re.DOTALL)
-            if json_match:
-                data = json.loads(json_match.group(0))
-            else:
+            data_text = self._generate_cached(prompt, bypass_cache=bypass_cache, endpoint='fetch_industry_data')
+
+            # Tìm JSON block trong response (quét cân bằng ngoặc, hỗ trợ lồng nhiều tầng)
+            data = extract_json_object(data_text)
+            if data is None:
                 # Nếu không tìm thấy JSON, tạo dữ liệu mẫu
                 data = self._generate_sample_data(industry_name)
 
@@ -289,7 +344,13 @@ Ví dụ format JSON:
             }
         }
 
-    def generate_charts_data(self, industry: str, industry_name: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    def generate_charts_data(
+        self,
+        industry: str,
+        industry_name: str,
+        data: Dict[str, Any],
+        bypass_cache: bool = False
+    ) -> Dict[str, Any]:
         """
         Tạo config biểu đồ ECharts từ dữ liệu và phân tích sơ bộ
 
@@ -297,6 +358,7 @@ Ví dụ format JSON:
             industry: Mã ngành
             industry_name: Tên ngành
             data: Dữ liệu ngành từ fetch_industry_data
+            bypass_cache: True = bỏ qua cache, luôn gọi Gemini
 
         Returns:
             Dict chứa charts_data (ECharts config) và brief_analysis
@@ -381,8 +443,7 @@ Trình bày ngắn gọn, súc tích, dễ hiểu.
 """
 
         try:
-            response = self.model.generate_content(prompt)
-            brief_analysis = response.text
+            brief_analysis = self._generate_cached(prompt, bypass_cache=bypass_cache, endpoint='generate_charts_data')
         except Exception as e:
             brief_analysis = f"Không thể tạo phân tích sơ bộ. Lỗi: {str(e)}"
 
@@ -392,7 +453,14 @@ Trình bày ngắn gọn, súc tích, dễ hiểu.
             "brief_analysis": brief_analysis
         }
 
-    def deep_analyze_industry(self, industry: str, industry_name: str, data: Dict[str, Any], brief_analysis: str) -> str:
+    def deep_analyze_industry(
+        self,
+        industry: str,
+        industry_name: str,
+        data: Dict[str, Any],
+        brief_analysis: str,
+        bypass_cache: bool = False
+    ) -> str:
         """
         Phân tích sâu ảnh hưởng của ngành đến quyết định cho vay
 
@@ -401,6 +469,7 @@ Trình bày ngắn gọn, súc tích, dễ hiểu.
             industry_name: Tên ngành
             data: Dữ liệu ngành
             brief_analysis: Phân tích sơ bộ
+            bypass_cache: True = bỏ qua cache, luôn gọi Gemini
 
         Returns:
             Phân tích sâu về ảnh hưởng đến quyết định tín dụng
@@ -446,8 +515,7 @@ Trả lời bằng tiếng Việt, chuyên nghiệp.
 """
 
         try:
-            response = self.model.generate_content(prompt)
-            return response.text
+            return self._generate_cached(prompt, bypass_cache=bypass_cache, endpoint='deep_analyze_industry')
         except Exception as e:
             return f"❌ Lỗi khi phân tích sâu: {str(e)}"
 
@@ -527,18 +595,18 @@ Trả lời bằng tiếng Việt, chuyên nghiệp.
 """
 
         try:
-            response = self.model.generate_content(prompt)
-            return response.text
+            return self.generate(prompt, endpoint='analyze_pd_with_industry')
         except Exception as e:
             return f"❌ Lỗi khi phân tích PD kết hợp: {str(e)}"
 
-    def analyze_industry(self, industry: str, industry_name: str) -> Dict[str, Any]:
+    def analyze_industry(self, industry: str, industry_name: str, bypass_cache: bool = False) -> Dict[str, Any]:
         """
         Phân tích tình hình ngành nghề và tác động đến quyết định cho vay
 
         Args:
             industry: Mã ngành (e.g., 'agriculture', 'finance')
             industry_name: Tên ngành đầy đủ
+            bypass_cache: True = bỏ qua cache, luôn gọi Gemini
 
         Returns:
             Dict chứa phân tích và dữ liệu charts (nếu có)
@@ -588,8 +656,7 @@ Hãy trả lời bằng tiếng Việt, chuyên nghiệp và chi tiết.
 """
 
         try:
-            response = self.model.generate_content(prompt)
-            analysis = response.text
+            analysis = self._generate_cached(prompt, bypass_cache=bypass_cache, endpoint='analyze_industry')
 
             # Tạo dữ liệu charts giả (trong thực tế có thể lấy từ API thực)
             charts = [
@@ -756,9 +823,7 @@ Hãy trình bày rõ ràng, có cấu trúc, tập trung vào insight chiến l
 
         try:
             # Gọi Gemini API
-            response = self.model.generate_content(prompt)
-            result = response.text
-            return result
+            return self.generate(prompt, endpoint='analyze_scenario_simulation')
 
         except Exception as e:
             return f"❌ Lỗi khi phân tích kịch bản: {str(e)}"
@@ -782,3 +847,21 @@ def get_gemini_analyzer(api_key: str = None) -> GeminiAnalyzer:
     if gemini_analyzer is None:
         gemini_analyzer = GeminiAnalyzer(api_key)
     return gemini_analyzer
+
+
+def get_cached_credit_analysis(prediction_data: Dict[str, Any], model_name: str = None) -> Optional[str]:
+    """
+    Lấy phân tích rủi ro tín dụng đã có trong cache (không gọi Gemini)
+
+    Args:
+        prediction_data: Dữ liệu dự báo (cùng định dạng với analyze_credit_risk)
+        model_name: Tên model. None = model của analyzer hiện tại (hoặc model mặc định)
+
+    Returns:
+        Phân tích đã cache, None nếu chưa có
+    """
+    if model_name is None:
+        model_name = gemini_analyzer.model_name if gemini_analyzer is not None else DEFAULT_MODEL_NAME
+    prompt = GeminiAnalyzer._create_analysis_prompt(prediction_data)
+    # peek: tra cứu để xuất báo cáo không được tính vào hit/miss của cache prompt (/gemini-stats)
+    return gemini_cache.peek(make_prompt_key(prompt, model_name))
@@ -0,0 +1,258 @@
+"""
+Gemini Cache Module - Cache kết quả Gemini theo hash của prompt
+Dùng cho các prompt mang tính xác định (phân tích ngành) được nhiều cán bộ gọi lặp lại
+Hỗ trợ TTL, loại bỏ LRU và lưu bền vững tùy chọn bằng SQLite
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+
+# Dữ liệu ngành thay đổi theo ngày, không phải theo giây → TTL mặc định 24 giờ
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 512
+
+
+def make_prompt_key(prompt: str, model_name: str = "") -> str:
+    """
+    Tạo khóa cache từ prompt (SHA-256)
+
+    Args:
+        prompt: Nội dung prompt gửi tới Gemini
+        model_name: Tên model (để không dùng lẫn kết quả giữa các model)
+
+    Returns:
+        Chuỗi hex SHA-256
+    """
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(prompt.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class GeminiResponseCache:
+    """Cache LRU có TTL cho response text của Gemini, có thể lưu xuống SQLite"""
+
+    def __init__(
+        self,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        db_path: Optional[str] = None
+    ):
+        """
+        Khởi tạo cache
+
+        Args:
+            ttl_seconds: Thời gian sống của một entry (giây)
+            max_entries: Số entry tối đa giữ trong bộ nhớ (vượt quá sẽ loại LRU)
+            db_path: Đường dẫn file SQLite để lưu bền vững. None = chỉ lưu trong bộ nhớ
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.db_path = db_path
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, text)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypassed = 0
+
+        if self.db_path:
+            self._init_db()
+
+    # ------------------------------------------------------------------
+    # SQLite
+    # ------------------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def _init_db(self):
+        """Tạo bảng cache nếu chưa có"""
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS gemini_cache ("
+                " key TEXT PRIMARY KEY,"
+                " expires_at REAL NOT NULL,"
+                " response TEXT NOT NULL)"
+            )
+
+    def _db_get(self, key: str) -> Optional[tuple]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT expires_at, response FROM gemini_cache WHERE key = ?", (key,)
+            ).fetchone()
+        return row
+
+    def _db_put(self, key: str, expires_at: float, text: str):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO gemini_cache (key, expires_at, response) VALUES (?, ?, ?)",
+                (key, expires_at, text)
+            )
+
+    def _db_delete(self, key: Optional[str] = None):
+        with self._connect() as conn:
+            if key is None:
+                conn.execute("DELETE FROM gemini_cache")
+            else:
+                conn.execute("DELETE FROM gemini_cache WHERE key = ?", (key,))
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Lấy response đã cache
+
+        Args:
+            key: Khóa cache (từ make_prompt_key)
+
+        Returns:
+            Response text nếu còn hạn, None nếu không có hoặc đã hết hạn
+        """
+        return self._lookup(key, record_stats=True)
+
+    def peek(self, key: str) -> Optional[str]:
+        """
+        Lấy response đã cache mà không tính vào hit/miss (VD: xuất báo cáo hàng loạt chỉ dùng lại phân tích có sẵn,
+        không phải lần gọi Gemini nào được cache phục vụ)
+
+        Args:
+            key: Khóa cache (từ make_prompt_key)
+
+        Returns:
+            Response text nếu còn hạn, None nếu không có hoặc đã hết hạn
+        """
+        return self._lookup(key, record_stats=False)
+
+    def _lookup(self, key: str, record_stats: bool) -> Optional[str]:
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, text = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    if record_stats:
+                        self.hits += 1
+                    return text
+                del self._entries[key]
+
+        # Không có trong bộ nhớ → thử SQLite (ví dụ sau khi restart worker)
+        if self.db_path:
+            try:
+                row = self._db_get(key)
+            except sqlite3.Error:
+                row = None
+
+            if row is not None:
+                expires_at, text = row
+                if expires_at > now:
+                    with self._lock:
+                        self._store_locked(key, expires_at, text)
+                        if record_stats:
+                            self.hits += 1
+                    return text
+                try:
+                    self._db_delete(key)
+                except sqlite3.Error:
+                    pass
+
+        if record_stats:
+            with self._lock:
+                self.misses += 1
+        return None
+
+    def set(self, key: str, text: str):
+        """
+        Lưu response vào cache
+
+        Args:
+            key: Khóa cache
+            text: Response text từ Gemini
+        """
+        expires_at = time.time() + self.ttl_seconds
+
+        with self._lock:
+            self._store_locked(key, expires_at, text)
+
+        if self.db_path:
+            try:
+                self._db_put(key, expires_at, text)
+            except sqlite3.Error:
+                pass  # Lỗi ghi đĩa không được làm hỏng request
+
+    def _store_locked(self, key: str, expires_at: float, text: str):
+        """Ghi entry vào bộ nhớ và loại LRU nếu vượt giới hạn (phải giữ self._lock)"""
+        self._entries[key] = (expires_at, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def record_bypass(self):
+        """Ghi nhận một lần gọi bỏ qua cache"""
+        with self._lock:
+            self.bypassed += 1
+
+    def clear(self):
+        """Xóa toàn bộ cache (bộ nhớ và SQLite)"""
+        with self._lock:
+            self._entries.clear()
+
+        if self.db_path:
+            try:
+                self._db_delete()
+            except sqlite3.Error:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Thống kê cache
+
+        Returns:
+            Dict chứa số hit/miss, tỷ lệ hit, số entry hiện tại
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "bypassed": self.bypassed,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persistent": bool(self.db_path)
+            }
+
+
+def create_cache_from_env() -> GeminiResponseCache:
+    """
+    Tạo cache từ biến môi trường
+
+    - GEMINI_CACHE_TTL_SECONDS: TTL (mặc định 86400)
+    - GEMINI_CACHE_MAX_ENTRIES: Số entry tối đa (mặc định 512)
+    - GEMINI_CACHE_DB: Đường dẫn file SQLite (bỏ trống = chỉ lưu trong bộ nhớ)
+    """
+    return GeminiResponseCache(
+        ttl_seconds=float(os.getenv("GEMINI_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+        max_entries=int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+        db_path=os.getenv("GEMINI_CACHE_DB") or None
+    )
+
+
+# Khởi tạo instance global (dùng chung cho mọi GeminiAnalyzer, kể cả khi đổi API key)
+gemini_cache = create_cache_from_env()
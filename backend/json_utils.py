@@ -0,0 +1,94 @@
+"""
+JSON Utils Module - Trích xuất JSON từ response text của LLM
+Quét cân bằng ngoặc một lượt (có xử lý chuỗi và ký tự escape), thời gian tuyến tính theo độ dài text,
+thay cho regex chỉ hỗ trợ 2 tầng lồng nhau và có thể backtrack chậm trên response dài
+"""
+
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# Chỉ các ký tự này ảnh hưởng tới trạng thái quét → nhảy thẳng tới chúng thay vì duyệt từng ký tự
+_SIGNIFICANT_CHARS = re.compile(r'[{}"\\]')
+
+# Object JSON phải bắt đầu bằng '{' rồi tới key dạng chuỗi hoặc '}' (lọc nhanh "{tạm tính}" trong lời dẫn)
+_OBJECT_START = re.compile(r'\{\s*["}]')
+
+# Số lần json.loads tối đa trên các khối ứng viên (giữ tổng chi phí tuyến tính theo độ dài text)
+DEFAULT_MAX_ATTEMPTS = 32
+
+
+def _try_parse(text: str, span: Tuple[int, int]) -> Optional[Dict[str, Any]]:
+    """Parse text[start:end] thành dict, None nếu không hợp lệ"""
+    try:
+        data = json.loads(text[span[0]:span[1]])
+    except (ValueError, RecursionError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def extract_json_object(text: str, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> Optional[Dict[str, Any]]:
+    """
+    Lấy object JSON hợp lệ đầu tiên (ngoài cùng) trong response text
+    Bỏ qua markdown, lời dẫn, code fence và các ngoặc '{' lẻ không bao giờ đóng
+
+    Args:
+        text: Response text từ LLM
+        max_attempts: Số khối ứng viên tối đa được parse
+
+    Returns:
+        Dict đã parse, None nếu không tìm thấy object JSON hợp lệ
+    """
+    if not text or '{' not in text:
+        return None
+
+    attempts = 0
+    open_positions: List[int] = []      # Vị trí các '{' đang mở
+    nested: List[Tuple[int, int]] = []  # Khối con đã đóng nhưng khối bao ngoài chưa đóng
+    in_string = False
+    escaped_index = -1
+
+    def try_candidates(candidates) -> Optional[Dict[str, Any]]:
+        nonlocal attempts
+        # Sắp theo vị trí bắt đầu → khối ngoài được thử trước khối con của nó
+        for span in sorted(candidates):
+            if attempts >= max_attempts:
+                return None
+            if not _OBJECT_START.match(text, span[0]):
+                continue
+            attempts += 1
+            data = _try_parse(text, span)
+            if data is not None:
+                return data
+        return None
+
+    for match in _SIGNIFICANT_CHARS.finditer(text):
+        index = match.start()
+        if index == escaped_index:
+            continue
+
+        char = match.group()
+        if in_string:
+            if char == '\\':
+                escaped_index = index + 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            # Dấu nháy trong lời dẫn (ngoài mọi ngoặc) không mở chuỗi JSON
+            in_string = bool(open_positions)
+        elif char == '{':
+            open_positions.append(index)
+        elif char == '}' and open_positions:
+            span = (open_positions.pop(), index + 1)
+            if open_positions:
+                nested.append(span)
+                continue
+
+            # Khối ngoài cùng vừa cân bằng: thử nó trước, rồi tới các khối con
+            data = try_candidates([span] + nested)
+            if data is not None or attempts >= max_attempts:
+                return data
+            nested = []
+
+    # Hết text mà còn '{' chưa đóng: các khối con đã cân bằng bên trong vẫn có thể là JSON hợp lệ
+    return try_candidates(nested)
@@ -0,0 +1,532 @@
+"""
+LLM Client Module - Client LLM dùng chung cho toàn bộ backend
+Cấu hình Gemini một lần, tái sử dụng GenerativeModel (và kết nối bên dưới) cho mọi request,
+giới hạn số lời gọi đồng thời và cho phép thay backend (VD: backend giả lập cho load test).
+Mọi lời gọi có ngân sách độ trễ theo endpoint và đi qua circuit breaker: khi Gemini chậm/lỗi
+liên tục, lời gọi bị từ chối ngay để caller chuyển sang dữ liệu/báo cáo fallback.
+"""
+
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, Optional
+from dotenv import load_dotenv
+from metrics import timed_stage
+from tracing import set_span_attribute
+
+load_dotenv()
+
+DEFAULT_MODEL_NAME = 'gemini-2.0-flash'
+DEFAULT_MAX_CONCURRENCY = 8
+
+# Ngân sách độ trễ (giây) cho từng loại lời gọi. Vượt ngân sách = lỗi, caller dùng fallback.
+# Ghi đè bằng LLM_LATENCY_BUDGETS="early_warning_diagnosis=10,fetch_industry_data=15"
+DEFAULT_LATENCY_BUDGET_SECONDS = 30.0
+DEFAULT_LATENCY_BUDGETS = {
+    'analyze_credit_risk': 30.0,
+    'fetch_industry_data': 20.0,
+    'generate_charts_data': 20.0,
+    'deep_analyze_industry': 30.0,
+    'analyze_pd_with_industry': 30.0,
+    'analyze_industry': 30.0,
+    'analyze_scenario_simulation': 30.0,
+    'analyze_macro': 30.0,
+    'chat_assistant': 20.0,
+    'early_warning_diagnosis': 15.0,
+    'anomaly_explanation': 15.0,
+}
+
+
+class LLMUnavailableError(RuntimeError):
+    """LLM không sẵn sàng (circuit mở hoặc vượt ngân sách độ trễ)"""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """Circuit breaker đang mở, lời gọi bị từ chối ngay"""
+
+
+class LLMTimeoutError(LLMUnavailableError):
+    """Lời gọi LLM vượt ngân sách độ trễ"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker theo tỷ lệ lỗi trong cửa sổ thời gian trượt
+
+    - CLOSED: cho phép mọi lời gọi, theo dõi tỷ lệ lỗi
+    - OPEN: từ chối ngay trong cooldown_seconds
+    - HALF_OPEN: cho phép một lời gọi thử; thành công → CLOSED, thất bại → OPEN
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(
+        self,
+        window_seconds: float = 60.0,
+        min_calls: int = 5,
+        error_rate_threshold: float = 0.5,
+        cooldown_seconds: float = 30.0
+    ):
+        """
+        Khởi tạo circuit breaker
+
+        Args:
+            window_seconds: Độ dài cửa sổ trượt để tính tỷ lệ lỗi
+            min_calls: Số lời gọi tối thiểu trong cửa sổ trước khi xét mở circuit
+            error_rate_threshold: Tỷ lệ lỗi (0-1) để mở circuit
+            cooldown_seconds: Thời gian circuit mở trước khi thử lại
+        """
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.cooldown_seconds = cooldown_seconds
+
+        self.state = self.CLOSED
+        self._outcomes = deque()  # (timestamp, thành công?)
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+        self.times_opened = 0
+        self.rejected = 0
+
+    def _prune(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+
+    def allow_request(self) -> bool:
+        """Kiểm tra lời gọi có được phép thực hiện không"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown_seconds:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        """Ghi nhận lời gọi thành công"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.CLOSED
+                self._outcomes.clear()
+                self._probe_in_flight = False
+            now = time.monotonic()
+            self._outcomes.append((now, True))
+            self._prune(now)
+
+    def record_failure(self):
+        """Ghi nhận lời gọi thất bại (lỗi hoặc vượt ngân sách độ trễ)"""
+        with self._lock:
+            now = time.monotonic()
+
+            if self.state == self.HALF_OPEN:
+                self._open(now)
+                return
+
+            self._outcomes.append((now, False))
+            self._prune(now)
+
+            if self.state == self.CLOSED and len(self._outcomes) >= self.min_calls:
+                failures = sum(1 for _, ok in self._outcomes if not ok)
+                if failures / len(self._outcomes) >= self.error_rate_threshold:
+                    self._open(now)
+
+    def _open(self, now: float):
+        self.state = self.OPEN
+        self._opened_at = now
+        self._probe_in_flight = False
+        self._outcomes.clear()
+        self.times_opened += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê circuit breaker"""
+        with self._lock:
+            self._prune(time.monotonic())
+            calls = len(self._outcomes)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            return {
+                "state": self.state,
+                "window_calls": calls,
+                "window_error_rate": round(failures / calls, 4) if calls else 0.0,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected
+            }
+
+
+def _latency_budgets_from_env() -> Dict[str, float]:
+    """Đọc ngân sách độ trễ từ LLM_LATENCY_BUDGET_SECONDS và LLM_LATENCY_BUDGETS"""
+    budgets = dict(DEFAULT_LATENCY_BUDGETS)
+    for item in os.getenv("LLM_LATENCY_BUDGETS", "").split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            budgets[name.strip()] = float(value)
+    return budgets
+
+
+class GeminiBackend:
+    """Backend gọi Google Gemini thật"""
+
+    def __init__(self, api_key: str, model_name: str = DEFAULT_MODEL_NAME):
+        """
+        Khởi tạo backend Gemini (configure + tạo GenerativeModel đúng một lần)
+
+        Args:
+            api_key: API key của Google Gemini
+            model_name: Tên model Gemini
+        """
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.api_key = api_key
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt: str) -> str:
+        """Gọi Gemini và trả về response text"""
+        response = self.model.generate_content(prompt)
+        return response.text
+
+
+class FakeLLMBackend:
+    """Backend giả lập (không gọi mạng) dùng cho load test và chạy offline"""
+
+    DEFAULT_RESPONSE = (
+        "## Phân tích (giả lập)\n"
+        "Đây là response giả lập từ FakeLLMBackend.\n"
+        '{"growth": {"gdp_growth": [3.5, 4.2, 5.1, 6.0, 5.8], "years": [2020, 2021, 2022, 2023, 2024], '
+        '"revenue_growth": 5.5, "market_size_usd": 50.2}, '
+        '"financial": {"roe": 12.5, "roa": 8.2, "gross_margin": 25.3, "debt_ratio": 45.6}, '
+        '"credit_risk": {"npl_rates": [2.1, 2.0, 1.8, 1.5, 1.4], "default_rate": 1.2, "risk_rating": "Trung bình"}, '
+        '"other": {"num_companies": 15000, "market_concentration": "Phân tán", "price_trend": "Tăng nhẹ"}}'
+    )
+
+    def __init__(
+        self,
+        latency_seconds: float = 0.0,
+        error_rate: float = 0.0,
+        response_text: Optional[str] = None,
+        seed: Optional[int] = None
+    ):
+        """
+        Khởi tạo backend giả lập
+
+        Args:
+            latency_seconds: Độ trễ giả lập cho mỗi lời gọi (giây)
+            error_rate: Tỷ lệ lời gọi bị lỗi (0-1)
+            response_text: Nội dung trả về. None = dùng response mẫu (có JSON dữ liệu ngành)
+            seed: Seed cho bộ sinh ngẫu nhiên (để tái lập lỗi)
+        """
+        self.api_key = None
+        self.model_name = 'fake-llm'
+        self.latency_seconds = latency_seconds
+        self.error_rate = error_rate
+        self.response_text = response_text or self.DEFAULT_RESPONSE
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def generate(self, prompt: str) -> str:
+        """Giả lập một lời gọi LLM"""
+        if self.latency_seconds > 0:
+            time.sleep(self.latency_seconds)
+
+        with self._random_lock:
+            failed = self._random.random() < self.error_rate
+        if failed:
+            raise RuntimeError("FakeLLMBackend: lỗi giả lập")
+
+        return self.response_text
+
+
+class LLMClient:
+    """Client LLM dùng chung: giới hạn đồng thời và đo thời gian mọi lời gọi tại một chỗ"""
+
+    def __init__(
+        self,
+        backend,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        latency_budgets: Optional[Dict[str, float]] = None,
+        default_budget_seconds: float = DEFAULT_LATENCY_BUDGET_SECONDS
+    ):
+        """
+        Khởi tạo client
+
+        Args:
+            backend: Đối tượng có phương thức generate(prompt) -> str và thuộc tính model_name
+            max_concurrency: Số lời gọi LLM đồng thời tối đa
+            circuit_breaker: Circuit breaker dùng chung cho mọi lời gọi. None = tạo mới
+            latency_budgets: Ngân sách độ trễ (giây) theo endpoint
+            default_budget_seconds: Ngân sách cho endpoint không có trong latency_budgets
+        """
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.latency_budgets = latency_budgets if latency_budgets is not None else dict(DEFAULT_LATENCY_BUDGETS)
+        self.default_budget_seconds = default_budget_seconds
+
+        # Slot chỉ được trả khi lời gọi thật sự kết thúc (kể cả lời gọi đã bị timeout),
+        # nên số lời gọi đang treo không bao giờ vượt max_concurrency
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.in_flight = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.total_wait_seconds = 0.0
+
+    @property
+    def model_name(self) -> str:
+        return self.backend.model_name
+
+    @property
+    def api_key(self) -> Optional[str]:
+        return self.backend.api_key
+
+    def budget_for(self, endpoint: str) -> float:
+        """Ngân sách độ trễ (giây) của endpoint"""
+        return self.latency_budgets.get(endpoint, self.default_budget_seconds)
+
+    @timed_stage('llm')
+    def generate(self, prompt: str, endpoint: str = 'default', timeout: Optional[float] = None) -> str:
+        """
+        Gọi LLM qua backend hiện tại
+
+        Args:
+            prompt: Prompt gửi tới LLM
+            endpoint: Tên loại lời gọi (để chọn ngân sách độ trễ)
+            timeout: Ngân sách độ trễ (giây). None = theo endpoint
+
+        Returns:
+            Response text
+
+        Raises:
+            CircuitOpenError: Circuit đang mở, không gọi LLM
+            LLMTimeoutError: Vượt ngân sách độ trễ
+            Exception: Lỗi từ backend được ném lại cho caller xử lý (fallback)
+        """
+        set_span_attribute("llm.endpoint", endpoint)
+
+        if not self.circuit_breaker.allow_request():
+            raise CircuitOpenError("Gemini tạm thời không khả dụng (circuit breaker đang mở)")
+
+        budget = timeout if timeout is not None else self.budget_for(endpoint)
+        deadline = time.perf_counter() + budget
+
+        wait_start = time.perf_counter()
+        if not self._semaphore.acquire(timeout=budget):
+            # Hết slot do các lời gọi đang treo → coi như Gemini chậm
+            with self._lock:
+                self.timeouts += 1
+            self.circuit_breaker.record_failure()
+            raise LLMTimeoutError(f"Không có slot gọi Gemini trong {budget:.0f}s ({endpoint})")
+
+        start = time.perf_counter()
+        with self._lock:
+            self.in_flight += 1
+            self.total_wait_seconds += start - wait_start
+
+        try:
+            future = self._executor.submit(self.backend.generate, prompt)
+        except Exception:
+            # VD: executor đã shutdown. Phải báo breaker, nếu không lượt thử half-open bị giữ mãi (_probe_in_flight)
+            self._release_slot(start, failed=True)
+            self.circuit_breaker.record_failure()
+            raise
+        future.add_done_callback(
+            lambda f: self._release_slot(start, failed=f.cancelled() or f.exception() is not None)
+        )
+
+        try:
+            result = future.result(timeout=max(0.0, deadline - time.perf_counter()))
+        except FutureTimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            self.circuit_breaker.record_failure()
+            raise LLMTimeoutError(f"Gemini phản hồi quá {budget:.0f}s ({endpoint})")
+        except Exception:
+            self.circuit_breaker.record_failure()
+            raise
+
+        self.circuit_breaker.record_success()
+        return result
+
+    def _release_slot(self, start: float, failed: bool):
+        """Trả slot và ghi nhận thời gian khi lời gọi backend kết thúc"""
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.in_flight -= 1
+            self.calls += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+            if failed:
+                self.errors += 1
+        self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Thống kê các lời gọi LLM
+
+        Returns:
+            Dict chứa số lời gọi, lỗi, thời gian trung bình/tối đa, thời gian chờ slot
+        """
+        with self._lock:
+            return {
+                "backend": type(self.backend).__name__,
+                "model_name": self.model_name,
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "calls": self.calls,
+                "errors": self.errors,
+                "timeouts": self.timeouts,
+                "avg_seconds": round(self.total_seconds / self.calls, 4) if self.calls else 0.0,
+                "max_seconds": round(self.max_seconds, 4),
+                "total_wait_seconds": round(self.total_wait_seconds, 4),
+                "circuit_breaker": self.circuit_breaker.stats()
+            }
+
+
+# Khởi tạo instance global
+_llm_client: Optional[LLMClient] = None
+_injected = False
+_client_lock = threading.Lock()
+
+
+def _max_concurrency_from_env() -> int:
+    return int(os.getenv("LLM_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+
+
+def _create_client(backend, max_concurrency: int = None) -> LLMClient:
+    """Tạo LLMClient với cấu hình circuit breaker và ngân sách độ trễ từ biến môi trường"""
+    circuit_breaker = CircuitBreaker(
+        window_seconds=float(os.getenv("LLM_CIRCUIT_WINDOW_SECONDS", 60)),
+        min_calls=int(os.getenv("LLM_CIRCUIT_MIN_CALLS", 5)),
+        error_rate_threshold=float(os.getenv("LLM_CIRCUIT_ERROR_RATE", 0.5)),
+        cooldown_seconds=float(os.getenv("LLM_CIRCUIT_COOLDOWN_SECONDS", 30))
+    )
+    return LLMClient(
+        backend,
+        max_concurrency=max_concurrency or _max_concurrency_from_env(),
+        circuit_breaker=circuit_breaker,
+        latency_budgets=_latency_budgets_from_env(),
+        default_budget_seconds=float(os.getenv("LLM_LATENCY_BUDGET_SECONDS", DEFAULT_LATENCY_BUDGET_SECONDS))
+    )
+
+
+def _fake_backend_from_env() -> FakeLLMBackend:
+    """Tạo backend giả lập từ biến môi trường LLM_FAKE_LATENCY_MS, LLM_FAKE_ERROR_RATE"""
+    return FakeLLMBackend(
+        latency_seconds=float(os.getenv("LLM_FAKE_LATENCY_MS", 0)) / 1000,
+        error_rate=float(os.getenv("LLM_FAKE_ERROR_RATE", 0))
+    )
+
+
+def is_llm_available(api_key: str = None) -> bool:
+    """
+    Kiểm tra có thể gọi LLM hay không (có API key hoặc đang dùng backend giả lập/được inject)
+
+    Args:
+        api_key: API key của Gemini
+    """
+    return bool(
+        _injected
+        or os.getenv("LLM_BACKEND", "gemini").lower() == "fake"
+        or api_key
+        or os.getenv("GEMINI_API_KEY")
+    )
+
+
+def _swap_client(client: Optional[LLMClient]):
+    """
+    Thay client dùng chung và shutdown executor của client cũ (gọi khi đang giữ _client_lock)
+
+    Lời gọi đã submit vẫn chạy xong (wait=False không hủy). Lời gọi chưa submit trên client cũ nhận lỗi
+    và được tính là thất bại như các lỗi backend khác
+    """
+    global _llm_client
+
+    old, _llm_client = _llm_client, client
+    if old is not None and old is not client:
+        old._executor.shutdown(wait=False)
+
+
+def get_llm_client(api_key: str = None) -> LLMClient:
+    """
+    Lấy LLMClient dùng chung (singleton pattern)
+
+    Gemini chỉ được configure lại khi API key thay đổi (VD: qua /set-gemini-key).
+    Đặt LLM_BACKEND=fake để dùng backend giả lập.
+
+    Args:
+        api_key: API key của Gemini. Nếu không truyền, sẽ lấy từ biến môi trường GEMINI_API_KEY
+
+    Returns:
+        LLMClient instance
+    """
+    with _client_lock:
+        if _injected and _llm_client is not None:
+            return _llm_client
+
+        if os.getenv("LLM_BACKEND", "gemini").lower() == "fake":
+            if _llm_client is None or not isinstance(_llm_client.backend, FakeLLMBackend):
+                _swap_client(_create_client(_fake_backend_from_env()))
+            return _llm_client
+
+        api_key = api_key or os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("Không tìm thấy GEMINI_API_KEY. Vui lòng cung cấp API key hoặc set biến môi trường.")
+
+        if _llm_client is None or _llm_client.api_key != api_key:
+            _swap_client(_create_client(GeminiBackend(api_key)))
+
+        return _llm_client
+
+
+def set_llm_backend(backend, max_concurrency: int = None) -> LLMClient:
+    """
+    Inject backend cho client dùng chung (VD: FakeLLMBackend cho load test)
+
+    Args:
+        backend: Backend có generate(prompt) -> str, model_name và api_key
+        max_concurrency: Số lời gọi đồng thời tối đa. None = lấy từ LLM_MAX_CONCURRENCY
+
+    Returns:
+        LLMClient mới
+    """
+    global _injected
+
+    with _client_lock:
+        _swap_client(_create_client(backend, max_concurrency))
+        _injected = True
+        return _llm_client
+
+
+def reset_llm_client():
+    """Bỏ backend đã inject, lần gọi get_llm_client() tiếp theo sẽ tạo lại client"""
+    global _injected
+
+    with _client_lock:
+        _swap_client(None)
+        _injected = False
+
+
+def get_llm_stats() -> Optional[Dict[str, Any]]:
+    """Thống kê của client hiện tại (None nếu chưa có lời gọi nào tạo client)"""
+    client = _llm_client
+    return client.stats() if client is not None else None
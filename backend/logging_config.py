@@ -0,0 +1,103 @@
+"""
+Logging Config Module - Cấu hình logging có cấu trúc cho toàn bộ backend
+- Logger riêng cho từng module (get_logger(__name__)), mức log theo LOG_LEVEL (mặc định INFO)
+- Ghi log qua QueueHandler: request chỉ đẩy record vào hàng đợi, một thread nền ghi ra stdout
+- LOG_FORMAT=json: mỗi dòng là một JSON (kèm request_id) cho log driver của container
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+# Request id của request đang xử lý (middleware gán, tự theo sang threadpool qua contextvars)
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+_listener = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Gắn request_id hiện tại vào mọi log record"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Định dạng log record thành một dòng JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+def setup_logging(level: str = None, log_format: str = None):
+    """
+    Cấu hình logging cho process (gọi một lần khi khởi động; gọi lại không có tác dụng)
+
+    Args:
+        level: Mức log (DEBUG/INFO/WARNING...). None = LOG_LEVEL (mặc định INFO)
+        log_format: 'json' hoặc 'text'. None = LOG_FORMAT (mặc định text)
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    log_format = (log_format or os.getenv("LOG_FORMAT", "text")).lower()
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if log_format == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)s [%(name)s] [%(request_id)s] %(message)s"
+        ))
+
+    # Filter đặt ở QueueHandler: request_id được lấy trong context của request, trước khi vào hàng đợi
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=False)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Ghi nốt các log còn trong hàng đợi và dừng thread ghi log"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Lấy logger cho module
+
+    Args:
+        name: Tên module (thường là __name__)
+
+    Returns:
+        logging.Logger
+    """
+    return logging.getLogger(name)
@@ -3,7 +3,7 @@ FastAPI Backend - Hệ thống Đánh giá Rủi ro Tín dụng
 Endpoints: /train, /predict, /predict-from-xlsx, /analyze, /export-report
 """
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request
 from dotenv import load_dotenv
 import os
 
@@ -11,19 +11,41 @@ load_dotenv()  # Tải các biến môi trường từ file .env
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from pydantic import BaseModel
 from typing import Dict, Any, Optional, List
 import pandas as pd
 import os
 import tempfile
+import asyncio
+import io
+import json
+import time
+import uuid
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from model import credit_model
+from model import credit_model, DEFAULT_BASE_PARAMS, MODEL_COLS, make_base_learner
 from gemini_api import get_gemini_analyzer
+from gemini_cache import gemini_cache
+from llm_client import get_llm_stats
+from single_flight import gemini_single_flight
 from excel_processor import excel_processor
 from report_generator import ReportGenerator
+from report_batch import stream_reports_zip, batch_filename, shutdown_pool
 from early_warning import early_warning_system
 from anomaly_detection import anomaly_system
+from model_state import snapshot
+from training_jobs import training_manager, update_credit_model, JobConflictError, MODEL_PATH
+from training_store import credit_store, labeled_store
+from expected_loss import evaluate_portfolio
+from metrics import http_requests_total, http_request_duration_seconds, render_metrics
+from logging_config import setup_logging, get_logger, request_id_var
+from tracing import start_trace, server_timing_header, span_collector
+
+# Logging có cấu trúc (LOG_LEVEL, LOG_FORMAT=json), ghi qua hàng đợi ở thread nền
+setup_logging()
+logger = get_logger(__name__)
 
 # Khởi tạo FastAPI app
 app = FastAPI(
@@ -56,6 +78,57 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Đếm request và đo thời gian xử lý theo endpoint (nhãn là route template, không phải URL thật)"""
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        http_requests_total.inc(method=request.method, path=path, status=status_code)
+        http_request_duration_seconds.observe(time.perf_counter() - start, method=request.method, path=path)
+
+
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    """Trace request (span cho từng bước xử lý) và trả về header Server-Timing"""
+    with start_trace(
+        f"{request.method} {request.url.path}",
+        request_id_var.get(),
+        **{"http.method": request.method, "http.target": request.url.path}
+    ) as trace:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if route is not None:
+            trace.root.name = f"{request.method} {route.path}"
+        trace.root.attributes["http.status_code"] = response.status_code
+
+    response.headers["Server-Timing"] = server_timing_header(trace)
+    # Cho phép frontend (khác origin) đọc Server-Timing qua Performance API
+    origin = request.headers.get("origin")
+    if origin in origins:
+        response.headers["Timing-Allow-Origin"] = origin
+    return response
+
+
+@app.middleware("http")
+async def assign_request_id(request: Request, call_next):
+    """Gán request id (lấy từ header X-Request-ID nếu có) cho log của request và trả lại trong response"""
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        request_id_var.reset(token)
+
+
 # ================================================================================================
 # PYDANTIC MODELS
 # ================================================================================================
@@ -97,52 +170,308 @@ async def root():
     }
 
 
+async def run_training_job(kind: str, background: bool, *args: Any):
+    """
+    Chạy job huấn luyện trên process riêng
+
+    Args:
+        kind: Loại job ('credit', 'credit_append', 'early_warning', 'anomaly', 'tune')
+        background: True = trả về job_id ngay (202), False = chờ job xong (không chặn event loop)
+        *args: Dữ liệu huấn luyện của job
+
+    Returns:
+        JSONResponse 202 (background) hoặc kết quả huấn luyện
+    """
+    try:
+        job = training_manager.submit(kind, *args)
+    except JobConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except BrokenProcessPool:
+        raise HTTPException(
+            status_code=503,
+            detail="Process huấn luyện vừa bị lỗi và đã được khởi tạo lại. Vui lòng gửi lại yêu cầu."
+        )
+
+    if background:
+        return JSONResponse(status_code=202, content={
+            "status": "accepted",
+            "job_id": job.job_id,
+            "status_url": f"/training-jobs/{job.job_id}"
+        })
+
+    return await asyncio.wrap_future(job.future)
+
+
 @app.post("/train")
-async def train_model(file: UploadFile = File(...)):
+async def train_model(
+    file: Optional[UploadFile] = File(None),
+    base_params_json: Optional[str] = Form(None),
+    background: bool = False,
+    data_version: Optional[int] = None
+):
     """
     Endpoint huấn luyện mô hình từ file CSV
 
     Args:
-        file: File CSV chứa dữ liệu huấn luyện (phải có cột X_1 đến X_14 và cột 'default')
+        file: File CSV chứa dữ liệu huấn luyện (phải có cột X_1 đến X_14 và cột 'default').
+              Bỏ trống = huấn luyện lại trên kho dữ liệu đã lưu (GET /training-data)
+        base_params_json: JSON siêu tham số cho base models (VD: base_params của một điểm trong kết quả /tune) - Optional
+        background: True = trả về job_id ngay, theo dõi tiến độ tại /training-jobs/{job_id}
+        data_version: Phiên bản dữ liệu khi không upload file (bỏ trống = mới nhất)
 
     Returns:
-        Dict chứa thông tin huấn luyện và metrics
+        Dict chứa thông tin huấn luyện và metrics (hoặc job_id nếu background=true)
+    """
+    try:
+        base_params = parse_base_params(base_params_json)
+
+        if file is None:
+            # Không upload: đọc trực tiếp từ kho (memory-map, giữ cách chia train/test của phiên bản)
+            data_version = credit_store.resolve_version(data_version)
+            tmp_file_path = None
+        else:
+            # Kiểm tra file extension
+            if not file.filename.endswith('.csv'):
+                raise HTTPException(status_code=400, detail="File phải có định dạng CSV")
+
+            # Lưu file tạm (process huấn luyện xóa file khi xong)
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp_file:
+                content = await file.read()
+                tmp_file.write(content)
+                tmp_file_path = tmp_file.name
+
+        # Huấn luyện trên process riêng, mô hình được lưu ra MODEL_PATH và nạp vào credit_model khi xong
+        response = await run_training_job('credit', background, tmp_file_path, base_params, data_version)
+        if background:
+            return response
+
+        result, _ = response
+        return result
+
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi huấn luyện mô hình: {str(e)}")
+
+
+@app.post("/train-append")
+async def train_append(
+    file: UploadFile = File(...),
+    extra_trees: Optional[int] = Form(None),
+    extra_rounds: Optional[int] = Form(None),
+    background: bool = False
+):
+    """
+    Endpoint huấn luyện tiếp mô hình PD với các dòng có nhãn mới (warm start, không fit lại từ đầu)
+
+    Args:
+        file: File CSV chỉ gồm các dòng mới (X_1 đến X_14 và cột 'default')
+        extra_trees: Số cây Random Forest thêm (bỏ trống = theo tỷ lệ dòng mới)
+        extra_rounds: Số vòng boosting XGBoost thêm (bỏ trống = theo tỷ lệ dòng mới)
+        background: True = trả về job_id ngay, theo dõi tiến độ tại /training-jobs/{job_id}
+
+    Returns:
+        Dict chứa metrics mới, drift so với phiên bản trước và data_version (hoặc job_id nếu background=true)
     """
     try:
-        # Kiểm tra file extension
         if not file.filename.endswith('.csv'):
             raise HTTPException(status_code=400, detail="File phải có định dạng CSV")
+        for name, value in (('extra_trees', extra_trees), ('extra_rounds', extra_rounds)):
+            if value is not None and not 1 <= value <= 1000:
+                raise HTTPException(status_code=400, detail=f"{name} phải nằm trong khoảng 1-1000")
+        if not os.path.exists(MODEL_PATH):
+            raise HTTPException(
+                status_code=400,
+                detail="Mô hình chưa được huấn luyện. Vui lòng upload file CSV để huấn luyện trước."
+            )
 
-        # Lưu file tạm
         with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
+            tmp_file.write(await file.read())
             tmp_file_path = tmp_file.name
 
-        # Huấn luyện mô hình
-        result = credit_model.train(tmp_file_path)
+        # Job nạp mô hình từ MODEL_PATH, huấn luyện tiếp rồi lưu lại và thay credit_model khi xong
+        response = await run_training_job('credit_append', background, tmp_file_path, extra_trees, extra_rounds)
+        if background:
+            return response
+
+        result, _ = response
+        return result
+
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi huấn luyện tiếp mô hình: {str(e)}")
 
-        # Lưu mô hình
-        credit_model.save_model("model_stacking.pkl")
 
-        # Xóa file tạm
-        os.unlink(tmp_file_path)
+def parse_base_params(base_params_json: Optional[str]) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Đọc và kiểm tra JSON siêu tham số base models
 
-        return result
+    Args:
+        base_params_json: JSON dạng {"xgboost": {"max_depth": 4}, ...} hoặc None
 
+    Returns:
+        Dict siêu tham số (None nếu không truyền)
+    """
+    if not base_params_json:
+        return None
+    try:
+        base_params = json.loads(base_params_json)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="base_params_json không phải JSON hợp lệ")
+
+    unknown = [name for name in base_params if name not in DEFAULT_BASE_PARAMS] if isinstance(base_params, dict) else None
+    if unknown is None or not all(isinstance(value, dict) for value in base_params.values()):
+        raise HTTPException(status_code=400, detail="base_params_json phải có dạng {\"tên base model\": {siêu tham số}}")
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Không có base model: {', '.join(unknown)}. Các base model: {', '.join(DEFAULT_BASE_PARAMS)}"
+        )
+    try:
+        # Kiểm tra tên/giá trị siêu tham số ngay (lỗi 400 thay vì job thất bại)
+        for name, params in base_params.items():
+            make_base_learner(name, params).get_params()
+    except TypeError as e:
+        raise HTTPException(status_code=400, detail=f"Siêu tham số không hợp lệ: {str(e)}")
+    return base_params
+
+
+@app.post("/tune")
+async def tune_hyperparameters(file: UploadFile = File(...), n_iter: int = Form(8)):
+    """
+    Endpoint tìm siêu tham số cho 3 base models (random search song song, job chạy nền)
+
+    Args:
+        file: File CSV huấn luyện (X_1 → X_14 + 'default')
+        n_iter: Số bộ siêu tham số ngẫu nhiên cho mỗi base model (ngoài bộ mặc định)
+
+    Returns:
+        job_id (HTTP 202). Kết quả tại /training-jobs/{job_id}:
+        - pareto_front: Các stack tốt nhất theo AUC (OOF) - độ trễ dự báo, kèm base_params và meta_C
+        - best_auc, default: Stack AUC cao nhất và stack với siêu tham số hiện tại
+        - base_learners: AUC/độ trễ từng ứng viên
+    """
+    if not file.filename.endswith('.csv'):
+        raise HTTPException(status_code=400, detail="File phải có định dạng CSV")
+    if not 1 <= n_iter <= 50:
+        raise HTTPException(status_code=400, detail="n_iter phải nằm trong khoảng 1-50")
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp_file:
+        tmp_file.write(await file.read())
+        tmp_file_path = tmp_file.name
+
+    return await run_training_job('tune', True, tmp_file_path, n_iter)
+
+
+async def run_credit_update(method: str, *args: Any):
+    """
+    Cập nhật nhanh mô hình PD (dùng dự báo OOF đã lưu) như một job nhóm 'credit':
+    409 khi đang huấn luyện mô hình PD; cập nhật trên bản sao, lưu file rồi publish như job huấn luyện
+
+    Args:
+        method: Tên phương thức của CreditRiskModel ('refit_meta', 'recalibrate_threshold')
+        *args: Tham số của phương thức
+
+    Returns:
+        Kết quả của phương thức
+    """
+    try:
+        return await run_in_threadpool(training_manager.run_inline, 'credit_update', update_credit_model, method, *args)
+    except JobConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.post("/refit-meta")
+async def refit_meta_model(C: float = Form(1.0), class_weight: Optional[str] = Form(None)):
+    """
+    Fit lại riêng meta-model của Stacking trên dự báo OOF đã lưu khi huấn luyện (không fit lại base models)
+
+    Args:
+        C: Hệ số regularization của meta-model (VD: meta_C từ kết quả /tune)
+        class_weight: 'balanced' hoặc bỏ trống
+
+    Returns:
+        Dict chứa meta_params, metrics_train, metrics_test mới và elapsed_ms
+    """
+    if C <= 0:
+        raise HTTPException(status_code=400, detail="C phải lớn hơn 0")
+    if class_weight not in (None, '', 'balanced'):
+        raise HTTPException(status_code=400, detail="class_weight chỉ nhận 'balanced' hoặc bỏ trống")
+
+    try:
+        meta_params = {'C': C, 'class_weight': class_weight or None}
+        return await run_credit_update('refit_meta', meta_params)
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Lỗi khi huấn luyện mô hình: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Lỗi khi fit lại meta-model: {str(e)}")
+
+
+@app.post("/recalibrate-threshold")
+async def recalibrate_threshold(threshold: Optional[float] = Form(None)):
+    """
+    Đặt lại ngưỡng phân loại Default của /predict (mặc định 15%)
+
+    Args:
+        threshold: Ngưỡng mới (0-1). Bỏ trống = chọn ngưỡng F1 cao nhất trên PD Stacking out-of-fold
+
+    Returns:
+        Dict chứa threshold, method và precision/recall/F1 trên tập test theo ngưỡng mới
+    """
+    try:
+        return await run_credit_update('recalibrate_threshold', threshold)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi chọn lại ngưỡng: {str(e)}")
+
+
+@app.get("/training-jobs")
+async def list_training_jobs():
+    """
+    Danh sách các job huấn luyện gần nhất (mới nhất trước)
+
+    Returns:
+        Dict chứa danh sách job (trạng thái, tiến độ, kết quả/lỗi)
+    """
+    return {"jobs": training_manager.list_jobs()}
+
+
+@app.get("/training-jobs/{job_id}")
+async def get_training_job(job_id: str):
+    """
+    Trạng thái và tiến độ một job huấn luyện
+
+    Args:
+        job_id: Mã job trả về từ /train, /train-early-warning-model, /train-anomaly-model (background=true)
+
+    Returns:
+        Dict chứa status (queued/running/succeeded/failed), progress (0-100), message, result, error
+    """
+    job = training_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy job huấn luyện: {job_id}")
+    return job.to_dict()
 
 
 @app.post("/predict")
-async def predict(input_data: PredictionInput):
+async def predict(input_data: PredictionInput, explain: bool = False, top_k: int = 5):
     """
     Endpoint dự báo PD từ 14 chỉ số tài chính
 
     Args:
         input_data: Dict chứa 14 chỉ số X_1 đến X_14
+        explain: True = kèm đóng góp của từng chỉ số vào PD Stacking (explanation)
+        top_k: Số chỉ số đóng góp lớn nhất trả về khi explain=true
 
     Returns:
         Dict chứa PD từ 4 models và kết quả dự đoán
@@ -151,8 +480,8 @@ async def predict(input_data: PredictionInput):
         # Kiểm tra mô hình đã được train chưa
         if credit_model.model is None:
             # Thử load model từ file
-            if os.path.exists("model_stacking.pkl"):
-                credit_model.load_model("model_stacking.pkl")
+            if os.path.exists(MODEL_PATH):
+                credit_model.load_model(MODEL_PATH)
             else:
                 raise HTTPException(
                     status_code=400,
@@ -165,6 +494,8 @@ async def predict(input_data: PredictionInput):
 
         # Dự báo
         result = credit_model.predict(X_new)
+        if explain:
+            result["explanation"] = credit_model.explain(X_new, top_k)[0]
 
         return result
 
@@ -193,8 +524,8 @@ async def predict_from_xlsx(file: UploadFile = File(...)):
 
         # Kiểm tra mô hình đã được train chưa
         if credit_model.model is None:
-            if os.path.exists("model_stacking.pkl"):
-                credit_model.load_model("model_stacking.pkl")
+            if os.path.exists(MODEL_PATH):
+                credit_model.load_model(MODEL_PATH)
             else:
                 raise HTTPException(
                     status_code=400,
@@ -241,6 +572,136 @@ async def predict_from_xlsx(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Lỗi khi xử lý file XLSX: {str(e)}")
 
 
+async def read_rows_frame(file: Optional[UploadFile], rows_json: Optional[str]) -> Optional[pd.DataFrame]:
+    """
+    Đọc danh sách dòng (mỗi dòng 14 chỉ số + cột phụ) từ file CSV/XLSX hoặc JSON string
+
+    Returns:
+        DataFrame, hoặc None nếu không có cả file lẫn JSON
+    """
+    if file:
+        if not file.filename.endswith(('.csv', '.xlsx', '.xls')):
+            raise HTTPException(status_code=400, detail="File phải có định dạng CSV, XLSX hoặc XLS")
+        content = await file.read()
+        if file.filename.endswith('.csv'):
+            return await run_in_threadpool(pd.read_csv, io.BytesIO(content))
+        return await run_in_threadpool(pd.read_excel, io.BytesIO(content))
+    if rows_json:
+        return pd.DataFrame(json.loads(rows_json))
+    return None
+
+
+@app.post("/predict-batch")
+async def predict_batch(
+    file: Optional[UploadFile] = File(None),
+    rows_json: Optional[str] = Form(None),
+    explain: bool = Form(True),
+    top_k: int = Form(5)
+):
+    """
+    Endpoint dự báo PD cho nhiều doanh nghiệp, kèm giải thích theo chỉ số (tính một lần cho cả lô)
+
+    Args:
+        file: File CSV/XLSX, mỗi dòng X_1 → X_14, tùy chọn cột id - Optional
+        rows_json: JSON string danh sách dòng cùng định dạng - Optional
+        explain: True = kèm đóng góp của từng chỉ số vào PD Stacking
+        top_k: Số chỉ số đóng góp lớn nhất mỗi dòng (giới hạn kích thước kết quả)
+
+    Returns:
+        Dict chứa num_rows và rows: id, pd_stacking, pd_stacking_calibrated, prediction, explanation
+    """
+    try:
+        if credit_model.model is None:
+            if os.path.exists(MODEL_PATH):
+                credit_model.load_model(MODEL_PATH)
+            else:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Mô hình chưa được huấn luyện. Vui lòng upload file CSV để huấn luyện trước."
+                )
+
+        frame = await read_rows_frame(file, rows_json)
+        if frame is None:
+            raise HTTPException(status_code=400, detail="Vui lòng cung cấp file hoặc rows_json")
+        if len(frame) == 0:
+            raise HTTPException(status_code=400, detail="Không có dòng dữ liệu nào")
+        missing = [col for col in MODEL_COLS if col not in frame.columns]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Thiếu cột: {', '.join(missing)}")
+        X = frame[MODEL_COLS].apply(pd.to_numeric, errors='coerce')
+        if X.isna().any().any():
+            bad_rows = X.index[X.isna().any(axis=1)][:5].tolist()
+            raise HTTPException(status_code=400, detail=f"Chỉ số không hợp lệ (trống hoặc không phải số) ở các dòng: {bad_rows}")
+
+        rows = await run_in_threadpool(credit_model.predict_batch, X, explain, top_k)
+        ids = frame['id'].astype(str).tolist() if 'id' in frame.columns else [str(i) for i in range(len(frame))]
+        return {
+            "status": "success",
+            "num_rows": len(rows),
+            "rows": [{"id": row_id, **row} for row_id, row in zip(ids, rows)]
+        }
+
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi dự báo theo lô: {str(e)}")
+
+
+@app.post("/expected-loss-batch")
+async def expected_loss_batch(
+    file: Optional[UploadFile] = File(None),
+    exposures_json: Optional[str] = Form(None),
+    segment_by: str = Form("segment"),
+    top_n: int = Form(10),
+    include_rows: bool = Form(False)
+):
+    """
+    Endpoint tính tổn thất kỳ vọng EL = PD × LGD × EAD cho cả danh mục
+
+    Args:
+        file: File CSV/XLSX, mỗi dòng một khoản vay: X_1 → X_14, tùy chọn id, LGD, EAD, cột nhóm - Optional
+        exposures_json: JSON string danh sách khoản vay cùng định dạng - Optional
+        segment_by: Cột nhóm để tổng hợp EL (VD: segment, industry; không trùng id, PD, LGD, EAD, EL)
+        top_n: Số khoản vay đóng góp EL lớn nhất cần trả về
+        include_rows: True = trả về PD/LGD/EAD/EL từng khoản vay
+
+    Returns:
+        Dict chứa:
+        - summary: Tổng EL, tổng EAD, tỷ lệ EL/EAD, PD bình quân
+        - by_segment: EL theo nhóm
+        - top_contributors: Các khoản vay đóng góp EL lớn nhất
+        - lgd_ead_source: Số dòng dùng LGD/EAD dự báo (thay vì giá trị có sẵn) và số giá trị có sẵn bị giới hạn về miền hợp lệ
+    """
+    try:
+        if credit_model.model is None:
+            if os.path.exists(MODEL_PATH):
+                credit_model.load_model(MODEL_PATH)
+            else:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Mô hình chưa được huấn luyện. Vui lòng upload file CSV để huấn luyện trước."
+                )
+
+        exposures = await read_rows_frame(file, exposures_json)
+        if exposures is None:
+            raise HTTPException(status_code=400, detail="Vui lòng cung cấp file danh mục hoặc exposures_json")
+
+        # Vector hóa trên cả danh mục, chạy trong thread pool để không chặn event loop
+        result = await run_in_threadpool(
+            evaluate_portfolio, credit_model, exposures, segment_by, top_n, include_rows
+        )
+        return {"status": "success", **result}
+
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi tính tổn thất kỳ vọng: {str(e)}")
+
+
 @app.post("/analyze")
 async def analyze_with_gemini(request_data: Dict[str, Any]):
     """
@@ -280,6 +741,7 @@ async def analyze_industry(request_data: Dict[str, Any]):
 
     Args:
         request_data: Dict chứa industry code và industry_name
+                      (tùy chọn bypass_cache=true để bỏ qua cache Gemini)
 
     Returns:
         Dict chứa kết quả phân tích ngành và dữ liệu charts
@@ -297,8 +759,11 @@ async def analyze_industry(request_data: Dict[str, Any]):
         # Lấy Gemini analyzer
         analyzer = get_gemini_analyzer()
 
-        # Phân tích ngành
-        result = analyzer.analyze_industry(industry, industry_name)
+        # Phân tích ngành (chạy trong thread pool để các request cùng ngành được gộp)
+        result = await run_in_threadpool(
+            analyzer.analyze_industry, industry, industry_name,
+            bypass_cache=bool(request_data.get('bypass_cache', False))
+        )
 
         return {
             "status": "success",
@@ -343,6 +808,66 @@ async def set_gemini_key(request: GeminiAPIKeyRequest):
         raise HTTPException(status_code=500, detail=f"Lỗi khi set Gemini API key: {str(e)}")
 
 
+@app.get("/gemini-stats")
+async def get_gemini_stats():
+    """
+    Endpoint lấy thống kê các lời gọi Gemini (cache hit/miss, số lời gọi được gộp, độ trễ)
+
+    Returns:
+        Dict chứa thống kê cache, single-flight và LLM client
+    """
+    return {
+        "status": "success",
+        "cache": gemini_cache.stats(),
+        "single_flight": gemini_single_flight.stats(),
+        "client": get_llm_stats()
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Endpoint xuất metrics theo định dạng Prometheus
+
+    Returns:
+        Số request theo endpoint, histogram thời gian request và từng bước xử lý
+        (parse, indicators, predict_proba.<model>, scenario, llm, report_render, ...), số lần nạp mô hình
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/traces/recent")
+async def get_recent_traces(limit: int = 20):
+    """
+    Endpoint xem các trace gần nhất (collector trong bộ nhớ)
+
+    Args:
+        limit: Số trace tối đa
+
+    Returns:
+        Danh sách trace (mới nhất trước) với thời gian từng span
+    """
+    return {
+        "status": "success",
+        "traces": span_collector.recent(limit)
+    }
+
+
+@app.post("/gemini-cache/clear")
+async def clear_gemini_cache():
+    """
+    Endpoint xóa toàn bộ cache Gemini (bộ nhớ và SQLite)
+
+    Returns:
+        Dict xác nhận
+    """
+    gemini_cache.clear()
+    return {
+        "status": "success",
+        "message": "Đã xóa cache Gemini"
+    }
+
+
 @app.post("/export-report")
 async def export_report(report_data: Dict[str, Any]):
     """
@@ -352,26 +877,68 @@ async def export_report(report_data: Dict[str, Any]):
         report_data: Dict chứa prediction, indicators, và analysis
 
     Returns:
-        File Word báo cáo
+        File Word báo cáo (stream từ bộ nhớ, không ghi ra đĩa)
     """
     try:
-        # Tạo báo cáo
+        # Tạo báo cáo trong bộ nhớ (chạy trong thread pool để python-docx/matplotlib không chặn event loop)
         report_gen = ReportGenerator()
-        output_path = f"bao_cao_tin_dung_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx"
+        buffer = io.BytesIO()
+        await run_in_threadpool(report_gen.generate_report, report_data, buffer)
+        buffer.seek(0)
 
-        report_path = report_gen.generate_report(report_data, output_path)
+        filename = f"bao_cao_tin_dung_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx"
 
         # Trả về file
-        return FileResponse(
-            path=report_path,
+        return StreamingResponse(
+            buffer,
             media_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-            filename=output_path
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
         )
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi xuất báo cáo: {str(e)}")
 
 
+@app.on_event("shutdown")
+def shutdown_report_pool():
+    """Đóng process pool xuất báo cáo hàng loạt và process huấn luyện khi tắt server"""
+    shutdown_pool()
+    training_manager.shutdown()
+
+
+@app.post("/export-reports-batch")
+async def export_reports_batch(request_data: Dict[str, Any]):
+    """
+    Endpoint xuất báo cáo Word hàng loạt cho cả danh mục (file ZIP)
+
+    Args:
+        request_data: Dict chứa:
+            - reports: Danh sách dữ liệu báo cáo (như /export-report, tùy chọn 'name' để đặt tên file)
+            - include_analysis: False = bỏ phần phân tích Gemini (mặc định True)
+            - use_cached_analysis: True = dùng phân tích đã có từ /analyze cho báo cáo không kèm 'analysis'
+
+    Returns:
+        File ZIP chứa các báo cáo Word (stream dần khi từng báo cáo hoàn tất)
+    """
+    reports = request_data.get('reports')
+    if not isinstance(reports, list) or not reports:
+        raise HTTPException(status_code=400, detail="Thiếu danh sách reports để xuất báo cáo")
+    if not all(isinstance(report, dict) for report in reports):
+        raise HTTPException(status_code=400, detail="Mỗi phần tử trong reports phải là một object dữ liệu báo cáo")
+
+    stream = stream_reports_zip(
+        reports,
+        include_analysis=bool(request_data.get('include_analysis', True)),
+        use_cached_analysis=bool(request_data.get('use_cached_analysis', False))
+    )
+
+    return StreamingResponse(
+        stream,
+        media_type='application/zip',
+        headers={"Content-Disposition": f'attachment; filename="{batch_filename()}"'}
+    )
+
+
 @app.post("/fetch-industry-data")
 async def fetch_industry_data(request_data: Dict[str, Any]):
     """
@@ -379,6 +946,7 @@ async def fetch_industry_data(request_data: Dict[str, Any]):
 
     Args:
         request_data: Dict chứa industry code và industry_name
+                      (tùy chọn bypass_cache=true để bỏ qua cache Gemini)
 
     Returns:
         Dict chứa dữ liệu ngành nghề
@@ -396,8 +964,11 @@ async def fetch_industry_data(request_data: Dict[str, Any]):
         # Lấy Gemini analyzer
         analyzer = get_gemini_analyzer()
 
-        # Lấy dữ liệu
-        result = analyzer.fetch_industry_data(industry, industry_name)
+        # Lấy dữ liệu (chạy trong thread pool để các request cùng ngành được gộp)
+        result = await run_in_threadpool(
+            analyzer.fetch_industry_data, industry, industry_name,
+            bypass_cache=bool(request_data.get('bypass_cache', False))
+        )
 
         return {
             "status": "success",
@@ -420,6 +991,7 @@ async def generate_charts(request_data: Dict[str, Any]):
 
     Args:
         request_data: Dict chứa industry, industry_name, và data
+                      (tùy chọn bypass_cache=true để bỏ qua cache Gemini)
 
     Returns:
         Dict chứa charts_data và brief_analysis
@@ -439,7 +1011,10 @@ async def generate_charts(request_data: Dict[str, Any]):
         analyzer = get_gemini_analyzer()
 
         # Tạo biểu đồ và phân tích
-        result = analyzer.generate_charts_data(industry, industry_name, data)
+        result = await run_in_threadpool(
+            analyzer.generate_charts_data, industry, industry_name, data,
+            bypass_cache=bool(request_data.get('bypass_cache', False))
+        )
 
         return {
             "status": "success",
@@ -463,6 +1038,7 @@ async def deep_analyze_industry_endpoint(request_data: Dict[str, Any]):
 
     Args:
         request_data: Dict chứa industry, industry_name, data, và brief_analysis
+                      (tùy chọn bypass_cache=true để bỏ qua cache Gemini)
 
     Returns:
         Dict chứa deep_analysis
@@ -483,7 +1059,10 @@ async def deep_analyze_industry_endpoint(request_data: Dict[str, Any]):
         analyzer = get_gemini_analyzer()
 
         # Phân tích sâu
-        deep_analysis = analyzer.deep_analyze_industry(industry, industry_name, data, brief_analysis)
+        deep_analysis = await run_in_threadpool(
+            analyzer.deep_analyze_industry, industry, industry_name, data, brief_analysis,
+            bypass_cache=bool(request_data.get('bypass_cache', False))
+        )
 
         return {
             "status": "success",
@@ -655,8 +1234,8 @@ async def get_model_info():
     try:
         if credit_model.model is None:
             # Thử load model từ file
-            if os.path.exists("model_stacking.pkl"):
-                credit_model.load_model("model_stacking.pkl")
+            if os.path.exists(MODEL_PATH):
+                credit_model.load_model(MODEL_PATH)
             else:
                 return {
                     "status": "not_trained",
@@ -667,7 +1246,14 @@ async def get_model_info():
             "status": "trained",
             "message": "Mô hình đã sẵn sàng",
             "metrics_train": credit_model.metrics_in,
-            "metrics_test": credit_model.metrics_out
+            "metrics_test": credit_model.metrics_out,
+            "meta_params": credit_model.meta_params,
+            "threshold": credit_model.threshold,
+            "oof_cache_available": credit_model.stack_cache is not None,
+            "base_params": credit_model.base_params,
+            "data_version": credit_model.data_version,
+            # Hiệu chỉnh PD: phương pháp (identity/isotonic/platt), Brier cross-validation, reliability curve cv/test
+            "calibration": credit_model.calibration_report
         }
 
     except Exception as e:
@@ -724,8 +1310,7 @@ Hãy trả lời câu hỏi:
 """
 
         # Gọi Gemini API
-        response = analyzer.model.generate_content(prompt)
-        answer = response.text
+        answer = analyzer.generate(prompt, endpoint='chat_assistant')
 
         return {
             "status": "success",
@@ -777,8 +1362,8 @@ async def simulate_scenario(
 
         # Kiểm tra mô hình đã được train chưa
         if credit_model.model is None:
-            if os.path.exists("model_stacking.pkl"):
-                credit_model.load_model("model_stacking.pkl")
+            if os.path.exists(MODEL_PATH):
+                credit_model.load_model(MODEL_PATH)
             else:
                 raise HTTPException(
                     status_code=400,
@@ -1016,8 +1601,8 @@ async def simulate_scenario_macro(
 
         # Kiểm tra mô hình đã được train chưa
         if credit_model.model is None:
-            if os.path.exists("model_stacking.pkl"):
-                credit_model.load_model("model_stacking.pkl")
+            if os.path.exists(MODEL_PATH):
+                credit_model.load_model(MODEL_PATH)
             else:
                 raise HTTPException(
                     status_code=400,
@@ -1299,8 +1884,7 @@ Hãy viết báo cáo phân tích chi tiết (sử dụng Markdown) với cấu
 """
 
         # Gọi Gemini API
-        response = analyzer.model.generate_content(prompt)
-        analysis = response.text
+        analysis = analyzer.generate(prompt, endpoint='analyze_macro')
 
         return {
             "status": "success",
@@ -1316,13 +1900,75 @@ Hãy viết báo cáo phân tích chi tiết (sử dụng Markdown) với cấu
         raise HTTPException(status_code=500, detail=f"Lỗi khi phân tích vĩ mô bằng Gemini: {str(e)}")
 
 
+async def store_labeled_upload(file: UploadFile, append: bool) -> int:
+    """
+    Đọc file DN có nhãn (X_1 → X_14 + label) một lần và ghi vào labeled_store
+
+    Args:
+        file: File XLSX/XLS/CSV
+        append: True = thêm vào sau phiên bản mới nhất (chỉ ghi dòng mới), False = phiên bản mới chỉ gồm file này
+
+    Returns:
+        Số phiên bản dữ liệu mới
+    """
+    if not file.filename.endswith(('.xlsx', '.xls', '.csv')):
+        raise HTTPException(
+            status_code=400,
+            detail="File phải có định dạng XLSX, XLS hoặc CSV"
+        )
+
+    content = await file.read()
+    if file.filename.endswith('.csv'):
+        df = await run_in_threadpool(pd.read_csv, io.BytesIO(content))
+    else:
+        df = await run_in_threadpool(pd.read_excel, io.BytesIO(content))
+
+    # Kiểm tra các cột cần thiết
+    required_cols = MODEL_COLS + ['label']
+    missing_cols = [col for col in required_cols if col not in df.columns]
+    if missing_cols:
+        raise HTTPException(
+            status_code=400,
+            detail=f"File thiếu các cột: {', '.join(missing_cols)}"
+        )
+    if not df['label'].isin([0, 1]).all():
+        raise HTTPException(status_code=400, detail="Cột 'label' chỉ nhận giá trị 0 hoặc 1")
+
+    frame = df[required_cols].astype({'label': 'int8'})
+    parent = labeled_store.latest_version() if append else None
+    return await run_in_threadpool(labeled_store.write, frame, parent)
+
+
+async def resolve_labeled_version(kind: str, file: Optional[UploadFile], append: bool, data_version: Optional[int]) -> int:
+    """
+    Phiên bản dữ liệu cho job Early Warning / Anomaly: ghi file upload vào kho, hoặc dùng phiên bản đã lưu
+    File upload chỉ được ghi khi không có job cùng loại đang chạy (409 không tạo phiên bản dữ liệu mới)
+    """
+    if file is not None:
+        try:
+            training_manager.ensure_idle(kind)
+        except JobConflictError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        return await store_labeled_upload(file, append)
+    return labeled_store.resolve_version(data_version)
+
+
 @app.post("/train-early-warning-model")
-async def train_early_warning_model(file: UploadFile = File(...)):
+async def train_early_warning_model(
+    file: Optional[UploadFile] = File(None),
+    background: bool = False,
+    append: bool = False,
+    data_version: Optional[int] = None
+):
     """
     Endpoint huấn luyện Early Warning System
 
     Args:
-        file: File Excel chứa 1300 DN với 14 chỉ số (X_1 → X_14) + cột 'label' (0=không vỡ nợ, 1=vỡ nợ)
+        file: File Excel chứa 1300 DN với 14 chỉ số (X_1 → X_14) + cột 'label' (0=không vỡ nợ, 1=vỡ nợ).
+              Bỏ trống = huấn luyện trên kho dữ liệu đã lưu (dùng chung với /train-anomaly-model)
+        background: True = trả về job_id ngay, theo dõi tiến độ tại /training-jobs/{job_id}
+        append: True = thêm các dòng của file vào phiên bản dữ liệu mới nhất thay vì thay toàn bộ
+        data_version: Phiên bản dữ liệu khi không upload file (bỏ trống = mới nhất)
 
     Returns:
         Dict chứa thông tin về training:
@@ -1330,55 +1976,25 @@ async def train_early_warning_model(file: UploadFile = File(...)):
         - num_samples: Số lượng mẫu
         - feature_importances: Feature importances từ RandomForest
         - cluster_distribution: Phân bố các cluster
+        - data_version: Phiên bản dữ liệu đã dùng
     """
     try:
-        # Kiểm tra file extension
-        if not file.filename.endswith(('.xlsx', '.xls', '.csv')):
-            raise HTTPException(
-                status_code=400,
-                detail="File phải có định dạng XLSX, XLS hoặc CSV"
-            )
-
-        # Lưu file tạm
-        suffix = '.xlsx' if file.filename.endswith(('.xlsx', '.xls')) else '.csv'
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_file_path = tmp_file.name
+        version = await resolve_labeled_version('early_warning', file, append, data_version)
 
-        try:
-            # Đọc file
-            if suffix == '.csv':
-                df = pd.read_csv(tmp_file_path)
-            else:
-                df = pd.read_excel(tmp_file_path)
-
-            # Kiểm tra các cột cần thiết
-            required_cols = [f'X_{i}' for i in range(1, 15)] + ['label']
-            missing_cols = [col for col in required_cols if col not in df.columns]
-
-            if missing_cols:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"File thiếu các cột: {', '.join(missing_cols)}"
-                )
-
-            # Train Early Warning System
-            result = early_warning_system.train_models(df)
-
-            return {
-                "status": "success",
-                "message": "Early Warning System trained successfully!",
-                **result
-            }
+        # Train Early Warning System trên process riêng (đọc kho dữ liệu bằng memory-map)
+        response = await run_training_job('early_warning', background, version)
+        if background:
+            return response
 
-        finally:
-            # Xóa file tạm
-            try:
-                os.unlink(tmp_file_path)
-            except Exception:
-                pass
+        result, _ = response
+        return {
+            "status": "success",
+            "message": "Early Warning System trained successfully!",
+            **result
+        }
 
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -1416,8 +2032,11 @@ async def early_warning_check(
     try:
         import json
 
+        # Một bản chụp mô hình cho cả request: job huấn luyện publish giữa chừng không trộn mô hình cũ và mới
+        ews = snapshot(early_warning_system)
+
         # Kiểm tra Early Warning System đã được train chưa
-        if early_warning_system.stacking_model is None:
+        if ews.stacking_model is None:
             raise HTTPException(
                 status_code=400,
                 detail="Early Warning System chưa được train. Vui lòng upload file training data trước."
@@ -1425,8 +2044,8 @@ async def early_warning_check(
 
         # Kiểm tra mô hình PD đã được train chưa
         if credit_model.model is None:
-            if os.path.exists("model_stacking.pkl"):
-                credit_model.load_model("model_stacking.pkl")
+            if os.path.exists(MODEL_PATH):
+                credit_model.load_model(MODEL_PATH)
             else:
                 raise HTTPException(
                     status_code=400,
@@ -1467,21 +2086,21 @@ async def early_warning_check(
             )
 
         # 2. TÍNH HEALTH SCORE
-        health_score = early_warning_system.calculate_health_score(indicators)
+        health_score = ews.calculate_health_score(indicators)
 
         # 3. PHÂN LOẠI MỨC RỦI RO
-        risk_info = early_warning_system.classify_risk_level(health_score)
+        risk_info = ews.classify_risk_level(health_score)
 
-        # 4. TÍNH PD HIỆN TẠI (sử dụng early_warning_system.stacking_model)
+        # 4. TÍNH PD HIỆN TẠI (sử dụng ews.stacking_model)
         feature_cols = [f'X_{i}' for i in range(1, 15)]
         X_current = [[indicators[col] for col in feature_cols]]
-        current_pd = early_warning_system.stacking_model.predict_proba(X_current)[0, 1] * 100
+        current_pd = ews.stacking_model.predict_proba(X_current)[0, 1] * 100
 
         # 5. PHÁT HIỆN ĐIỂM YẾU
-        weaknesses = early_warning_system.detect_weaknesses(indicators)
+        weaknesses = ews.detect_weaknesses(indicators)
 
         # 6. XÁC ĐỊNH VỊ TRÍ CLUSTER
-        cluster_info = early_warning_system.get_cluster_position(indicators)
+        cluster_info = ews.get_cluster_position(indicators)
 
         # 7. DỰ BÁO PD TƯƠNG LAI (3/6/12 tháng x 3 kịch bản)
         scenarios = ['recession_mild', 'recession_moderate', 'crisis']
@@ -1494,7 +2113,7 @@ async def early_warning_check(
         for scenario in scenarios:
             pd_projection[scenario] = {}
             for months in time_periods:
-                pd_future = early_warning_system.project_future_pd(
+                pd_future = ews.project_future_pd(
                     indicators=indicators,
                     months=months,
                     scenario=scenario,
@@ -1504,14 +2123,16 @@ async def early_warning_check(
                 pd_projection[scenario][f'{months}_months'] = pd_future
 
         # 8. TẠO BÁO CÁO CHẨN ĐOÁN BẰNG GEMINI AI
-        gemini_diagnosis = early_warning_system.generate_gemini_diagnosis(
+        # Chạy trong threadpool: lời gọi Gemini chậm không chặn event loop
+        gemini_diagnosis = await run_in_threadpool(
+            ews.generate_gemini_diagnosis,
             health_score=health_score,
             risk_info=risk_info,
             weaknesses=weaknesses,
             cluster_info=cluster_info,
             pd_projections=pd_projection,
             current_pd=current_pd,
-            gemini_api_key=GEMINI_API_KEY
+            gemini_api_key=os.getenv("GEMINI_API_KEY")
         )
 
         # 9. TRẢ VỀ KẾT QUẢ
@@ -1527,7 +2148,7 @@ async def early_warning_check(
             "cluster_info": cluster_info,
             "pd_projection": pd_projection,
             "gemini_diagnosis": gemini_diagnosis,
-            "feature_importances": early_warning_system.feature_importances,
+            "feature_importances": ews.feature_importances,
             "report_period": report_period
         }
 
@@ -1538,73 +2159,67 @@ async def early_warning_check(
 
 
 @app.post("/train-anomaly-model")
-async def train_anomaly_model(file: UploadFile = File(...)):
+async def train_anomaly_model(
+    file: Optional[UploadFile] = File(None),
+    background: bool = False,
+    append: bool = False,
+    data_version: Optional[int] = None
+):
     """
     Endpoint huấn luyện Anomaly Detection System
 
     Args:
-        file: File Excel/CSV chứa 1300 DN với 14 chỉ số (X_1 → X_14) + cột 'label' (0=khỏe mạnh, 1=vỡ nợ)
+        file: File Excel/CSV chứa 1300 DN với 14 chỉ số (X_1 → X_14) + cột 'label' (0=khỏe mạnh, 1=vỡ nợ).
+              Bỏ trống = huấn luyện trên kho dữ liệu đã lưu (dùng chung với /train-early-warning-model)
+        background: True = trả về job_id ngay, theo dõi tiến độ tại /training-jobs/{job_id}
+        append: True = thêm các dòng của file vào phiên bản dữ liệu mới nhất thay vì thay toàn bộ
+        data_version: Phiên bản dữ liệu khi không upload file (bỏ trống = mới nhất)
 
     Returns:
         Dict chứa thông tin về training:
         - status: success
         - feature_statistics: Thống kê 14 features (P5, P25, P50, P75, P95)
         - contamination_rate: Tỷ lệ contamination
+        - data_version: Phiên bản dữ liệu đã dùng
     """
     try:
-        # Kiểm tra file extension
-        if not file.filename.endswith(('.xlsx', '.xls', '.csv')):
-            raise HTTPException(
-                status_code=400,
-                detail="File phải có định dạng XLSX, XLS hoặc CSV"
-            )
-
-        # Lưu file tạm
-        suffix = '.xlsx' if file.filename.endswith(('.xlsx', '.xls')) else '.csv'
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_file_path = tmp_file.name
-
-        try:
-            # Đọc file
-            if suffix == '.csv':
-                df = pd.read_csv(tmp_file_path)
-            else:
-                df = pd.read_excel(tmp_file_path)
-
-            # Kiểm tra các cột cần thiết
-            required_cols = [f'X_{i}' for i in range(1, 15)] + ['label']
-            missing_cols = [col for col in required_cols if col not in df.columns]
+        version = await resolve_labeled_version('anomaly', file, append, data_version)
 
-            if missing_cols:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"File thiếu các cột: {', '.join(missing_cols)}"
-                )
+        # Train Anomaly Detection System trên process riêng (chỉ đọc row group label 0 của kho)
+        response = await run_training_job('anomaly', background, version)
+        if background:
+            return response
 
-            # Train Anomaly Detection System
-            result = anomaly_system.train_model(df)
-
-            return {
-                "status": "success",
-                "message": "Anomaly Detection System trained successfully!",
-                **result
-            }
-
-        finally:
-            # Xóa file tạm
-            try:
-                os.unlink(tmp_file_path)
-            except Exception:
-                pass
+        result, _ = response
+        return {
+            "status": "success",
+            "message": "Anomaly Detection System trained successfully!",
+            **result
+        }
 
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi train Anomaly Detection System: {str(e)}")
 
 
+@app.get("/training-data")
+async def get_training_data():
+    """
+    Endpoint liệt kê các phiên bản dữ liệu huấn luyện đã lưu
+
+    Returns:
+        Dict chứa phiên bản của kho 'credit' (/train, /train-append; phân vùng split 0=train, 1=test)
+        và kho 'companies' (/train-early-warning-model, /train-anomaly-model; phân vùng label)
+    """
+    return {
+        "credit": credit_store.versions(),
+        "companies": labeled_store.versions()
+    }
+
+
 @app.post("/check-anomaly")
 async def check_anomaly(
     file: Optional[UploadFile] = File(None),
@@ -1629,8 +2244,11 @@ async def check_anomaly(
     try:
         import json
 
+        # Một bản chụp mô hình cho cả request: job huấn luyện publish giữa chừng không trộn mô hình cũ và mới
+        anomaly = snapshot(anomaly_system)
+
         # Kiểm tra Anomaly Detection System đã được train chưa
-        if anomaly_system.model is None:
+        if anomaly.model is None:
             raise HTTPException(
                 status_code=400,
                 detail="Anomaly Detection System chưa được train. Vui lòng upload file training data trước."
@@ -1670,13 +2288,13 @@ async def check_anomaly(
             )
 
         # 2. TÍNH ANOMALY SCORE
-        anomaly_score = anomaly_system.calculate_anomaly_score(indicators)
+        anomaly_score = anomaly.calculate_anomaly_score(indicators)
 
         # 3. PHÁT HIỆN CÁC FEATURES BẤT THƯỜNG
-        abnormal_features = anomaly_system.detect_abnormal_features(indicators)
+        abnormal_features = anomaly.detect_abnormal_features(indicators)
 
         # 4. PHÂN LOẠI LOẠI BẤT THƯỜNG
-        anomaly_type = anomaly_system.classify_anomaly_type(indicators, abnormal_features)
+        anomaly_type = anomaly.classify_anomaly_type(indicators, abnormal_features)
 
         # 5. XÁC ĐỊNH MỨC RỦI RO
         if anomaly_score < 60:
@@ -1693,21 +2311,22 @@ async def check_anomaly(
             risk_level_icon = "🔴"
 
         # 6. TẠO GIẢI THÍCH BẰNG GEMINI AI
-        gemini_explanation = anomaly_system.generate_gemini_explanation(
+        gemini_explanation = await run_in_threadpool(
+            anomaly.generate_gemini_explanation,
             indicators=indicators,
             anomaly_score=anomaly_score,
             abnormal_features=abnormal_features,
             anomaly_type=anomaly_type,
-            gemini_api_key=GEMINI_API_KEY
+            gemini_api_key=os.getenv("GEMINI_API_KEY")
         )
 
         # 7. SO SÁNH VỚI DN KHỎE MẠNH (cho Radar Chart)
         comparison_with_healthy = []
-        for feature in anomaly_system.feature_names:
+        for feature in anomaly.feature_names:
             comparison_with_healthy.append({
-                'feature': anomaly_system.indicator_names[feature],
+                'feature': anomaly.indicator_names[feature],
                 'current': indicators[feature],
-                'healthy_mean': anomaly_system.healthy_stats[feature]['mean']
+                'healthy_mean': anomaly.healthy_stats[feature]['mean']
             })
 
         # 8. TRẢ VỀ KẾT QUẢ
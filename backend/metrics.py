@@ -0,0 +1,189 @@
+"""
+Metrics Module - Bộ đếm và histogram độ trễ theo định dạng Prometheus
+Không phụ thuộc thư viện ngoài; mỗi lần ghi chỉ tốn một lock + tra dict + bisect
+nên có thể bật thường trực trên production. Xuất ra tại endpoint /metrics.
+Mỗi bước đo bằng stage_timer đồng thời là một span trong trace của request (tracing.py).
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List, Sequence, Tuple
+
+from tracing import span
+
+# Bucket (giây) đủ rộng cho cả bước tính toán vài ms lẫn lời gọi Gemini vài chục giây
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+INF_BOUND = 'le="+Inf"'
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """Bộ đếm tăng dần theo nhãn"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        """Tăng bộ đếm cho bộ nhãn tương ứng"""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """Histogram phân bố giá trị (độ trễ) theo nhãn, bucket cố định"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [số đếm từng bucket (không cộng dồn) + bucket +Inf, tổng, số mẫu]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        """Ghi nhận một giá trị"""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._values[key] = entry
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, ([*entry[0]], entry[1], entry[2])) for key, entry in self._values.items())
+        bounds = ['le="%g"' % bound for bound in self.buckets]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, bound)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, INF_BOUND)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Tập hợp các metric để xuất ra định dạng text của Prometheus"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_requests_total = registry.register(Counter(
+    "http_requests_total", "Số request HTTP theo endpoint và mã trạng thái", ("method", "path", "status")
+))
+http_request_duration_seconds = registry.register(Histogram(
+    "http_request_duration_seconds", "Thời gian xử lý request HTTP (giây)", ("method", "path")
+))
+stage_duration_seconds = registry.register(Histogram(
+    "stage_duration_seconds", "Thời gian từng bước xử lý (giây)", ("stage",)
+))
+stage_errors_total = registry.register(Counter(
+    "stage_errors_total", "Số lần một bước xử lý ném lỗi", ("stage",)
+))
+model_loads_total = registry.register(Counter(
+    "model_loads_total", "Số lần nạp mô hình (từ file hoặc sau khi huấn luyện)", ("model", "source")
+))
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """
+    Đo thời gian một bước xử lý, ghi vào stage_duration_seconds và tạo span trong trace của request
+
+    Args:
+        stage: Tên bước (VD: parse, indicators, predict_proba.stacking, scenario, llm, report_render)
+    """
+    start = time.perf_counter()
+    try:
+        with span(stage):
+            yield
+    except BaseException:
+        stage_errors_total.inc(stage=stage)
+        raise
+    finally:
+        stage_duration_seconds.observe(time.perf_counter() - start, stage=stage)
+
+
+def timed_stage(stage: str):
+    """Decorator: đo thời gian cả hàm như một bước xử lý"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_model_load(model: str, source: str):
+    """
+    Ghi nhận một lần nạp mô hình
+
+    Args:
+        model: Tên mô hình (VD: credit_stacking, early_warning, anomaly)
+        source: 'file' (load từ pickle) hoặc 'train' (vừa huấn luyện)
+    """
+    model_loads_total.inc(model=model, source=source)
+
+
+def render_metrics() -> str:
+    """Toàn bộ metric ở định dạng text của Prometheus"""
+    return registry.render()
@@ -8,16 +8,150 @@ import numpy as np
 import pandas as pd
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier, StackingClassifier
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score
+from sklearn.base import clone
+from sklearn.model_selection import PredefinedSplit, cross_val_predict, train_test_split
+from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score, precision_recall_curve
 from xgboost import XGBClassifier
+import copy
+import math
 import pickle
 import os
-from typing import Dict, Tuple, Any
+import time
+import uuid
+from typing import Callable, Dict, List, Tuple, Any, Optional
+from metrics import stage_timer, record_model_load
+from model_state import snapshot
+from expected_loss import ExpectedLossModel, TARGET_COLS
+from oof_cache import atomic_savez, stratified_fold_ids
+from calibration import ProbabilityCalibrator, reliability_metrics, select_calibrator
+from explain import StackingExplainer, top_contributions
+from training_store import TrainingStore
+from logging_config import get_logger
+
+logger = get_logger(__name__)
 
 # Danh sách 14 chỉ số tài chính
 MODEL_COLS = [f'X_{i}' for i in range(1, 15)]
 
+# Siêu tham số mặc định của 3 base models (có thể ghi đè khi huấn luyện, VD: theo kết quả /tune)
+DEFAULT_BASE_PARAMS = {
+    'logistic': {'C': 1.0, 'class_weight': 'balanced'},
+    'random_forest': {'n_estimators': 100, 'max_depth': 10, 'class_weight': 'balanced'},
+    'xgboost': {'n_estimators': 100, 'max_depth': 6, 'learning_rate': 0.1},
+}
+BASE_LEARNERS = tuple(DEFAULT_BASE_PARAMS)
+
+# Siêu tham số mặc định của meta-model và ngưỡng phân loại (PD >= ngưỡng = Default)
+DEFAULT_META_PARAMS = {'C': 1.0, 'class_weight': None}
+DEFAULT_THRESHOLD = 0.15
+STACKING_CV = 5
+
+
+def make_base_learner(name: str, params: Dict[str, Any] = None, n_jobs: int = None):
+    """
+    Tạo một base model với siêu tham số cho trước (các tham số cố định như random_state giữ nguyên)
+
+    Args:
+        name: 'logistic', 'random_forest' hoặc 'xgboost'
+        params: Siêu tham số ghi đè DEFAULT_BASE_PARAMS[name]
+        n_jobs: Số thread cho RF/XGB (None = mặc định của thư viện)
+
+    Returns:
+        Estimator chưa fit
+    """
+    if name not in DEFAULT_BASE_PARAMS:
+        raise ValueError(f"Không có base model '{name}'. Các base model: {', '.join(BASE_LEARNERS)}")
+    params = {**DEFAULT_BASE_PARAMS[name], **(params or {})}
+    threads = {} if n_jobs is None else {'n_jobs': n_jobs}
+
+    if name == 'logistic':
+        return LogisticRegression(random_state=42, max_iter=1000, solver="lbfgs", **params)
+    if name == 'random_forest':
+        return RandomForestClassifier(random_state=42, **threads, **params)
+    return XGBClassifier(random_state=42, use_label_encoder=False, eval_metric='logloss', **threads, **params)
+
+
+def make_meta_learner(params: Dict[str, Any] = None) -> LogisticRegression:
+    """Meta-model LogisticRegression với siêu tham số ghi đè DEFAULT_META_PARAMS"""
+    return LogisticRegression(random_state=42, max_iter=1000, **{**DEFAULT_META_PARAMS, **(params or {})})
+
+
+def fit_stacking_with_oof(
+    stacking: StackingClassifier,
+    X,
+    y,
+    meta: LogisticRegression,
+    n_splits: int = STACKING_CV
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fit StackingClassifier(cv='prefit') cho kết quả giống cv=n_splits nhưng giữ lại dự báo OOF
+
+    - Dự báo OOF của từng base model theo StratifiedKFold(n_splits) (cùng cách chia của cv=n_splits)
+    - Base models (stacking.estimators) fit một lần trên toàn bộ dữ liệu
+    - Meta-model fit trên ma trận OOF
+
+    Args:
+        stacking: StackingClassifier(cv='prefit', stack_method='predict_proba') với base models chưa fit
+        X: Features
+        y: Nhãn (0/1)
+        meta: Meta-model chưa fit
+        n_splits: Số fold
+
+    Returns:
+        (ma trận OOF n_samples × số base models, fold của từng dòng)
+    """
+    base_models = [estimator for _, estimator in stacking.estimators]
+    fold_ids = stratified_fold_ids(X, y, n_splits)
+
+    oof = np.column_stack([
+        cross_val_predict(clone(estimator), X, y, cv=PredefinedSplit(fold_ids), method='predict_proba', n_jobs=-1)[:, 1]
+        for estimator in base_models
+    ])
+    for estimator in base_models:
+        estimator.fit(X, y)
+
+    stacking.fit(X, y)  # cv='prefit': chỉ gắn base models đã fit
+    stacking.final_estimator_ = meta.fit(oof, y)
+    return oof, fold_ids
+
+
+def stacking_oof_pd(oof: np.ndarray, y, fold_ids: np.ndarray, make_meta: Callable[[], LogisticRegression]) -> np.ndarray:
+    """
+    PD Stacking out-of-fold: với mỗi fold, meta-model fit trên ma trận OOF của các fold còn lại
+
+    Args:
+        oof: Ma trận OOF của base models
+        y: Nhãn
+        fold_ids: Fold của từng dòng
+        make_meta: Hàm tạo meta-model chưa fit
+
+    Returns:
+        PD của từng dòng (dữ liệu mà cả base models lẫn meta-model chưa thấy)
+    """
+    y = np.asarray(y)
+    oof_pd = np.empty(len(y), dtype=np.float64)
+    for fold in np.unique(fold_ids):
+        train_mask = fold_ids != fold
+        meta = make_meta().fit(oof[train_mask], y[train_mask])
+        oof_pd[~train_mask] = meta.predict_proba(oof[~train_mask])[:, 1]
+    return oof_pd
+
+
+def oof_artifact_path(model_path: str) -> str:
+    """File .npz chứa dự báo OOF đi kèm file mô hình (VD: model_stacking.pkl → model_stacking_oof.npz)"""
+    return f"{os.path.splitext(model_path)[0]}_oof.npz"
+
+
+def classification_metrics(y_true, y_pred, y_proba) -> Dict[str, float]:
+    """Accuracy, precision, recall, F1, AUC"""
+    return {
+        "accuracy": accuracy_score(y_true, y_pred),
+        "precision": precision_score(y_true, y_pred, zero_division=0),
+        "recall": recall_score(y_true, y_pred, zero_division=0),
+        "f1": f1_score(y_true, y_pred, zero_division=0),
+        "auc": roc_auc_score(y_true, y_proba),
+    }
+
 
 class CreditRiskModel:
     """Class quản lý mô hình Stacking Classifier cho đánh giá rủi ro tín dụng"""
@@ -33,32 +167,35 @@ class CreditRiskModel:
         self.y_test = None
         self.metrics_in = {}
         self.metrics_out = {}
+        self.el_model = None  # Mô hình LGD/EAD (chỉ có khi dữ liệu huấn luyện có cột LGD, EAD)
+        self.base_params = {}
+        self.meta_params = dict(DEFAULT_META_PARAMS)
+        self.threshold = DEFAULT_THRESHOLD
+        # Dự báo OOF của base models + fold (lưu kèm mô hình): fit lại meta-model / chọn ngưỡng không cần fit lại base models
+        self.stack_cache: Optional[Dict[str, np.ndarray]] = None
+        self.calibrator: Optional[ProbabilityCalibrator] = None  # Hiệu chỉnh PD Stacking (fit trên PD out-of-fold)
+        self.calibration_report: Optional[Dict[str, Any]] = None
+        self.feature_means: Optional[np.ndarray] = None  # Trung bình 14 chỉ số tập train (mốc giải thích Logistic)
+        self._explainer: Optional[StackingExplainer] = None  # Tạo lười, gắn với self.model hiện tại
+        self.data_version: Optional[int] = None  # Phiên bản dữ liệu huấn luyện trong TrainingStore (nếu có)
+
+    def build_model(self, base_params: Dict[str, Dict[str, Any]] = None):
+        """
+        Xây dựng mô hình Stacking Classifier
 
-    def build_model(self):
-        """Xây dựng mô hình Stacking Classifier"""
-        # Định nghĩa 3 Base Models
-        self.model_logistic = LogisticRegression(
-            random_state=42,
-            max_iter=1000,
-            class_weight="balanced",
-            solver="lbfgs"
-        )
-
-        self.model_rf = RandomForestClassifier(
-            n_estimators=100,
-            random_state=42,
-            max_depth=10,
-            class_weight="balanced"
-        )
+        Args:
+            base_params: Siêu tham số ghi đè cho từng base model, VD: {'xgboost': {'max_depth': 4}}
+        """
+        base_params = base_params or {}
+        unknown = [name for name in base_params if name not in DEFAULT_BASE_PARAMS]
+        if unknown:
+            raise ValueError(f"Không có base model: {', '.join(unknown)}. Các base model: {', '.join(BASE_LEARNERS)}")
+        self.base_params = {name: {**DEFAULT_BASE_PARAMS[name], **base_params.get(name, {})} for name in BASE_LEARNERS}
 
-        self.model_xgb = XGBClassifier(
-            n_estimators=100,
-            random_state=42,
-            max_depth=6,
-            learning_rate=0.1,
-            use_label_encoder=False,
-            eval_metric='logloss'
-        )
+        # Định nghĩa 3 Base Models
+        self.model_logistic = make_base_learner('logistic', self.base_params['logistic'])
+        self.model_rf = make_base_learner('random_forest', self.base_params['random_forest'])
+        self.model_xgb = make_base_learner('xgboost', self.base_params['xgboost'])
 
         # Tạo StackingClassifier với LogisticRegression làm meta-model
         estimators = [
@@ -67,25 +204,78 @@ class CreditRiskModel:
             ('xgboost', self.model_xgb)
         ]
 
+        # cv='prefit': base models được fit trực tiếp (cũng là 3 mô hình PD riêng), meta-model được fit
+        # trên dự báo OOF 5-fold như cv=5 - xem _fit_stacking
         self.model = StackingClassifier(
             estimators=estimators,
-            final_estimator=LogisticRegression(random_state=42, max_iter=1000),
-            cv=5,  # Cross-validation 5-fold
-            stack_method='predict_proba',  # Dùng probability để stack
-            n_jobs=-1  # Sử dụng tất cả CPU cores
+            final_estimator=make_meta_learner(self.meta_params),
+            cv='prefit',
+            stack_method='predict_proba'  # Dùng probability để stack
         )
 
-    def train(self, csv_file_path: str) -> Dict[str, Any]:
+    def _fit_stacking(self):
+        """
+        Fit Stacking giống StackingClassifier(cv=5) nhưng giữ lại dự báo OOF (fit_stacking_with_oof);
+        base models fit trên toàn bộ tập train dùng chung cho Stacking và PD riêng (không fit 2 lần)
+        """
+        oof, fold_ids = fit_stacking_with_oof(
+            self.model, self.X_train, self.y_train, make_meta_learner(self.meta_params)
+        )
+        self.stack_cache = {
+            'oof': oof,
+            'fold_ids': fold_ids,
+            'y_train': self.y_train.to_numpy(dtype=np.int8),
+            'train_base': self._base_probabilities(self.X_train),
+            'test_base': self._base_probabilities(self.X_test),
+            'y_test': self.y_test.to_numpy(dtype=np.int8),
+        }
+
+    def _base_probabilities(self, X: pd.DataFrame) -> np.ndarray:
+        """Ma trận PD của 3 base models (đầu vào của meta-model)"""
+        return self.model.transform(X[MODEL_COLS])
+
+    def _fit_calibration(self, meta: LogisticRegression, meta_params: Dict[str, Any]) -> Tuple[ProbabilityCalibrator, Dict[str, Any]]:
+        """
+        Fit hiệu chỉnh PD trên PD Stacking out-of-fold và đánh giá reliability trên tập test
+
+        Returns:
+            (calibrator, báo cáo: phương pháp, Brier cross-validation, reliability cv/test trước và sau hiệu chỉnh)
+        """
+        cache = self.stack_cache
+        oof_pd = stacking_oof_pd(cache['oof'], cache['y_train'], cache['fold_ids'], lambda: make_meta_learner(meta_params))
+        calibrator, report = select_calibrator(oof_pd, cache['y_train'], cache['fold_ids'])
+
+        test_pd = meta.predict_proba(cache['test_base'])[:, 1]
+        report['reliability_test'] = {
+            'raw': reliability_metrics(cache['y_test'], test_pd),
+            'calibrated': reliability_metrics(cache['y_test'], calibrator.transform(test_pd)),
+        }
+        return calibrator, report
+
+    def train(
+        self,
+        csv_file_path: str,
+        progress_callback: Optional[Callable[[int, str], None]] = None,
+        base_params: Dict[str, Dict[str, Any]] = None,
+        store: Optional[TrainingStore] = None
+    ) -> Dict[str, Any]:
         """
         Huấn luyện mô hình từ file CSV
 
         Args:
             csv_file_path: Đường dẫn đến file CSV chứa dữ liệu huấn luyện
+            progress_callback: Hàm nhận (phần trăm, mô tả bước) để báo tiến độ (VD: job huấn luyện nền)
+            base_params: Siêu tham số ghi đè cho 3 base models (None = DEFAULT_BASE_PARAMS)
+            store: Kho dữ liệu huấn luyện; dữ liệu (kèm cách chia train/test) được ghi thành phiên bản mới
+                   để huấn luyện lại / train_append sau này không cần upload lại. None = không lưu
 
         Returns:
             Dict chứa metrics và thông tin huấn luyện
         """
+        progress = progress_callback or (lambda pct, message: None)
+
         # Đọc dữ liệu
+        progress(5, "Đọc dữ liệu huấn luyện")
         df = pd.read_csv(csv_file_path)
 
         # Kiểm tra cột cần thiết
@@ -94,52 +284,80 @@ class CreditRiskModel:
         if missing:
             raise ValueError(f"Thiếu cột: {missing}. Vui lòng kiểm tra lại file CSV.")
 
-        # Chuẩn bị dữ liệu
-        X = df[MODEL_COLS]
-        y = df['default'].astype(int)
-
         # Chia train/test
-        self.X_train, self.X_test, self.y_train, self.y_test = train_test_split(
-            X, y, test_size=0.2, random_state=42, stratify=y
-        )
+        train_df, test_df = train_test_split(df, test_size=0.2, random_state=42, stratify=df['default'].astype(int))
 
-        # Xây dựng mô hình
-        self.build_model()
+        data_version = None
+        if store is not None:
+            data_version = self._store_split(store, train_df, test_df)
 
-        # Train mô hình Stacking
-        print("🚀 Đang huấn luyện mô hình Stacking Classifier...")
-        self.model.fit(self.X_train, self.y_train)
+        return self._train_split(train_df, test_df, progress, base_params, data_version)
 
-        # Train riêng 3 base models để lấy PD riêng biệt
-        print("🔧 Đang huấn luyện 3 base models riêng biệt...")
-        self.model_logistic.fit(self.X_train, self.y_train)
-        self.model_rf.fit(self.X_train, self.y_train)
-        self.model_xgb.fit(self.X_train, self.y_train)
+    def train_from_store(
+        self,
+        store: TrainingStore,
+        version: Optional[int] = None,
+        progress_callback: Optional[Callable[[int, str], None]] = None,
+        base_params: Dict[str, Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Huấn luyện lại từ đầu trên một phiên bản dữ liệu đã lưu (giữ nguyên cách chia train/test), không cần upload lại
+
+        Args:
+            store: Kho dữ liệu huấn luyện (phân vùng 'split')
+            version: Phiên bản dữ liệu (None = mới nhất)
+            progress_callback: Hàm nhận (phần trăm, mô tả bước) để báo tiến độ
+            base_params: Siêu tham số ghi đè cho 3 base models
+
+        Returns:
+            Dict chứa metrics và thông tin huấn luyện
+        """
+        progress = progress_callback or (lambda pct, message: None)
+        version = store.resolve_version(version)
+        progress(5, f"Đọc dữ liệu huấn luyện (phiên bản {version})")
+        train_df = store.read(version, partitions=[0])
+        test_df = store.read(version, partitions=[1])
+        return self._train_split(train_df, test_df, progress, base_params, version)
+
+    def _train_split(
+        self,
+        train_df: pd.DataFrame,
+        test_df: pd.DataFrame,
+        progress: Callable[[int, str], None],
+        base_params: Optional[Dict[str, Dict[str, Any]]],
+        data_version: Optional[int]
+    ) -> Dict[str, Any]:
+        """Huấn luyện Stacking, hiệu chỉnh PD và mô hình LGD/EAD trên tập train/test đã chia"""
+        self.X_train, self.X_test = train_df[MODEL_COLS], test_df[MODEL_COLS]
+        self.y_train, self.y_test = train_df['default'].astype(int), test_df['default'].astype(int)
+        self.data_version = data_version
+
+        # Xây dựng mô hình
+        self.build_model(base_params)
+        self.feature_means = self.X_train.mean().to_numpy(dtype=np.float64)
+
+        # Train mô hình Stacking (base models fit một lần, dùng chung cho PD riêng biệt)
+        logger.info("Đang huấn luyện mô hình Stacking Classifier")
+        progress(15, "Huấn luyện mô hình Stacking (5-fold)")
+        self._fit_stacking()
 
         # Đánh giá mô hình
-        y_pred_in = self.model.predict(self.X_train)
-        y_proba_in = self.model.predict_proba(self.X_train)[:, 1]
-        y_pred_out = self.model.predict(self.X_test)
-        y_proba_out = self.model.predict_proba(self.X_test)[:, 1]
-
-        # Tính metrics
-        self.metrics_in = {
-            "accuracy": accuracy_score(self.y_train, y_pred_in),
-            "precision": precision_score(self.y_train, y_pred_in, zero_division=0),
-            "recall": recall_score(self.y_train, y_pred_in, zero_division=0),
-            "f1": f1_score(self.y_train, y_pred_in, zero_division=0),
-            "auc": roc_auc_score(self.y_train, y_proba_in),
-        }
+        progress(85, "Đánh giá mô hình")
+        self.metrics_in, self.metrics_out = self._meta_metrics(self.model.final_estimator_)
 
-        self.metrics_out = {
-            "accuracy": accuracy_score(self.y_test, y_pred_out),
-            "precision": precision_score(self.y_test, y_pred_out, zero_division=0),
-            "recall": recall_score(self.y_test, y_pred_out, zero_division=0),
-            "f1": f1_score(self.y_test, y_pred_out, zero_division=0),
-            "auc": roc_auc_score(self.y_test, y_proba_out),
-        }
+        # Hiệu chỉnh PD (isotonic/Platt) trên PD out-of-fold
+        self.calibrator, self.calibration_report = self._fit_calibration(self.model.final_estimator_, self.meta_params)
+
+        # Mô hình LGD/EAD cho tổn thất kỳ vọng (cùng tập train/test với mô hình PD)
+        el_metrics = None
+        self.el_model = None
+        if ExpectedLossModel.has_targets(train_df):
+            progress(90, "Huấn luyện mô hình LGD/EAD")
+            self.el_model = ExpectedLossModel()
+            el_metrics = self.el_model.train(train_df, test_df)
 
-        print("✅ Huấn luyện hoàn tất!")
+        logger.info("Huấn luyện hoàn tất")
+        record_model_load('credit_stacking', 'train')
 
         return {
             "status": "success",
@@ -147,7 +365,275 @@ class CreditRiskModel:
             "train_samples": len(self.X_train),
             "test_samples": len(self.X_test),
             "metrics_train": self.metrics_in,
-            "metrics_test": self.metrics_out
+            "metrics_test": self.metrics_out,
+            "metrics_lgd_ead": el_metrics,
+            "base_params": self.base_params,
+            "meta_params": self.meta_params,
+            "threshold": self.threshold,
+            "calibration": self.calibration_report,
+            "data_version": self.data_version
+        }
+
+    @staticmethod
+    def _store_split(store: TrainingStore, train_df: pd.DataFrame, test_df: pd.DataFrame, parent: Optional[int] = None) -> int:
+        """
+        Ghi các dòng train rồi test (giữ thứ tự) vào kho, cột 'split': 0 = train, 1 = test
+
+        Returns:
+            Số phiên bản mới của kho
+        """
+        cols = ['default'] + MODEL_COLS + [col for col in TARGET_COLS if col in train_df.columns]
+        frame = pd.concat([train_df[cols], test_df[cols]], ignore_index=True)
+        frame['default'] = frame['default'].astype(np.int8)
+        frame['split'] = np.repeat(np.array([0, 1], dtype=np.int8), [len(train_df), len(test_df)])
+        return store.write(frame, parent=parent)
+
+    def _meta_metrics(self, meta: LogisticRegression) -> Tuple[Dict[str, float], Dict[str, float]]:
+        """Metrics train/test của Stacking với meta-model cho trước, tính từ PD base models đã lưu (không gọi base models)"""
+        cache = self.stack_cache
+        return tuple(
+            classification_metrics(cache[y_key], meta.predict(cache[key]), meta.predict_proba(cache[key])[:, 1])
+            for key, y_key in (('train_base', 'y_train'), ('test_base', 'y_test'))
+        )
+
+    def _require_stack_cache(self) -> Dict[str, np.ndarray]:
+        if self.model is None:
+            raise ValueError("Mô hình chưa được huấn luyện. Vui lòng huấn luyện trước.")
+        if self.stack_cache is None:
+            raise ValueError("Mô hình không có dự báo OOF đi kèm (VD: huấn luyện bằng phiên bản cũ). Vui lòng huấn luyện lại.")
+        return self.stack_cache
+
+    def refit_meta(self, meta_params: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Fit lại riêng meta-model trên dự báo OOF đã lưu (vài ms, không fit lại base models)
+        Thay đổi chính đối tượng này: server gọi trên bản sao rồi publish (training_jobs.run_inline)
+
+        Args:
+            meta_params: Siêu tham số meta-model ghi đè DEFAULT_META_PARAMS, VD: {'C': 0.1, 'class_weight': 'balanced'}
+
+        Returns:
+            Dict chứa meta_params, metrics train/test mới và thời gian fit
+        """
+        cache = self._require_stack_cache()
+        started = time.perf_counter()
+        params = {**DEFAULT_META_PARAMS, **(meta_params or {})}
+        meta = make_meta_learner(params).fit(cache['oof'], cache['y_train'])
+
+        model = copy.copy(self.model)  # Dùng chung base models đã fit, chỉ thay meta-model
+        model.final_estimator = make_meta_learner(params)
+        model.final_estimator_ = meta
+        metrics_in, metrics_out = self._meta_metrics(meta)
+        calibrator, calibration_report = self._fit_calibration(meta, params)
+
+        self.model = model
+        self.meta_params = params
+        self.metrics_in, self.metrics_out = metrics_in, metrics_out
+        self.calibrator, self.calibration_report = calibrator, calibration_report
+        logger.info("Đã fit lại meta-model với %s", params)
+
+        return {
+            "meta_params": params,
+            "metrics_train": metrics_in,
+            "metrics_test": metrics_out,
+            "calibration": calibration_report,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+
+    def recalibrate_threshold(self, threshold: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Đặt lại ngưỡng phân loại Default (mặc định 15%)
+        Thay đổi chính đối tượng này: server gọi trên bản sao rồi publish (training_jobs.run_inline)
+
+        Args:
+            threshold: Ngưỡng mới (0-1). None = chọn ngưỡng F1 cao nhất trên PD Stacking out-of-fold
+                       (meta-model fit trên các fold còn lại của ma trận OOF)
+
+        Returns:
+            Dict chứa ngưỡng mới, cách chọn và precision/recall/F1 trên tập test theo ngưỡng
+        """
+        cache = self._require_stack_cache()
+        started = time.perf_counter()
+        if threshold is None:
+            meta_params = self.meta_params
+            oof_pd = stacking_oof_pd(cache['oof'], cache['y_train'], cache['fold_ids'], lambda: make_meta_learner(meta_params))
+            precision, recall, thresholds = precision_recall_curve(cache['y_train'], oof_pd)
+            f1 = 2 * precision * recall / np.maximum(precision + recall, 1e-12)
+            threshold = float(thresholds[np.argmax(f1[:-1])])
+            method = "max_f1_oof"
+        elif not 0.0 < threshold < 1.0:
+            raise ValueError("Ngưỡng phải nằm trong khoảng (0, 1)")
+        else:
+            threshold = float(threshold)
+            method = "manual"
+
+        test_pd = self.model.final_estimator_.predict_proba(cache['test_base'])[:, 1]
+        test_pred = (test_pd >= threshold).astype(int)
+        self.threshold = threshold
+        logger.info("Ngưỡng phân loại mới: %.4f (%s)", threshold, method)
+
+        return {
+            "threshold": threshold,
+            "method": method,
+            "metrics_test": {
+                "precision": precision_score(cache['y_test'], test_pred, zero_division=0),
+                "recall": recall_score(cache['y_test'], test_pred, zero_division=0),
+                "f1": f1_score(cache['y_test'], test_pred, zero_division=0),
+                "default_rate_predicted": float(test_pred.mean()),
+            },
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+
+    def train_append(
+        self,
+        csv_file_path: str,
+        store: TrainingStore,
+        extra_trees: Optional[int] = None,
+        extra_rounds: Optional[int] = None,
+        progress_callback: Optional[Callable[[int, str], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Huấn luyện tiếp (warm start) với các dòng có nhãn mới, không fit lại từ đầu
+
+        - Dòng mới được chia train/test 80/20 và ghi thêm vào kho (phiên bản mới, không ghi lại dữ liệu cũ)
+        - Random Forest thêm cây (warm_start), XGBoost thêm vòng boosting tiếp từ booster hiện tại,
+          Logistic Regression fit lại (rẻ); meta-model fit lại trên ma trận OOF mở rộng: dòng train mới
+          dùng PD của base models phiên bản trước (chưa thấy các dòng này)
+        - So sánh metrics với mô hình phiên bản trước trên cùng tập test (drift)
+
+        Args:
+            csv_file_path: File CSV chỉ gồm các dòng mới (X_1 → X_14 + 'default', tùy chọn LGD/EAD)
+            store: Kho dữ liệu huấn luyện chứa phiên bản self.data_version
+            extra_trees: Số cây Random Forest thêm. None = theo tỷ lệ dòng train mới (tối thiểu 1)
+            extra_rounds: Số vòng XGBoost thêm. None = theo tỷ lệ dòng train mới (tối thiểu 1)
+            progress_callback: Hàm nhận (phần trăm, mô tả bước) để báo tiến độ
+
+        Returns:
+            Dict chứa metrics mới, drift so với phiên bản trước, số dòng, phiên bản dữ liệu và thời gian
+        """
+        progress = progress_callback or (lambda pct, message: None)
+        cache = self._require_stack_cache()
+        if self.data_version is None:
+            raise ValueError("Mô hình chưa gắn với kho dữ liệu huấn luyện. Vui lòng huấn luyện lại đầy đủ bằng /train.")
+        started = time.perf_counter()
+
+        progress(5, "Đọc dữ liệu mới và dữ liệu đã lưu")
+        new_df = pd.read_csv(csv_file_path)
+        missing = [c for c in ['default'] + MODEL_COLS if c not in new_df.columns]
+        if missing:
+            raise ValueError(f"Thiếu cột: {missing}. Vui lòng kiểm tra lại file CSV.")
+        if len(new_df) == 0:
+            raise ValueError("File không có dòng dữ liệu mới")
+        new_df['default'] = new_df['default'].astype(int)
+
+        old_train = store.read(self.data_version, partitions=[0])
+        old_test = store.read(self.data_version, partitions=[1])
+        if len(old_train) != len(cache['y_train']):
+            raise ValueError("Kho dữ liệu không khớp với dự báo OOF của mô hình. Vui lòng huấn luyện lại đầy đủ bằng /train.")
+
+        # Chia dòng mới 80/20 (phân tầng nếu đủ dòng mỗi lớp, nếu không tất cả vào train)
+        try:
+            new_train, new_test = train_test_split(new_df, test_size=0.2, random_state=42, stratify=new_df['default'])
+        except ValueError:
+            new_train, new_test = new_df, new_df.iloc[:0]
+
+        X_train = pd.concat([old_train[MODEL_COLS], new_train[MODEL_COLS]], ignore_index=True)
+        y_train = pd.concat([old_train['default'], new_train['default']], ignore_index=True).astype(int)
+        X_test = pd.concat([old_test[MODEL_COLS], new_test[MODEL_COLS]], ignore_index=True)
+        y_test = pd.concat([old_test['default'], new_test['default']], ignore_index=True).astype(int)
+
+        # Mô hình phiên bản trước: PD cho dòng train mới (OOF của meta-model) và tập test chung để đo drift
+        progress(15, "Đánh giá mô hình phiên bản trước")
+        new_train_base = self._base_probabilities(new_train)
+        previous_test_pd = self.model.final_estimator_.predict_proba(self._base_probabilities(X_test))[:, 1]
+        previous_metrics = classification_metrics(y_test, (previous_test_pd >= 0.5).astype(int), previous_test_pd)
+        previous_version, previous_metrics_recorded = self.data_version, self.metrics_out
+
+        # Warm start base models trên toàn bộ tập train (cũ + mới); các đối tượng này cũng là estimators_ của Stacking
+        growth = len(new_train) / max(len(old_train), 1)
+        rf, xgb_model = self.model_rf, self.model_xgb
+        extra_trees = extra_trees or max(1, math.ceil(rf.n_estimators * growth))
+        total_rounds = xgb_model.get_booster().num_boosted_rounds()
+        extra_rounds = extra_rounds or max(1, math.ceil(total_rounds * growth))
+
+        progress(30, f"Random Forest: thêm {extra_trees} cây")
+        rf.set_params(warm_start=True, n_estimators=rf.n_estimators + extra_trees)
+        rf.fit(X_train, y_train)
+        rf.set_params(warm_start=False)
+
+        progress(55, f"XGBoost: thêm {extra_rounds} vòng boosting")
+        xgb_model.set_params(n_estimators=extra_rounds)
+        xgb_model.fit(X_train, y_train, xgb_model=xgb_model.get_booster())
+
+        progress(75, "Fit lại Logistic Regression và meta-model")
+        self.model_logistic.fit(X_train, y_train)
+        self.base_params = {
+            **self.base_params,
+            'random_forest': {**self.base_params['random_forest'], 'n_estimators': rf.n_estimators},
+            'xgboost': {**self.base_params['xgboost'], 'n_estimators': xgb_model.get_booster().num_boosted_rounds()},
+        }
+
+        self.X_train, self.X_test, self.y_train, self.y_test = X_train, X_test, y_train, y_test
+        self.feature_means = X_train.mean().to_numpy(dtype=np.float64)
+        new_fold_ids = np.empty(len(new_train), dtype=np.int8)
+        for label in (0, 1):
+            # Fold xoay vòng trong từng lớp (phân tầng, dùng được cả khi ít dòng)
+            idx = np.flatnonzero(new_train['default'].to_numpy() == label)
+            new_fold_ids[idx] = np.arange(len(idx)) % STACKING_CV
+        self.stack_cache = {
+            'oof': np.vstack([cache['oof'], new_train_base]),
+            'fold_ids': np.concatenate([cache['fold_ids'], new_fold_ids]),
+            'y_train': y_train.to_numpy(dtype=np.int8),
+            'train_base': self._base_probabilities(X_train),
+            'test_base': self._base_probabilities(X_test),
+            'y_test': y_test.to_numpy(dtype=np.int8),
+        }
+        self.model.final_estimator_ = make_meta_learner(self.meta_params).fit(self.stack_cache['oof'], y_train)
+        self._explainer = None
+
+        progress(85, "Đánh giá mô hình")
+        self.metrics_in, self.metrics_out = self._meta_metrics(self.model.final_estimator_)
+        self.calibrator, self.calibration_report = self._fit_calibration(self.model.final_estimator_, self.meta_params)
+
+        el_metrics = None
+        if ExpectedLossModel.has_targets(old_train):
+            progress(90, "Huấn luyện lại mô hình LGD/EAD")
+            self.el_model = ExpectedLossModel()
+            el_metrics = self.el_model.train(
+                pd.concat([old_train, new_train.reindex(columns=old_train.columns)], ignore_index=True),
+                pd.concat([old_test, new_test.reindex(columns=old_test.columns)], ignore_index=True)
+            )
+
+        self.data_version = self._store_split(store, new_train, new_test, parent=previous_version)
+        test_pd = self.model.final_estimator_.predict_proba(self.stack_cache['test_base'])[:, 1]
+        logger.info("Huấn luyện tiếp hoàn tất: +%d dòng, phiên bản dữ liệu %d", len(new_df), self.data_version)
+        record_model_load('credit_stacking', 'train')
+
+        return {
+            "status": "success",
+            "message": "Mô hình đã được huấn luyện tiếp với dữ liệu mới!",
+            "new_rows": {"train": len(new_train), "test": len(new_test)},
+            "train_samples": len(X_train),
+            "test_samples": len(X_test),
+            "extra_trees": extra_trees,
+            "extra_rounds": extra_rounds,
+            "metrics_train": self.metrics_in,
+            "metrics_test": self.metrics_out,
+            "metrics_lgd_ead": el_metrics,
+            "drift": {
+                "previous_data_version": previous_version,
+                "metrics_test_previous_recorded": previous_metrics_recorded,
+                "metrics_test_previous_model": previous_metrics,
+                "metrics_test_delta": {key: self.metrics_out[key] - value for key, value in previous_metrics.items()},
+                "mean_abs_pd_change": float(np.mean(np.abs(test_pd - previous_test_pd))),
+                "default_rate": {
+                    "previous_train": float(old_train['default'].mean()),
+                    "new_rows": float(new_df['default'].mean()),
+                },
+            },
+            "base_params": self.base_params,
+            "calibration": self.calibration_report,
+            "data_version": self.data_version,
+            "elapsed_seconds": round(time.perf_counter() - started, 3)
         }
 
     def predict(self, X_new: pd.DataFrame) -> Dict[str, Any]:
@@ -160,24 +646,29 @@ class CreditRiskModel:
         Returns:
             Dict chứa PD từ 4 models và kết quả dự đoán
         """
-        if self.model is None:
+        state = snapshot(self)
+        if state.model is None:
             raise ValueError("Mô hình chưa được huấn luyện. Vui lòng huấn luyện trước khi dự báo.")
 
         # Đảm bảo thứ tự cột đúng
         X_new = X_new[MODEL_COLS]
 
         # 1. PD từ Stacking Model (kết quả chính)
-        probs_stacking = self.model.predict_proba(X_new)[:, 1]
+        with stage_timer('predict_proba.stacking'):
+            probs_stacking = state.model.predict_proba(X_new)[:, 1]
 
         # 2. PD từ 3 Base Models
-        probs_logistic = self.model_logistic.predict_proba(X_new)[:, 1]
-        probs_rf = self.model_rf.predict_proba(X_new)[:, 1]
-        probs_xgb = self.model_xgb.predict_proba(X_new)[:, 1]
+        with stage_timer('predict_proba.logistic'):
+            probs_logistic = state.model_logistic.predict_proba(X_new)[:, 1]
+        with stage_timer('predict_proba.random_forest'):
+            probs_rf = state.model_rf.predict_proba(X_new)[:, 1]
+        with stage_timer('predict_proba.xgboost'):
+            probs_xgb = state.model_xgb.predict_proba(X_new)[:, 1]
 
-        # Ngưỡng phân loại: PD >= 15% = Default
-        preds = (probs_stacking >= 0.15).astype(int)
+        # Ngưỡng phân loại: PD >= ngưỡng (mặc định 15%) = Default
+        preds = (probs_stacking >= state.threshold).astype(int)
 
-        return {
+        result = {
             "pd_stacking": float(probs_stacking[0]),
             "pd_logistic": float(probs_logistic[0]),
             "pd_random_forest": float(probs_rf[0]),
@@ -185,6 +676,87 @@ class CreditRiskModel:
             "prediction": int(preds[0]),
             "prediction_label": "Default (Vỡ nợ)" if preds[0] == 1 else "Non-Default (Không vỡ nợ)"
         }
+        # PD đã hiệu chỉnh (tần suất vỡ nợ thực tế kỳ vọng); không có với mô hình huấn luyện bằng phiên bản cũ
+        if state.calibrator is not None:
+            result["pd_stacking_calibrated"] = float(state.calibrator.transform(probs_stacking)[0])
+        return result
+
+    def _get_explainer(self) -> StackingExplainer:
+        explainer = self._explainer
+        if explainer is None or explainer.model is not self.model:
+            # Mô hình đã thay (huấn luyện lại, /refit-meta, load file): dựng lại bảng tra cứu của cây
+            explainer = StackingExplainer(self.model, self.feature_means)
+            self._explainer = explainer
+        return explainer
+
+    def explain(self, X: pd.DataFrame, top_k: int = 5) -> List[Dict[str, Any]]:
+        """
+        Đóng góp của từng chỉ số vào PD Stacking cho nhiều dòng (một lần tính cho cả lô)
+
+        Args:
+            X: DataFrame chứa 14 chỉ số X_1 đến X_14
+            top_k: Số chỉ số đóng góp lớn nhất trả về mỗi dòng
+
+        Returns:
+            Danh sách theo dòng: base_pd (PD nền) và top_contributions (đóng góp theo PD, dương = làm tăng PD)
+        """
+        state = snapshot(self)
+        if state.model is None:
+            raise ValueError("Mô hình chưa được huấn luyện. Vui lòng huấn luyện trước khi dự báo.")
+
+        with stage_timer('explain.stacking'):
+            explained = state._get_explainer().explain(X)
+            tops = top_contributions(X[MODEL_COLS].to_numpy(dtype=np.float64), explained['contributions'], top_k)
+        return [
+            {"base_pd": float(base_pd), "top_contributions": top}
+            for base_pd, top in zip(explained['base_pd'], tops)
+        ]
+
+    def predict_batch(self, X: pd.DataFrame, explain: bool = False, top_k: int = 5) -> List[Dict[str, Any]]:
+        """
+        Dự báo PD Stacking (thô + đã hiệu chỉnh) cho nhiều dòng, tùy chọn kèm giải thích
+
+        Args:
+            X: DataFrame chứa 14 chỉ số X_1 đến X_14
+            explain: True = kèm đóng góp của từng chỉ số
+            top_k: Số chỉ số đóng góp lớn nhất mỗi dòng
+
+        Returns:
+            Danh sách theo dòng: pd_stacking, pd_stacking_calibrated, prediction (và explanation)
+        """
+        state = snapshot(self)
+        probs = state.predict_pd_batch(X)
+        calibrated = state.calibrator.transform(probs) if state.calibrator is not None else probs
+        preds = probs >= state.threshold
+        rows = [
+            {"pd_stacking": float(p), "pd_stacking_calibrated": float(c), "prediction": int(d)}
+            for p, c, d in zip(probs, calibrated, preds)
+        ]
+        if explain:
+            for row, explanation in zip(rows, state.explain(X, top_k)):
+                row["explanation"] = explanation
+        return rows
+
+    def predict_pd_batch(self, X: pd.DataFrame, calibrated: bool = False) -> np.ndarray:
+        """
+        PD (Stacking) cho nhiều dòng trong một lần predict_proba
+
+        Args:
+            X: DataFrame chứa 14 chỉ số X_1 đến X_14
+            calibrated: True = PD đã hiệu chỉnh (nếu mô hình có calibrator)
+
+        Returns:
+            Mảng PD theo thứ tự dòng
+        """
+        state = snapshot(self)
+        if state.model is None:
+            raise ValueError("Mô hình chưa được huấn luyện. Vui lòng huấn luyện trước khi dự báo.")
+
+        with stage_timer('predict_proba.stacking'):
+            probs = state.model.predict_proba(X[MODEL_COLS])[:, 1]
+        if calibrated and state.calibrator is not None:
+            probs = state.calibrator.transform(probs)
+        return probs
 
     def save_model(self, filepath: str = "model_stacking.pkl"):
         """Lưu mô hình ra file"""
@@ -197,13 +769,34 @@ class CreditRiskModel:
             "model_rf": self.model_rf,
             "model_xgb": self.model_xgb,
             "metrics_in": self.metrics_in,
-            "metrics_out": self.metrics_out
+            "metrics_out": self.metrics_out,
+            "el_model": self.el_model,
+            "base_params": self.base_params,
+            "meta_params": self.meta_params,
+            "threshold": self.threshold,
+            "calibrator": self.calibrator,
+            "calibration_report": self.calibration_report,
+            "feature_means": self.feature_means,
+            "data_version": self.data_version,
+            "stack_cache_token": None
         }
 
-        with open(filepath, 'wb') as f:
-            pickle.dump(model_data, f)
+        # Dự báo OOF lưu riêng dạng .npz (gọn, đọc được không cần unpickle); token khớp cặp file pkl/npz
+        if self.stack_cache is not None:
+            model_data["stack_cache_token"] = uuid.uuid4().hex
+            atomic_savez(oof_artifact_path(filepath), token=np.array(model_data["stack_cache_token"]), **self.stack_cache)
+
+        # Ghi ra file tạm rồi os.replace: process khác (VD: /predict load lười) không bao giờ đọc phải file ghi dở
+        tmp_path = f"{filepath}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(model_data, f)
+            os.replace(tmp_path, filepath)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
 
-        print(f"✅ Mô hình đã được lưu tại: {filepath}")
+        logger.info("Mô hình đã được lưu tại: %s", filepath)
 
     def load_model(self, filepath: str = "model_stacking.pkl"):
         """Load mô hình từ file"""
@@ -219,8 +812,29 @@ class CreditRiskModel:
         self.model_xgb = model_data["model_xgb"]
         self.metrics_in = model_data["metrics_in"]
         self.metrics_out = model_data["metrics_out"]
-
-        print(f"✅ Mô hình đã được load từ: {filepath}")
+        self.el_model = model_data.get("el_model")  # File cũ không có mô hình LGD/EAD
+        self.base_params = model_data.get("base_params", DEFAULT_BASE_PARAMS)
+        self.meta_params = model_data.get("meta_params", dict(DEFAULT_META_PARAMS))
+        self.threshold = model_data.get("threshold", DEFAULT_THRESHOLD)
+        self.calibrator = model_data.get("calibrator")
+        self.calibration_report = model_data.get("calibration_report")
+        self.feature_means = model_data.get("feature_means")
+        self.data_version = model_data.get("data_version")
+        self.stack_cache = self._load_stack_cache(oof_artifact_path(filepath), model_data.get("stack_cache_token"))
+
+        record_model_load('credit_stacking', 'file')
+        logger.info("Mô hình đã được load từ: %s", filepath)
+
+    @staticmethod
+    def _load_stack_cache(path: str, token: Optional[str]) -> Optional[Dict[str, np.ndarray]]:
+        """Đọc file OOF đi kèm; bỏ qua nếu không có hoặc không thuộc file mô hình này"""
+        if token is None or not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if str(data['token']) != token:
+                logger.warning("File OOF %s không khớp với mô hình, bỏ qua", path)
+                return None
+            return {key: data[key] for key in data.files if key != 'token'}
 
 
 # Khởi tạo instance global
@@ -0,0 +1,34 @@
+"""
+Model State Module - Đọc trạng thái mô hình nhất quán trong một request
+- Job huấn luyện publish mô hình mới bằng một phép gán thay cả __dict__ của đối tượng dùng chung (training_jobs)
+- Bản chụp (snapshot) giữ __dict__ tại thời điểm chụp: mọi thuộc tính đọc từ bản chụp (mô hình, scaler,
+  ngưỡng, bảng tra cứu tính sẵn khi train) thuộc cùng một lần huấn luyện, kể cả khi job publish giữa chừng
+"""
+
+import functools
+from typing import Callable, TypeVar
+
+T = TypeVar('T')
+
+
+def snapshot(obj: T) -> T:
+    """
+    Bản chụp trạng thái hiện tại của một mô hình dùng chung (không copy dữ liệu)
+
+    Args:
+        obj: Đối tượng mô hình (VD: credit_model, early_warning_system, anomaly_system)
+
+    Returns:
+        Đối tượng cùng lớp dùng chung __dict__ hiện tại của obj
+    """
+    state = obj.__class__.__new__(obj.__class__)
+    state.__dict__ = obj.__dict__
+    return state
+
+
+def on_snapshot(method: Callable) -> Callable:
+    """Decorator: phương thức đọc nhiều thuộc tính chạy trên bản chụp trạng thái lúc được gọi"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return method(snapshot(self), *args, **kwargs)
+    return wrapper
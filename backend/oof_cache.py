@@ -0,0 +1,155 @@
+"""
+OOF Cache Module - Cache fold cross-validation và dự báo out-of-fold (OOF) của base models
+- Fold giống hệt StackingClassifier(cv=5) với bài toán phân loại: StratifiedKFold(5), không shuffle
+- Dự báo OOF của một base model (theo bộ siêu tham số) chỉ tính một lần cho mỗi bộ dữ liệu; meta-learner
+  có thể được tinh chỉnh / fit lại trên ma trận OOF mà không phải fit lại base models
+- Lưu dạng .npz trong OOF_CACHE_DIR (mặc định ./oof_cache), ghi bằng os.replace nên nhiều process dùng chung an toàn
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import numpy as np
+from sklearn.model_selection import StratifiedKFold
+
+DEFAULT_N_SPLITS = 5
+
+
+def dataset_fingerprint(X, y) -> str:
+    """
+    Mã băm của bộ dữ liệu (giá trị + thứ tự dòng), dùng làm khóa cache
+
+    Args:
+        X: Ma trận features (DataFrame hoặc ndarray)
+        y: Nhãn
+
+    Returns:
+        Chuỗi hex 16 ký tự
+    """
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(np.asarray(X, dtype=np.float64)).tobytes())
+    digest.update(np.ascontiguousarray(np.asarray(y, dtype=np.int64)).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def params_key(learner: str, params: Dict[str, Any]) -> str:
+    """Khóa ổn định cho (base model, bộ siêu tham số)"""
+    payload = json.dumps({'learner': learner, 'params': params}, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def atomic_savez(path: str, **arrays):
+    """Ghi .npz (nén) ra file tạm rồi os.replace: process khác không bao giờ đọc phải file ghi dở"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def stratified_fold_ids(X, y, n_splits: int = DEFAULT_N_SPLITS) -> np.ndarray:
+    """
+    Fold của từng dòng (0..n_splits-1), cùng cách chia với StackingClassifier(cv=n_splits)
+
+    Args:
+        X: Ma trận features
+        y: Nhãn
+        n_splits: Số fold
+
+    Returns:
+        Mảng int8 độ dài n_samples
+    """
+    fold_ids = np.empty(len(y), dtype=np.int8)
+    for fold, (_, val_idx) in enumerate(StratifiedKFold(n_splits=n_splits).split(X, y)):
+        fold_ids[val_idx] = fold
+    return fold_ids
+
+
+class OOFCache:
+    """Cache fold và dự báo OOF trên đĩa (kèm bản trong bộ nhớ của process hiện tại)"""
+
+    def __init__(self, cache_dir: str = None):
+        """
+        Args:
+            cache_dir: Thư mục cache. None = OOF_CACHE_DIR (mặc định ./oof_cache)
+        """
+        self.cache_dir = cache_dir or os.getenv("OOF_CACHE_DIR", "oof_cache")
+        self._memory: Dict[str, Dict[str, np.ndarray]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, f"{name}.npz")
+
+    def _load(self, name: str) -> Optional[Dict[str, np.ndarray]]:
+        with self._lock:
+            if name in self._memory:
+                return self._memory[name]
+        path = self._path(name)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                arrays = {key: data[key] for key in data.files}
+        except (OSError, ValueError):
+            return None  # File hỏng → tính lại
+        with self._lock:
+            self._memory[name] = arrays
+        return arrays
+
+    def _store(self, name: str, **arrays):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        atomic_savez(self._path(name), **arrays)
+        with self._lock:
+            self._memory[name] = arrays
+
+    def get_folds(self, X, y, n_splits: int = DEFAULT_N_SPLITS, fingerprint: str = None) -> np.ndarray:
+        """
+        Fold của từng dòng (stratified_fold_ids), có cache theo bộ dữ liệu
+
+        Args:
+            X: Ma trận features
+            y: Nhãn
+            n_splits: Số fold
+            fingerprint: Mã băm dữ liệu (None = tự tính)
+
+        Returns:
+            Mảng int8 độ dài n_samples
+        """
+        fingerprint = fingerprint or dataset_fingerprint(X, y)
+        name = f"folds_{fingerprint}_{n_splits}"
+        cached = self._load(name)
+        if cached is not None:
+            return cached['fold_ids']
+
+        fold_ids = stratified_fold_ids(X, y, n_splits)
+        self._store(name, fold_ids=fold_ids)
+        return fold_ids
+
+    def get_oof(self, fingerprint: str, learner: str, params: Dict[str, Any]) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Dự báo OOF đã cache của (base model, siêu tham số) trên bộ dữ liệu
+
+        Returns:
+            Dict {'oof': xác suất lớp 1 theo dòng, 'latency_ms': [độ trễ dự báo 1 dòng], 'fit_seconds': [...]}
+            hoặc None nếu chưa có
+        """
+        cached = self._load(f"oof_{fingerprint}_{params_key(learner, params)}")
+        with self._lock:
+            if cached is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return cached
+
+    def put_oof(self, fingerprint: str, learner: str, params: Dict[str, Any], oof: np.ndarray, **extra: float):
+        """Lưu dự báo OOF (và số liệu đi kèm như latency_ms, fit_seconds)"""
+        arrays = {'oof': np.asarray(oof, dtype=np.float64)}
+        arrays.update({key: np.asarray([value], dtype=np.float64) for key, value in extra.items()})
+        self._store(f"oof_{fingerprint}_{params_key(learner, params)}", **arrays)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'cache_dir': self.cache_dir, 'hits': self.hits, 'misses': self.misses}
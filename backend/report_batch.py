@@ -0,0 +1,191 @@
+"""
+Report Batch Module - Xuất báo cáo Word hàng loạt cho cả danh mục khách hàng
+Các báo cáo được tạo song song trên process pool và ghi lần lượt vào một file ZIP được stream
+về client ngay khi từng báo cáo hoàn tất (không giữ toàn bộ báo cáo trong bộ nhớ)
+"""
+
+import io
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from gemini_api import get_cached_credit_analysis
+from report_generator import ReportGenerator
+
+# Số process tạo báo cáo (REPORT_BATCH_WORKERS, mặc định = số CPU)
+DEFAULT_WORKERS = os.cpu_count() or 2
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _worker_count() -> int:
+    return int(os.getenv("REPORT_BATCH_WORKERS", DEFAULT_WORKERS))
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """
+    Process pool dùng chung (tạo lười, các worker giữ sẵn template biểu đồ giữa các batch)
+    spawn: không fork process server đang có thread (event loop, threadpool, OpenMP)
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=_worker_count(), mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _reset_pool(pool: ProcessPoolExecutor):
+    """Bỏ pool hỏng (worker chết đột ngột, VD: hết bộ nhớ): batch sau tạo pool mới"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pool():
+    """Đóng process pool (gọi khi tắt server)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _render_report(report_data: Dict[str, Any], include_analysis: bool) -> bytes:
+    """Tạo một báo cáo Word trong process worker, trả về nội dung file docx"""
+    buffer = io.BytesIO()
+    ReportGenerator().generate_report(report_data, buffer, include_analysis=include_analysis)
+    return buffer.getvalue()
+
+
+def _entry_name(index: int, report_data: Dict[str, Any]) -> str:
+    """Tên file trong ZIP: số thứ tự + tên khách hàng (nếu có)"""
+    name = str(report_data.get('name') or report_data.get('company_name') or 'bao_cao_tin_dung')
+    name = re.sub(r'[^\w\-. ]', '_', name).strip() or 'bao_cao_tin_dung'
+    return f"{index + 1:03d}_{name[:80]}"
+
+
+def _resolve_analysis(report_data: Dict[str, Any], include_analysis: bool, use_cached_analysis: bool) -> Dict[str, Any]:
+    """Chọn nội dung phân tích cho báo cáo mà không gọi Gemini"""
+    if not include_analysis or report_data.get('analysis'):
+        return report_data
+
+    analysis = None
+    if use_cached_analysis:
+        try:
+            analysis = get_cached_credit_analysis(report_data)
+        except Exception:
+            analysis = None  # Dữ liệu lỗi sẽ được báo trong LOI.txt khi tạo báo cáo
+    return {**report_data, 'analysis': analysis or 'Không có phân tích'}
+
+
+class _ZipStream(io.RawIOBase):
+    """Stream chỉ-ghi, không seek được: zipfile ghi vào đây, generator lấy dữ liệu ra để gửi đi"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_reports_zip(
+    reports: List[Dict[str, Any]],
+    include_analysis: bool = True,
+    use_cached_analysis: bool = False,
+    max_in_flight: int = None
+) -> Iterator[bytes]:
+    """
+    Tạo ZIP báo cáo Word cho danh sách khách hàng, yield từng đoạn ZIP khi báo cáo hoàn tất
+
+    Args:
+        reports: Danh sách dữ liệu báo cáo (cùng định dạng với /export-report, tùy chọn 'name')
+        include_analysis: False = bỏ phần phân tích Gemini trong mọi báo cáo
+        use_cached_analysis: True = báo cáo không kèm 'analysis' sẽ lấy phân tích đã cache từ /analyze
+        max_in_flight: Số báo cáo tối đa đang tạo/chờ ghi cùng lúc (mặc định 2 x số worker)
+
+    Yields:
+        Các đoạn bytes của file ZIP; báo cáo lỗi (kể cả khi process pool hỏng) được ghi vào LOI.txt,
+        file ZIP luôn đầy đủ vì header HTTP đã gửi đi trước đoạn đầu tiên
+    """
+    pool = _get_pool()
+    max_in_flight = max_in_flight or 2 * _worker_count()
+
+    stream = _ZipStream()
+    pending = {}
+    next_index = 0
+    errors = []
+
+    def record_error(index: int, error: Exception):
+        if isinstance(error, BrokenProcessPool):
+            _reset_pool(pool)
+        errors.append(f"{_entry_name(index, reports[index])}: {str(error) or type(error).__name__}")
+
+    def fill_pending():
+        nonlocal next_index
+        while next_index < len(reports) and len(pending) < max_in_flight:
+            index = next_index
+            next_index += 1
+            report_data = _resolve_analysis(reports[index], include_analysis, use_cached_analysis)
+            try:
+                future = pool.submit(_render_report, report_data, include_analysis)
+            except Exception as e:
+                # Pool hỏng hoặc đã đóng: ghi lỗi cho báo cáo thay vì cắt ngang file ZIP, batch sau tạo pool mới
+                _reset_pool(pool)
+                errors.append(f"{_entry_name(index, reports[index])}: {str(e) or type(e).__name__}")
+                continue
+            pending[future] = index
+
+    try:
+        # ZIP_STORED: docx đã được nén sẵn
+        with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_STORED) as archive:
+            fill_pending()
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    try:
+                        data = future.result()
+                    except Exception as e:
+                        record_error(index, e)
+                        continue
+                    archive.writestr(f"{_entry_name(index, reports[index])}.docx", data)
+
+                fill_pending()
+                chunk = stream.drain()
+                if chunk:
+                    yield chunk
+
+            if errors:
+                archive.writestr('LOI.txt', '\n'.join(errors))
+
+        yield stream.drain()
+
+    finally:
+        # Client ngắt kết nối giữa chừng → hủy các báo cáo chưa chạy
+        for future in pending:
+            future.cancel()
+
+
+def batch_filename() -> str:
+    """Tên file ZIP trả về cho client"""
+    return f"bao_cao_tin_dung_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
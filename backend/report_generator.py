@@ -6,19 +6,104 @@ Xuất 14 chỉ số, PD, biểu đồ và phân tích của Gemini ra file Word
 from docx import Document
 from docx.shared import Inches, Pt, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
-from typing import Dict, Any, List
-import matplotlib.pyplot as plt
+from docx.oxml.ns import qn
+from typing import Dict, Any, List, BinaryIO, Tuple, Union
+import copy
 import io
 import os
+import threading
 from datetime import datetime
+from chart_renderer import chart_renderer
+from metrics import timed_stage
+
+# DPI mặc định của biểu đồ (ghi đè bằng REPORT_CHART_DPI; 150 đủ nét khi in và nhẹ hơn ~4 lần)
+DEFAULT_CHART_DPI = 300
+
+# Chỗ giữ ngày tạo báo cáo trong template (thay bằng thời điểm tạo thật)
+DATE_PLACEHOLDER = '{{NGAY_TAO_BAO_CAO}}'
+
+# Template docx dựng sẵn một lần cho mỗi process: (Document đã parse, số block của phần footer)
+_template: Tuple[Any, int] = None
+_template_lock = threading.Lock()
+
+
+def get_report_template() -> Tuple[Any, int]:
+    """Lấy template báo cáo (styles, header, footer, lưu ý) đã dựng và parse sẵn"""
+    global _template
+    with _template_lock:
+        if _template is None:
+            blob, footer_size = ReportGenerator.build_template()
+            _template = (Document(io.BytesIO(blob)), footer_size)
+        return _template
+
+
+def clone_report_template() -> Tuple[Any, int]:
+    """Bản sao độc lập của template (deepcopy cây XML đã parse, nhanh hơn mở lại file docx)"""
+    template, footer_size = get_report_template()
+    with _template_lock:
+        return copy.deepcopy(template), footer_size
 
 
 class ReportGenerator:
     """Class để tạo báo cáo Word"""
 
-    def __init__(self):
-        self.doc = Document()
-        self.setup_styles()
+    def __init__(self, chart_dpi: int = None):
+        """
+        Khởi tạo báo cáo từ template dựng sẵn (chỉ còn phần nội dung động cần điền)
+
+        Args:
+            chart_dpi: DPI khi render biểu đồ. None = REPORT_CHART_DPI (mặc định 300)
+        """
+        self.doc, footer_size = clone_report_template()
+        self.chart_dpi = chart_dpi or int(os.getenv("REPORT_CHART_DPI", DEFAULT_CHART_DPI))
+
+        # Tách footer ra khỏi body, gắn lại sau khi đã thêm các phần nội dung
+        body = self.doc.element.body
+        blocks = [element for element in body.iterchildren() if element.tag != qn('w:sectPr')]
+        self._footer_blocks = blocks[len(blocks) - footer_size:] if footer_size else []
+        for element in self._footer_blocks:
+            body.remove(element)
+
+    @classmethod
+    def build_template(cls) -> Tuple[bytes, int]:
+        """
+        Dựng template báo cáo: styles, header (ngày tạo để trống), footer và lưu ý
+
+        Returns:
+            Tuple (nội dung file docx, số block thuộc phần footer)
+        """
+        builder = cls.__new__(cls)
+        builder.doc = Document()
+        builder.setup_styles()
+        builder.add_header(date_text=DATE_PLACEHOLDER)
+
+        body = builder.doc.element.body
+        blocks_before_footer = len(body) - 1  # Không tính sectPr
+        builder.add_footer()
+        footer_size = len(body) - 1 - blocks_before_footer
+
+        buffer = io.BytesIO()
+        builder.doc.save(buffer)
+        return buffer.getvalue(), footer_size
+
+    def _fill_header(self):
+        """Điền ngày tạo báo cáo vào header của template"""
+        date_text = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+        for paragraph in self.doc.paragraphs[:5]:
+            for run in paragraph.runs:
+                if DATE_PLACEHOLDER in run.text:
+                    run.text = run.text.replace(DATE_PLACEHOLDER, date_text)
+                    return
+
+    def _attach_footer(self):
+        """Gắn lại footer của template vào cuối báo cáo"""
+        sect_pr = self.doc.element.body.find(qn('w:sectPr'))
+        for element in self._footer_blocks:
+            if sect_pr is not None:
+                sect_pr.addprevious(element)
+            else:
+                self.doc.element.body.append(element)
+        self._footer_blocks = []
 
     def setup_styles(self):
         """Thiết lập styles cho document"""
@@ -27,8 +112,13 @@ class ReportGenerator:
         style.font.name = 'Times New Roman'
         style.font.size = Pt(12)
 
-    def add_header(self):
-        """Thêm header cho báo cáo"""
+    def add_header(self, date_text: str = None):
+        """
+        Thêm header cho báo cáo
+
+        Args:
+            date_text: Ngày tạo hiển thị trên báo cáo. None = thời điểm hiện tại
+        """
         # Title
         title = self.doc.add_heading('BÁO CÁO ĐÁNH GIÁ RỦI RO TÍN DỤNG DOANH NGHIỆP', 0)
         title.alignment = WD_ALIGN_PARAGRAPH.CENTER
@@ -44,7 +134,8 @@ class ReportGenerator:
         subtitle_run.font.color.rgb = RGBColor(100, 100, 100)
 
         # Ngày tạo báo cáo
-        date_para = self.doc.add_paragraph(f'Ngày tạo báo cáo: {datetime.now().strftime("%d/%m/%Y %H:%M:%S")}')
+        date_text = date_text or datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+        date_para = self.doc.add_paragraph(f'Ngày tạo báo cáo: {date_text}')
         date_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
         date_run = date_para.runs[0]
         date_run.font.size = Pt(11)
@@ -122,8 +213,6 @@ class ReportGenerator:
         # Biểu đồ 1: So sánh PD từ 4 models
         self.doc.add_heading('3.1. So sánh Xác suất Vỡ nợ (PD) từ 4 Models', level=2)
 
-        fig1, ax1 = plt.subplots(figsize=(10, 6))
-        models = ['Stacking', 'Logistic', 'Random Forest', 'XGBoost']
         pd_values = [
             prediction.get('pd_stacking', 0) * 100,
             prediction.get('pd_logistic', 0) * 100,
@@ -131,65 +220,17 @@ class ReportGenerator:
             prediction.get('pd_xgboost', 0) * 100
         ]
 
-        colors = ['#00a651', '#4CAF50', '#8BC34A', '#CDDC39']
-        bars = ax1.bar(models, pd_values, color=colors)
-        ax1.set_ylabel('Xác suất Vỡ nợ (%)', fontsize=12)
-        ax1.set_title('So sánh PD từ 4 Models', fontsize=14, fontweight='bold')
-        ax1.set_ylim(0, 100)
-
-        # Thêm giá trị trên các cột
-        for bar, value in zip(bars, pd_values):
-            height = bar.get_height()
-            ax1.text(bar.get_x() + bar.get_width()/2., height,
-                    f'{value:.2f}%',
-                    ha='center', va='bottom', fontsize=10)
-
-        # Lưu biểu đồ
-        chart1_path = 'chart_pd_comparison.png'
-        plt.tight_layout()
-        plt.savefig(chart1_path, dpi=300, bbox_inches='tight')
-        plt.close()
-
-        # Thêm vào document
-        self.doc.add_picture(chart1_path, width=Inches(6))
-        os.remove(chart1_path)
+        # Render trong bộ nhớ và thêm vào document
+        chart1 = chart_renderer.render_pd_comparison(pd_values, dpi=self.chart_dpi)
+        self.doc.add_picture(chart1, width=Inches(6))
 
         self.doc.add_paragraph()
 
-        # Biểu đồ 2: 14 chỉ số tài chính
+        # Biểu đồ 2: 14 chỉ số tài chính (Nhóm 1: X1-X6, Nhóm 2: X7-X14)
         self.doc.add_heading('3.2. Phân tích 14 Chỉ số Tài chính', level=2)
 
-        fig2, (ax2_1, ax2_2) = plt.subplots(1, 2, figsize=(14, 6))
-
-        # Biểu đồ 2a: Nhóm chỉ số sinh lời và đòn bẩy (X1-X6)
-        indicators_group1 = ['X_1', 'X_2', 'X_3', 'X_4', 'X_5', 'X_6']
-        values_group1 = [indicators_dict.get(key, 0) for key in indicators_group1]
-        labels_group1 = [f'{key}' for key in indicators_group1]
-
-        ax2_1.barh(labels_group1, values_group1, color='#FFB6C1')
-        ax2_1.set_xlabel('Giá trị', fontsize=10)
-        ax2_1.set_title('Nhóm 1: Sinh lời & Đòn bẩy (X1-X6)', fontsize=11, fontweight='bold')
-        ax2_1.grid(axis='x', alpha=0.3)
-
-        # Biểu đồ 2b: Nhóm thanh toán và hiệu quả (X7-X14)
-        indicators_group2 = ['X_7', 'X_8', 'X_9', 'X_10', 'X_11', 'X_12', 'X_13', 'X_14']
-        values_group2 = [indicators_dict.get(key, 0) for key in indicators_group2]
-        labels_group2 = [f'{key}' for key in indicators_group2]
-
-        ax2_2.barh(labels_group2, values_group2, color='#ADD8E6')
-        ax2_2.set_xlabel('Giá trị', fontsize=10)
-        ax2_2.set_title('Nhóm 2: Thanh toán & Hiệu quả (X7-X14)', fontsize=11, fontweight='bold')
-        ax2_2.grid(axis='x', alpha=0.3)
-
-        # Lưu biểu đồ
-        chart2_path = 'chart_indicators.png'
-        plt.tight_layout()
-        plt.savefig(chart2_path, dpi=300, bbox_inches='tight')
-        plt.close()
-
-        # Thêm vào document
-        self.doc.add_picture(chart2_path, width=Inches(6.5))
-        os.remove(chart2_path)
+        chart2 = chart_renderer.render_indicators(indicators_dict, dpi=self.chart_dpi)
+        self.doc.add_picture(chart2, width=Inches(6.5))
 
         self.doc.add_paragraph()
 
@@ -226,16 +267,23 @@ class ReportGenerator:
         disclaimer_run.font.italic = True
         disclaimer_run.font.color.rgb = RGBColor(150, 150, 150)
 
-    def generate_report(self, data: Dict[str, Any], output_path: str = 'bao_cao_tin_dung.docx') -> str:
+    @timed_stage('report_render')
+    def generate_report(
+        self,
+        data: Dict[str, Any],
+        output_path: Union[str, BinaryIO] = 'bao_cao_tin_dung.docx',
+        include_analysis: bool = True
+    ) -> Union[str, BinaryIO]:
         """
         Tạo báo cáo hoàn chỉnh
 
         Args:
             data: Dữ liệu bao gồm prediction, indicators, và analysis
-            output_path: Đường dẫn file output
+            output_path: Đường dẫn file output hoặc stream ghi được (VD: io.BytesIO để không ghi ra đĩa)
+            include_analysis: False = bỏ phần phân tích của Gemini
 
         Returns:
-            Đường dẫn file báo cáo
+            output_path (đường dẫn file hoặc stream đã ghi báo cáo)
         """
         try:
             # Lấy dữ liệu
@@ -244,15 +292,16 @@ class ReportGenerator:
             indicators_dict = data.get('indicators_dict', {})
             analysis = data.get('analysis', 'Không có phân tích')
 
-            # Tạo báo cáo
-            self.add_header()
+            # Tạo báo cáo (styles, header và footer đã có sẵn trong template)
+            self._fill_header()
             self.add_prediction_results(prediction)
             self.add_14_indicators(indicators)
             self.add_chart(prediction, indicators_dict)
-            self.add_gemini_analysis(analysis)
-            self.add_footer()
+            if include_analysis:
+                self.add_gemini_analysis(analysis)
+            self._attach_footer()
 
-            # Lưu file
+            # Lưu file (hoặc ghi vào stream)
             self.doc.save(output_path)
             return output_path
 
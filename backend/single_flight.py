@@ -0,0 +1,96 @@
+"""
+Single-flight Module - Gộp các lời gọi giống nhau đang chạy đồng thời
+Khi nhiều request cùng gửi một prompt, chỉ một lời gọi thật được thực hiện,
+các request còn lại chờ và nhận chung kết quả
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+
+class _Call:
+    """Một lời gọi đang chạy (in-flight)"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Gộp các lời gọi cùng khóa đang chạy đồng thời thành một lời gọi"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+        self.executed = 0   # Số lời gọi thật được thực hiện
+        self.coalesced = 0  # Số lời gọi được gộp vào lời gọi đang chạy
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Thực hiện fn() một lần cho mỗi khóa đang chạy
+
+        Args:
+            key: Khóa xác định lời gọi (VD: hash của prompt)
+            fn: Hàm thực hiện lời gọi thật
+
+        Returns:
+            Kết quả của fn() (dùng chung cho mọi caller cùng khóa)
+
+        Raises:
+            Exception: Lỗi của fn() được ném lại cho tất cả caller đang chờ
+            RuntimeError: (caller đang chờ) lời gọi thật bị ngắt bởi BaseException (VD: KeyboardInterrupt)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if isinstance(call.error, Exception):
+                raise call.error
+            if call.error is not None:
+                raise RuntimeError(f"Lời gọi single-flight bị ngắt ({type(call.error).__name__})") from call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            # Ghi nhận cả BaseException: caller đang chờ không được nhận result=None như một kết quả thật
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Thống kê single-flight
+
+        Returns:
+            Dict chứa số lời gọi thật, số lời gọi được gộp và số khóa đang chạy
+        """
+        with self._lock:
+            total = self.executed + self.coalesced
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "coalesced_rate": round(self.coalesced / total, 4) if total else 0.0,
+                "in_flight": len(self._calls)
+            }
+
+
+# Khởi tạo instance global cho các prompt Gemini
+gemini_single_flight = SingleFlight()
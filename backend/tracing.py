@@ -0,0 +1,260 @@
+"""
+Tracing Module - Trace nhẹ theo request (span lồng nhau qua contextvars)
+- Mỗi request là một trace, trace_id lấy từ request id (X-Request-ID)
+- Span cho các bước parse, indicators, predict_proba, scenario, llm, report_render (qua metrics.stage_timer)
+- Xuất span ra file JSONL theo cấu trúc OTLP/JSON (TRACE_EXPORT_FILE) và giữ các trace gần nhất trong bộ nhớ
+- Tạo header Server-Timing để xem thời gian từng bước trong DevTools của frontend
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+SERVICE_NAME = "credit-risk-backend"
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """Một bước xử lý có thời điểm bắt đầu/kết thúc"""
+
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, parent_id: Optional[str] = None, attributes: Dict[str, Any] = None):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    """Tập các span của một request"""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        # trace_id theo chuẩn W3C/OTLP là 32 ký tự hex; request id của client có thể không đúng định dạng
+        is_hex = len(request_id) == 32 and all(c in "0123456789abcdef" for c in request_id.lower())
+        self.trace_id = request_id.lower() if is_hex else uuid.uuid4().hex
+        self.spans: List[Span] = []
+        self.root: Optional[Span] = None
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Ghi một span trong trace hiện tại (không làm gì nếu không có trace, VD: khi chạy script)
+
+    Args:
+        name: Tên span (VD: parse, predict_proba.stacking, llm)
+        **attributes: Thuộc tính của span
+
+    Yields:
+        Span (hoặc None nếu không có trace)
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    parent = _current_span.get()
+    current = Span(name, parent.span_id if parent is not None else None, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end()
+        _current_span.reset(token)
+        trace.add(current)
+
+
+def set_span_attribute(key: str, value: Any):
+    """Gắn thuộc tính vào span hiện tại (nếu có)"""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes[key] = value
+
+
+@contextmanager
+def start_trace(name: str, request_id: str, **attributes):
+    """
+    Bắt đầu trace cho một request, xuất trace khi kết thúc
+
+    Args:
+        name: Tên root span (VD: "POST /simulate-scenario-macro")
+        request_id: Request id của request
+        **attributes: Thuộc tính của root span
+
+    Yields:
+        Trace
+    """
+    trace = Trace(request_id)
+    trace_token = _current_trace.set(trace)
+    try:
+        with span(name, **attributes) as root:
+            trace.root = root
+            yield trace
+    finally:
+        _current_trace.reset(trace_token)
+        export_trace(trace)
+
+
+def server_timing_header(trace: Trace) -> str:
+    """
+    Header Server-Timing: tổng thời gian theo từng tên bước (gộp các span trùng tên)
+
+    Args:
+        trace: Trace đã kết thúc
+
+    Returns:
+        Giá trị header, VD: 'parse;dur=12.3, predict_proba.stacking;dur=8.1;desc="x2", total;dur=95.0'
+    """
+    totals: "OrderedDict[str, list]" = OrderedDict()
+    with trace._lock:
+        spans = [s for s in trace.spans if s is not trace.root]
+    for s in sorted(spans, key=lambda item: item.start_ns):
+        entry = totals.setdefault(s.name, [0.0, 0])
+        entry[0] += s.duration_ms
+        entry[1] += 1
+
+    parts = []
+    for name, (duration, count) in totals.items():
+        metric = f"{name};dur={duration:.1f}"
+        if count > 1:
+            metric += f';desc="x{count}"'
+        parts.append(metric)
+    if trace.root is not None:
+        parts.append(f"total;dur={trace.root.duration_ms:.1f}")
+    return ", ".join(parts)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(trace: Trace) -> Dict[str, Any]:
+    """Chuyển trace sang cấu trúc OTLP/JSON (ExportTraceServiceRequest)"""
+    with trace._lock:
+        spans = list(trace.spans)
+
+    otlp_spans = []
+    for s in spans:
+        attributes = dict(s.attributes)
+        attributes.setdefault("request.id", trace.request_id)
+        otlp_span = {
+            "traceId": trace.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 2 if s is trace.root else 1,  # SERVER / INTERNAL
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns or s.start_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items()],
+            "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+        }
+        if s.parent_id:
+            otlp_span["parentSpanId"] = s.parent_id
+        otlp_spans.append(otlp_span)
+
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": otlp_spans}]
+        }]
+    }
+
+
+class InMemorySpanCollector:
+    """Collector giả lập: giữ các trace gần nhất trong bộ nhớ (xem nhanh khi debug, kiểm thử)"""
+
+    def __init__(self, max_traces: int = 100):
+        self._traces = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace):
+        with self._lock:
+            self._traces.append(trace)
+
+    def recent(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Các trace gần nhất dạng tóm tắt (mới nhất trước)"""
+        with self._lock:
+            traces = list(self._traces)[-limit:]
+        return [
+            {
+                "trace_id": t.trace_id,
+                "request_id": t.request_id,
+                "name": t.root.name if t.root else None,
+                "duration_ms": round(t.root.duration_ms, 2) if t.root else None,
+                "spans": [
+                    {"name": s.name, "duration_ms": round(s.duration_ms, 2), "error": s.error}
+                    for s in sorted(t.spans, key=lambda item: item.start_ns) if s is not t.root
+                ]
+            }
+            for t in reversed(traces)
+        ]
+
+
+class FileSpanExporter:
+    """Ghi trace ra file JSONL (mỗi dòng một ExportTraceServiceRequest), ghi ở thread nền"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, trace: Trace):
+        self._queue.put(to_otlp(trace))
+
+    def _run(self):
+        while True:
+            payload = self._queue.get()
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+            except OSError:
+                pass  # Lỗi ghi trace không được làm hỏng request
+
+
+span_collector = InMemorySpanCollector()
+_exporters = [span_collector]
+if os.getenv("TRACE_EXPORT_FILE"):
+    _exporters.append(FileSpanExporter(os.getenv("TRACE_EXPORT_FILE")))
+
+
+def export_trace(trace: Trace):
+    """Gửi trace tới các exporter đã cấu hình"""
+    for exporter in _exporters:
+        exporter.export(trace)
@@ -0,0 +1,499 @@
+"""
+Training Jobs Module - Huấn luyện mô hình trong process riêng, không chặn event loop của server
+- Mỗi job chạy trên một process mới (spawn): stacking 5-fold, K-Means, Isolation Forest không chiếm
+  CPU/GIL của process đang phục vụ request
+- Job báo tiến độ qua hàng đợi giữa các process; xem trạng thái tại /training-jobs/{job_id}
+- Khi xong, mô hình mới được publish nguyên khối: file pickle thay bằng os.replace, đối tượng trong
+  bộ nhớ được thay toàn bộ trạng thái bằng một phép gán (request dự báo PD chụp trạng thái một lần nên dùng trọn mô hình cũ)
+"""
+
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from anomaly_detection import AnomalyDetectionSystem, anomaly_system
+from early_warning import EarlyWarningSystem, early_warning_system
+from logging_config import get_logger, request_id_var, setup_logging
+from metrics import record_model_load
+from model import CreditRiskModel, credit_model
+from training_store import credit_store, labeled_store
+from tuning import run_tuning
+
+logger = get_logger(__name__)
+
+MODEL_PATH = "model_stacking.pkl"
+MAX_FINISHED_JOBS = 50
+
+# max_tasks_per_child chỉ có từ Python 3.11; bản cũ hơn thay cả pool sau mỗi job (_retire_pool)
+_MAX_TASKS_PER_CHILD = sys.version_info >= (3, 11)
+
+JOB_KINDS = {
+    'credit': 'Mô hình PD (Stacking)',
+    'credit_append': 'Mô hình PD - huấn luyện tiếp với dữ liệu mới',
+    'early_warning': 'Early Warning System',
+    'anomaly': 'Anomaly Detection System',
+    'tune': 'Tìm siêu tham số base models (Stacking)',
+    'credit_update': 'Mô hình PD - fit lại meta-model / chọn lại ngưỡng',
+}
+
+# Các loại job cập nhật cùng một mô hình: không chạy đồng thời
+_JOB_GROUPS = {'credit_append': 'credit', 'credit_update': 'credit'}
+
+class JobConflictError(RuntimeError):
+    """Đang có job cùng nhóm chưa xong (endpoint trả về 409)"""
+
+
+# Hàng đợi tiến độ trong process worker (gán bởi _init_worker)
+_worker_progress_queue = None
+
+
+# ================================================================================================
+# PHẦN CHẠY TRONG PROCESS WORKER
+# ================================================================================================
+
+def _init_worker(progress_queue):
+    global _worker_progress_queue
+    _worker_progress_queue = progress_queue
+    setup_logging()
+
+
+def _remove_file(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _progress_reporter(job_id: str):
+    """Callback tiến độ cho hàm train: đẩy (job_id, %, mô tả) về process chính"""
+    def report(pct: int, message: str):
+        _worker_progress_queue.put((job_id, pct, message))
+    return report
+
+
+def _run_credit_training(
+    job_id: str,
+    csv_path: Optional[str],
+    base_params: Dict[str, Dict[str, Any]] = None,
+    data_version: Optional[int] = None
+):
+    request_id_var.set(job_id)
+    report = _progress_reporter(job_id)
+    report(0, "Bắt đầu huấn luyện")
+    try:
+        model = CreditRiskModel()
+        if csv_path is None:
+            result = model.train_from_store(credit_store, data_version, progress_callback=report, base_params=base_params)
+        else:
+            result = model.train(csv_path, progress_callback=report, base_params=base_params, store=credit_store)
+        report(95, "Lưu mô hình")
+        model.save_model(MODEL_PATH)
+        return result, model
+    finally:
+        if csv_path is not None:
+            _remove_file(csv_path)
+
+
+def _run_credit_append(job_id: str, csv_path: str, extra_trees: Optional[int], extra_rounds: Optional[int]):
+    request_id_var.set(job_id)
+    report = _progress_reporter(job_id)
+    report(0, "Bắt đầu huấn luyện tiếp")
+    try:
+        model = CreditRiskModel()
+        model.load_model(MODEL_PATH)
+        result = model.train_append(csv_path, credit_store, extra_trees, extra_rounds, progress_callback=report)
+        report(95, "Lưu mô hình")
+        model.save_model(MODEL_PATH)
+        return result, model
+    finally:
+        _remove_file(csv_path)
+
+
+def _run_early_warning_training(job_id: str, data_version: int):
+    request_id_var.set(job_id)
+    report = _progress_reporter(job_id)
+    report(0, "Bắt đầu huấn luyện")
+    system = EarlyWarningSystem()
+    result = system.train_from_store(labeled_store, data_version, progress_callback=report)
+    return result, system
+
+
+def _run_anomaly_training(job_id: str, data_version: int):
+    request_id_var.set(job_id)
+    report = _progress_reporter(job_id)
+    report(0, "Bắt đầu huấn luyện")
+    system = AnomalyDetectionSystem()
+    result = system.train_from_store(labeled_store, data_version, progress_callback=report)
+    return result, system
+
+
+def _run_tuning(job_id: str, csv_path: str, n_iter: int):
+    request_id_var.set(job_id)
+    report = _progress_reporter(job_id)
+    report(0, "Bắt đầu tìm siêu tham số")
+    try:
+        result = run_tuning(pd.read_csv(csv_path), n_iter=n_iter, progress_callback=report)
+        return result, None  # Chỉ báo cáo kết quả, không thay mô hình đang phục vụ
+    finally:
+        _remove_file(csv_path)
+
+
+def update_credit_model(method: str, *args: Any):
+    """
+    Thao tác cập nhật nhanh mô hình PD (dùng dự báo OOF đã lưu), chạy trong process chính qua run_inline
+
+    Args:
+        method: Tên phương thức của CreditRiskModel ('refit_meta', 'recalibrate_threshold')
+        *args: Tham số của phương thức
+
+    Returns:
+        (kết quả, mô hình mới) - cập nhật trên bản sao, mô hình đang phục vụ không bị sửa dở
+    """
+    model = CreditRiskModel()
+    if credit_model.model is not None:
+        # Bản sao nông: dùng chung các estimator đã fit, phương thức cập nhật chỉ gán lại thuộc tính
+        model.__dict__ = dict(credit_model.__dict__)
+    elif os.path.exists(MODEL_PATH):
+        model.load_model(MODEL_PATH)
+    else:
+        raise ValueError("Mô hình chưa được huấn luyện. Vui lòng upload file CSV để huấn luyện trước.")
+    result = getattr(model, method)(*args)
+    model.save_model(MODEL_PATH)
+    return result, model
+
+
+def _data_version_arg(kind: str, args: tuple):
+    """(kho, phiên bản) cố định mà worker sẽ đọc; None nếu job không đọc phiên bản cố định của kho"""
+    if kind == 'credit' and args[0] is None and args[2] is not None:
+        return credit_store, args[2]
+    if kind in ('early_warning', 'anomaly'):
+        return labeled_store, args[0]
+    return None
+
+
+# Job nhận đường dẫn CSV tạm ở tham số đầu tiên (worker xóa khi xong)
+_TEMP_FILE_KINDS = {'credit', 'credit_append', 'tune'}
+
+_WORKER_FUNCTIONS = {
+    'credit': _run_credit_training,
+    'credit_append': _run_credit_append,
+    'early_warning': _run_early_warning_training,
+    'anomaly': _run_anomaly_training,
+    'tune': _run_tuning,
+}
+
+# Đối tượng dùng chung trong process chính nhận mô hình mới; tên dùng cho metric model_loads_total
+_TARGETS = {
+    'credit': (credit_model, 'credit_stacking'),
+    'credit_append': (credit_model, 'credit_stacking'),
+    'credit_update': (credit_model, 'credit_stacking'),
+    'early_warning': (early_warning_system, 'early_warning'),
+    'anomaly': (anomaly_system, 'anomaly'),
+}
+
+
+# ================================================================================================
+# PHẦN CHẠY TRONG PROCESS CHÍNH
+# ================================================================================================
+
+class TrainingJob:
+    """Trạng thái một job huấn luyện"""
+
+    def __init__(self, kind: str):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = 'queued'  # queued → running → succeeded | failed
+        self.progress = 0
+        self.message = 'Đang chờ'
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.future: Optional[Future] = None
+        self.data_pin = None  # (kho, token) giữ phiên bản dữ liệu job sẽ đọc tới khi job kết thúc
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('succeeded', 'failed')
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        return {
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'description': JOB_KINDS[self.kind],
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'duration_seconds': round(end - self.started_at, 2) if self.started_at else None,
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+class TrainingJobManager:
+    """Quản lý các job huấn luyện chạy trên process pool riêng"""
+
+    def __init__(self, max_workers: int = None):
+        """
+        Args:
+            max_workers: Số job chạy song song tối đa. None = TRAINING_WORKERS (mặc định 1)
+        """
+        self.max_workers = max_workers or int(os.getenv("TRAINING_WORKERS", 1))
+        self._jobs: "OrderedDict[str, TrainingJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._progress_queue = None
+        self._listener: Optional[threading.Thread] = None
+
+    def _ensure_pool(self) -> ProcessPoolExecutor:
+        """Tạo process pool lười (spawn: không fork process đang có thread của server / OpenMP)"""
+        context = multiprocessing.get_context("spawn")
+        if self._progress_queue is None:
+            self._progress_queue = context.Queue()
+            self._listener = threading.Thread(
+                target=self._listen_progress, args=(self._progress_queue,), name="training-progress", daemon=True
+            )
+            self._listener.start()
+        if self._pool is None:
+            # Mỗi job một process mới, bộ nhớ huấn luyện được trả lại khi xong
+            # (max_tasks_per_child=1, hoặc _retire_pool trước Python 3.11)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(self._progress_queue,),
+                **({'max_tasks_per_child': 1} if _MAX_TASKS_PER_CHILD else {})
+            )
+        return self._pool
+
+    def _listen_progress(self, progress_queue):
+        while True:
+            item = progress_queue.get()
+            if item is None:
+                return
+            job_id, pct, message = item
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job.finished:
+                    continue
+                if job.status == 'queued':
+                    job.status = 'running'
+                    job.started_at = time.time()
+                job.progress = pct
+                job.message = message
+
+    def submit(self, kind: str, *args: Any) -> TrainingJob:
+        """
+        Đưa một job huấn luyện vào hàng đợi
+
+        Args:
+            kind: Loại job, tham số tương ứng (args):
+                  'credit': đường dẫn CSV tạm (worker xóa khi xong; None = dùng kho dữ liệu), base_params, data_version
+                  'credit_append': đường dẫn CSV tạm chỉ gồm dòng mới, extra_trees, extra_rounds
+                  'early_warning', 'anomaly': phiên bản dữ liệu trong labeled_store
+                  'tune': đường dẫn CSV tạm, n_iter
+            *args: Tham số của hàm huấn luyện
+
+        Returns:
+            TrainingJob
+
+        Raises:
+            JobConflictError: Đang có job cùng loại (hoặc cập nhật cùng mô hình) chưa xong
+            ValueError: Phiên bản dữ liệu không còn trong kho
+            BrokenProcessPool: Process pool vừa hỏng (đã bỏ, job sau tạo pool mới)
+        """
+        with self._lock:
+            job = self._register(kind)
+
+        pool = None
+        try:
+            data_version = _data_version_arg(kind, args)
+            if data_version is not None:
+                # Giữ phiên bản tới khi job xong: upload mới trong lúc job chờ không được dọn mất dữ liệu của job
+                store, version = data_version
+                job.data_pin = (store, store.pin(version))
+            with self._lock:
+                pool = self._ensure_pool()
+            logger.info("Tạo job huấn luyện %s (%s)", job.job_id, kind)
+            job.future = pool.submit(_WORKER_FUNCTIONS[kind], job.job_id, *args)
+        except Exception as e:
+            # Pool hỏng (worker của job khác vừa chết, _on_done chưa kịp bỏ pool) hoặc đã đóng khi tắt server:
+            # job phải kết thúc (nếu không nhóm của nó bị 409 mãi) và file tạm không còn worker nào xóa
+            if isinstance(e, BrokenProcessPool):
+                self._drop_broken_pool(pool)
+            if kind in _TEMP_FILE_KINDS and args[0] is not None:
+                _remove_file(args[0])
+            self._fail(job, e)
+            raise
+
+        job.future.add_done_callback(lambda future: self._on_done(job, future, pool))
+        return job
+
+    def run_inline(self, kind: str, update, *args: Any) -> Dict[str, Any]:
+        """
+        Chạy một thao tác cập nhật nhanh ngay trong thread gọi (không qua process pool) nhưng vẫn là một job:
+        bị từ chối khi đang có job cùng nhóm, chặn job cùng nhóm tới khi xong, publish như job huấn luyện
+
+        Args:
+            kind: Loại job (VD: 'credit_update')
+            update: Hàm trả về (kết quả, mô hình mới hoặc None), VD: update_credit_model
+            *args: Tham số của update
+
+        Returns:
+            Kết quả của update
+
+        Raises:
+            JobConflictError: Đang có job cùng nhóm chưa xong
+        """
+        with self._lock:
+            job = self._register(kind)
+            job.status = 'running'
+            job.started_at = time.time()
+
+        try:
+            result, trained = update(*args)
+        except Exception as e:
+            self._fail(job, e)
+            raise
+        self._publish(job, result, trained)
+        return result
+
+    def ensure_idle(self, kind: str):
+        """
+        Kiểm tra trước khi chuẩn bị dữ liệu cho job (VD: ghi file upload vào kho dữ liệu)
+
+        Raises:
+            JobConflictError: Đang có job cùng nhóm với kind chưa xong
+        """
+        with self._lock:
+            self._check_idle(kind)
+
+    def _check_idle(self, kind: str):
+        group = _JOB_GROUPS.get(kind, kind)
+        running = [
+            job for job in self._jobs.values()
+            if _JOB_GROUPS.get(job.kind, job.kind) == group and not job.finished
+        ]
+        if running:
+            raise JobConflictError(
+                f"Đang có job huấn luyện {JOB_KINDS[running[0].kind]} chưa hoàn tất (job_id={running[0].job_id})"
+            )
+
+    def _register(self, kind: str) -> TrainingJob:
+        """Tạo job mới (gọi khi đang giữ self._lock); JobConflictError nếu đang có job cùng nhóm chưa xong"""
+        self._check_idle(kind)
+        job = TrainingJob(kind)
+        self._jobs[job.job_id] = job
+        self._evict_finished()
+        return job
+
+    def _on_done(self, job: TrainingJob, future: Future, pool: ProcessPoolExecutor):
+        """Chạy ở thread quản lý của pool khi job kết thúc: publish mô hình mới hoặc ghi lỗi"""
+        try:
+            result, trained = future.result()
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                self._drop_broken_pool(pool)
+            self._fail(job, e)
+            return
+        if not _MAX_TASKS_PER_CHILD:
+            self._retire_pool(pool)
+        self._publish(job, result, trained)
+
+    def _drop_broken_pool(self, pool: ProcessPoolExecutor):
+        """
+        Process worker chết đột ngột (VD: hết bộ nhớ): bỏ pool hỏng và cả hàng đợi tiến độ
+        (worker có thể chết khi đang ghi), job sau tạo mới
+        """
+        with self._lock:
+            if pool is not None and self._pool is pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._progress_queue.put(None)
+                self._pool, self._progress_queue = None, None
+
+    def _retire_pool(self, pool: ProcessPoolExecutor):
+        """
+        Trước Python 3.11: bỏ pool sau mỗi job để job sau chạy trên process mới
+        (job khác đang chạy/chờ trên pool cũ vẫn chạy xong, dùng chung hàng đợi tiến độ)
+        """
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    @staticmethod
+    def _release_data(job: TrainingJob):
+        if job.data_pin is not None:
+            store, token = job.data_pin
+            store.unpin(token)
+            job.data_pin = None
+
+    def _fail(self, job: TrainingJob, error: Exception):
+        self._release_data(job)
+        with self._lock:
+            job.status = 'failed'
+            job.error = str(error) or type(error).__name__
+            job.message = 'Lỗi khi huấn luyện'
+            job.finished_at = time.time()
+        logger.warning("Job huấn luyện %s thất bại: %s", job.job_id, job.error)
+
+    def _publish(self, job: TrainingJob, result: Dict[str, Any], trained: Any):
+        """Thay mô hình đang phục vụ bằng mô hình mới (đã được lưu ra file) rồi đánh dấu job hoàn tất"""
+        self._release_data(job)
+        if trained is not None:
+            target, metric_name = _TARGETS[job.kind]
+            # Một phép gán duy nhất thay toàn bộ trạng thái, không bao giờ lộ mô hình đang fit dở. Request đọc nhiều
+            # thuộc tính chỉ thấy trọn một mô hình nếu chụp __dict__ một lần (model_state.snapshot)
+            target.__dict__ = trained.__dict__
+            record_model_load(metric_name, 'train')
+
+        with self._lock:
+            job.status = 'succeeded'
+            job.progress = 100
+            job.message = 'Hoàn tất'
+            job.result = result
+            job.started_at = job.started_at or job.created_at
+            job.finished_at = time.time()
+        logger.info("Job huấn luyện %s hoàn tất sau %.1f giây", job.job_id, job.finished_at - job.started_at)
+
+    def _evict_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[TrainingJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        """Các job gần nhất (mới nhất trước)"""
+        with self._lock:
+            return [job.to_dict() for job in reversed(self._jobs.values())]
+
+    def shutdown(self):
+        """Dừng process pool (gọi khi tắt server; job đang chạy bị hủy)"""
+        with self._lock:
+            pool, progress_queue = self._pool, self._progress_queue
+            self._pool, self._progress_queue = None, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        if progress_queue is not None:
+            progress_queue.put(None)
+
+
+# Khởi tạo instance global
+training_manager = TrainingJobManager()
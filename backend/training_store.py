@@ -0,0 +1,346 @@
+"""
+Training Store Module - Kho dữ liệu huấn luyện dạng cột trên đĩa, có phiên bản
+- Mỗi lần ghi tạo một segment; segment chia thành row group theo giá trị cột phân vùng (VD: label),
+  mỗi row group lưu mỗi cột một file .npy và vị trí dòng trong segment (_row.npy)
+- Đọc nhiều phân vùng trả về dòng theo đúng thứ tự lúc ghi (không gom theo nhãn)
+- Đọc bằng memory-map (không parse lại CSV/Excel, nhiều process dùng chung page cache của cùng file);
+  lọc theo phân vùng bỏ qua cả row group, không đọc dòng không cần
+- Phiên bản = danh sách segment: thêm dòng chỉ ghi segment mới, không ghi lại dữ liệu đã có;
+  upload dữ liệu mới toàn bộ tạo phiên bản mới chỉ gồm segment mới
+- manifest.json ghi ra file tạm rồi os.replace; giữ STORE_MAX_VERSIONS phiên bản gần nhất,
+  segment không còn phiên bản nào dùng bị xóa; phiên bản đang được job huấn luyện giữ (pin) không bị xóa
+- Ghi phiên bản giữ khóa file (.lock) giữa các process: uvicorn worker và process huấn luyện cùng ghi một kho
+"""
+
+import itertools
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+import pandas as pd
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = ".lock"
+PIN_DIR = "pins"
+# Pin bị bỏ lại (VD: server dừng khi job đang chờ) hết hiệu lực sau 1 ngày, phiên bản lại được dọn như bình thường
+PIN_TTL_SECONDS = 24 * 60 * 60
+ROW_ORDER_FILE = "_row.npy"
+
+
+class TrainingStore:
+    """Kho dữ liệu huấn luyện (VD: 'credit'), lưu trong <root>/<name>"""
+
+    def __init__(self, name: str, partition_col: Optional[str] = None, root: str = None, max_versions: int = None):
+        """
+        Args:
+            name: Tên kho (thư mục con)
+            partition_col: Cột số nguyên chia row group (VD: 'label'); khi đọc, thứ tự dòng lúc ghi được khôi phục.
+                           None = một row group mỗi segment
+            root: Thư mục gốc. None = TRAINING_STORE_DIR (mặc định ./training_store)
+            max_versions: Số phiên bản giữ lại. None = STORE_MAX_VERSIONS (mặc định 10)
+        """
+        self.name = name
+        self.partition_col = partition_col
+        self.root = root or os.getenv("TRAINING_STORE_DIR", "training_store")
+        self.max_versions = max_versions or int(os.getenv("STORE_MAX_VERSIONS", 10))
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.root, self.name)
+
+    @contextmanager
+    def _write_lock(self):
+        """Khóa đọc-sửa-ghi manifest giữa các thread và giữa các process dùng chung thư mục kho"""
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, LOCK_FILE), 'a+b') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    else:
+                        lock_file.seek(0)
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return {'versions': []}
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        tmp_path = f"{manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+    def versions(self) -> List[Dict[str, Any]]:
+        """Các phiên bản hiện có (cũ nhất trước): version, parent, num_rows, số dòng theo phân vùng, columns, created_at"""
+        return [
+            {
+                **{key: value for key, value in entry.items() if key != 'segments'},
+                'partition_counts': self._partition_counts(entry),
+            }
+            for entry in self._read_manifest()['versions']
+        ]
+
+    def latest_version(self) -> Optional[int]:
+        versions = self._read_manifest()['versions']
+        return versions[-1]['version'] if versions else None
+
+    def _get_version(self, manifest: Dict[str, Any], version: Optional[int]) -> Dict[str, Any]:
+        if not manifest['versions']:
+            raise ValueError(f"Kho dữ liệu '{self.name}' chưa có dữ liệu. Vui lòng upload file dữ liệu huấn luyện.")
+        if version is None:
+            return manifest['versions'][-1]
+        for entry in manifest['versions']:
+            if entry['version'] == version:
+                return entry
+        raise ValueError(f"Kho dữ liệu '{self.name}' không có phiên bản {version}")
+
+    def resolve_version(self, version: Optional[int] = None) -> int:
+        """Số phiên bản cụ thể (None = mới nhất); ValueError nếu kho trống hoặc không có phiên bản này"""
+        return self._get_version(self._read_manifest(), version)['version']
+
+    @staticmethod
+    def _partition_counts(entry: Dict[str, Any]) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for segment in entry['segments']:
+            for group in segment['groups']:
+                key = str(group['key'])
+                counts[key] = counts.get(key, 0) + group['num_rows']
+        return counts
+
+    def write(self, df: pd.DataFrame, parent: Optional[int] = None) -> int:
+        """
+        Ghi dữ liệu thành phiên bản mới
+
+        Args:
+            df: DataFrame chỉ gồm cột số (có partition_col nếu kho có phân vùng)
+            parent: None = phiên bản mới chỉ gồm df (thay toàn bộ dữ liệu);
+                    số phiên bản = thêm df vào sau dữ liệu của phiên bản đó (cột thiếu = NaN, cột thừa bị bỏ)
+
+        Returns:
+            Số phiên bản mới
+        """
+        if df.empty:
+            raise ValueError("Dữ liệu không có dòng nào")
+        with self._write_lock():
+            manifest = self._read_manifest()
+            if parent is None:
+                segments, columns, num_rows = [], list(df.columns), 0
+            else:
+                base = self._get_version(manifest, parent)
+                segments, columns, num_rows = list(base['segments']), base['columns'], base['num_rows']
+                df = df.reindex(columns=columns)
+
+            non_numeric = [col for col in columns if not pd.api.types.is_numeric_dtype(df[col])]
+            if non_numeric:
+                raise ValueError(f"Cột không phải số: {', '.join(non_numeric)}")
+
+            segment = self._write_segment(df, columns)
+            version = (manifest['versions'][-1]['version'] + 1) if manifest['versions'] else 1
+            manifest['versions'].append({
+                'version': version,
+                'parent': parent,
+                'segments': segments + [segment],
+                'columns': columns,
+                'num_rows': num_rows + len(df),
+                'created_at': time.time(),
+            })
+            self._prune(manifest)
+            self._write_manifest(manifest)
+
+        logger.info("Kho dữ liệu %s: phiên bản %d (%d dòng)", self.name, version, num_rows + len(df))
+        return version
+
+    def _write_segment(self, df: pd.DataFrame, columns: List[str]) -> Dict[str, Any]:
+        """Ghi một segment (các row group theo phân vùng) vào thư mục tạm rồi đổi tên: phiên bản chỉ trỏ tới segment đã ghi xong"""
+        name = f"seg_{uuid.uuid4().hex[:12]}"
+        tmp_dir = os.path.join(self.path, f".{name}.tmp")
+        if self.partition_col is None:
+            parts = [(None, np.arange(len(df)))]
+        else:
+            if df[self.partition_col].isna().any():
+                raise ValueError(f"Cột '{self.partition_col}' có giá trị trống")
+            keys = df[self.partition_col].astype(np.int64).to_numpy()
+            parts = [(int(key), np.flatnonzero(keys == key)) for key in np.unique(keys)]
+
+        groups = []
+        for index, (key, rows) in enumerate(parts):
+            group_dir = os.path.join(tmp_dir, f"g{index}")
+            os.makedirs(group_dir, exist_ok=True)
+            part = df.iloc[rows]
+            for col in columns:
+                np.save(os.path.join(group_dir, f"{col}.npy"), part[col].to_numpy())
+            np.save(os.path.join(group_dir, ROW_ORDER_FILE), rows)
+            groups.append({'dir': f"g{index}", 'key': key, 'num_rows': len(rows)})
+        os.replace(tmp_dir, os.path.join(self.path, name))
+        return {'name': name, 'groups': groups}
+
+    def pin(self, version: int) -> str:
+        """
+        Giữ một phiên bản không bị dọn cho tới khi unpin (job đã nhận phiên bản nhưng chưa đọc xong dữ liệu)
+
+        Args:
+            version: Số phiên bản
+
+        Returns:
+            Token để unpin
+
+        Raises:
+            ValueError: Phiên bản không tồn tại (hoặc đã bị dọn)
+        """
+        token = f"{version}-{uuid.uuid4().hex[:12]}"
+        with self._write_lock():
+            self._get_version(self._read_manifest(), version)
+            os.makedirs(os.path.join(self.path, PIN_DIR), exist_ok=True)
+            open(os.path.join(self.path, PIN_DIR, token), 'w').close()
+        return token
+
+    def unpin(self, token: str):
+        """Bỏ pin (phiên bản được dọn ở lần ghi sau nếu đã cũ)"""
+        try:
+            os.unlink(os.path.join(self.path, PIN_DIR, token))
+        except OSError:
+            pass
+
+    def _pinned_versions(self) -> set:
+        pin_dir = os.path.join(self.path, PIN_DIR)
+        if not os.path.isdir(pin_dir):
+            return set()
+        pinned, now = set(), time.time()
+        for token in os.listdir(pin_dir):
+            path = os.path.join(pin_dir, token)
+            try:
+                if now - os.path.getmtime(path) > PIN_TTL_SECONDS:
+                    os.unlink(path)
+                    continue
+            except OSError:
+                continue
+            pinned.add(int(token.split('-', 1)[0]))
+        return pinned
+
+    def _prune(self, manifest: Dict[str, Any]):
+        """Giữ max_versions phiên bản gần nhất và các phiên bản đang được pin, xóa segment không còn được dùng"""
+        versions = manifest['versions']
+        pinned = self._pinned_versions()
+        keep_from = len(versions) - self.max_versions
+        kept, removed = [], []
+        for index, entry in enumerate(versions):
+            (kept if index >= keep_from or entry['version'] in pinned else removed).append(entry)
+        manifest['versions'] = kept
+        in_use = {segment['name'] for entry in manifest['versions'] for segment in entry['segments']}
+        for name in {segment['name'] for entry in removed for segment in entry['segments']} - in_use:
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    def _groups(self, entry: Dict[str, Any], partitions: Optional[Iterable[int]]) -> List[Dict[str, Any]]:
+        wanted = None if partitions is None else {int(key) for key in partitions}
+        return [
+            {**group, 'segment': segment['name'], 'path': os.path.join(self.path, segment['name'], group['dir'])}
+            for segment in entry['segments']
+            for group in segment['groups']
+            if wanted is None or group['key'] in wanted
+        ]
+
+    @staticmethod
+    def _row_order(groups: List[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """
+        Chỉ số sắp lại các dòng (đã nối theo row group) về thứ tự lúc ghi trong từng segment
+
+        Returns:
+            Mảng chỉ số, hoặc None nếu thứ tự nối đã đúng (mỗi segment chỉ đọc một row group)
+        """
+        order, offset, reordered = [], 0, False
+        for _, segment_groups in itertools.groupby(groups, key=lambda group: group['segment']):
+            segment_groups = list(segment_groups)
+            size = sum(group['num_rows'] for group in segment_groups)
+            row_paths = [os.path.join(group['path'], ROW_ORDER_FILE) for group in segment_groups]
+            # Segment ghi trước khi có _row.npy: giữ thứ tự nối theo row group
+            if len(segment_groups) > 1 and all(os.path.exists(path) for path in row_paths):
+                rows = np.concatenate([np.load(path) for path in row_paths])
+                order.append(offset + np.argsort(rows, kind='stable'))
+                reordered = True
+            else:
+                order.append(offset + np.arange(size))
+            offset += size
+        return np.concatenate(order) if reordered else None
+
+    def count(self, version: Optional[int] = None, partitions: Optional[Iterable[int]] = None) -> int:
+        """Số dòng của phiên bản (chỉ đọc manifest), tùy chọn chỉ các phân vùng cho trước"""
+        entry = self._get_version(self._read_manifest(), version)
+        return sum(group['num_rows'] for group in self._groups(entry, partitions))
+
+    def read_arrays(
+        self,
+        version: Optional[int] = None,
+        columns: Optional[List[str]] = None,
+        partitions: Optional[Iterable[int]] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Đọc các cột dạng mảng NumPy
+
+        Args:
+            version: Số phiên bản (None = mới nhất)
+            columns: Các cột cần đọc (None = tất cả)
+            partitions: Giá trị cột phân vùng cần đọc (VD: [0] = chỉ label 0). None = tất cả
+
+        Returns:
+            Dict {cột: mảng}; memory-map chỉ đọc (không copy) khi chỉ có một row group,
+            nếu không là mảng nối các row group, dòng theo đúng thứ tự lúc ghi
+        """
+        entry = self._get_version(self._read_manifest(), version)
+        columns = columns or entry['columns']
+        groups = self._groups(entry, partitions)
+        order = self._row_order(groups) if len(groups) > 1 else None
+        arrays = {}
+        for col in columns:
+            parts = [np.load(os.path.join(group['path'], f"{col}.npy"), mmap_mode='r') for group in groups]
+            if not parts:
+                arrays[col] = np.empty(0)
+            elif len(parts) == 1:
+                arrays[col] = parts[0]
+            else:
+                arrays[col] = np.concatenate(parts) if order is None else np.concatenate(parts)[order]
+        return arrays
+
+    def read(
+        self,
+        version: Optional[int] = None,
+        columns: Optional[List[str]] = None,
+        partitions: Optional[Iterable[int]] = None
+    ) -> pd.DataFrame:
+        """DataFrame của phiên bản (tham số như read_arrays)"""
+        return pd.DataFrame(self.read_arrays(version, columns, partitions))
+
+
+# Khởi tạo instance global
+# - credit: dữ liệu mô hình PD, phân vùng theo cách chia train (0) / test (1)
+# - companies: DN có nhãn (X_1 → X_14 + label) dùng chung cho Early Warning và Anomaly Detection, phân vùng theo label
+credit_store = TrainingStore('credit', partition_col='split')
+labeled_store = TrainingStore('companies', partition_col='label')
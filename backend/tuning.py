@@ -0,0 +1,305 @@
+"""
+Tuning Module - Tìm siêu tham số cho 3 base models của Stacking (random search, chạy song song trên process pool)
+- Mỗi ứng viên (base model, bộ siêu tham số) được đánh giá bằng dự báo OOF trên fold cố định (oof_cache):
+  AUC out-of-fold + độ trễ dự báo 1 dòng. Kết quả được cache nên chạy lại /tune chỉ tính ứng viên mới.
+- Ghép mọi tổ hợp (logistic × random_forest × xgboost): meta-learner fit trên ma trận OOF (không fit lại base models)
+  → AUC của stack; độ trễ stack = tổng độ trễ base models
+- Trả về Pareto front AUC - độ trễ; meta-learner (C) được tinh chỉnh lại cho các điểm trên front
+"""
+
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import train_test_split
+
+from logging_config import get_logger
+from model import BASE_LEARNERS, DEFAULT_BASE_PARAMS, MODEL_COLS, make_base_learner
+from oof_cache import OOFCache, dataset_fingerprint
+
+logger = get_logger(__name__)
+
+DEFAULT_N_ITER = 8
+META_C_GRID = (0.01, 0.1, 1.0, 10.0, 100.0)
+LATENCY_REPEATS = 15
+
+
+def _log_uniform(rng: np.random.Generator, low: float, high: float) -> float:
+    return float(np.exp(rng.uniform(np.log(low), np.log(high))))
+
+
+# Không gian tìm kiếm của từng base model (hàm nhận rng, trả về một bộ siêu tham số)
+SEARCH_SPACES: Dict[str, Callable[[np.random.Generator], Dict[str, Any]]] = {
+    'logistic': lambda rng: {
+        'C': round(_log_uniform(rng, 1e-3, 1e2), 5),
+        'class_weight': rng.choice(['balanced', None]),
+    },
+    'random_forest': lambda rng: {
+        'n_estimators': int(rng.choice([50, 100, 200, 300])),
+        'max_depth': rng.choice([4, 6, 8, 10, 14, None]),
+        'min_samples_leaf': int(rng.choice([1, 2, 5])),
+        'max_features': rng.choice(['sqrt', 0.5, None]),
+        'class_weight': rng.choice(['balanced', None]),
+    },
+    'xgboost': lambda rng: {
+        'n_estimators': int(rng.choice([50, 100, 200, 300])),
+        'max_depth': int(rng.choice([2, 3, 4, 6, 8])),
+        'learning_rate': round(_log_uniform(rng, 0.01, 0.3), 4),
+        'subsample': round(float(rng.uniform(0.6, 1.0)), 2),
+        'colsample_bytree': round(float(rng.uniform(0.6, 1.0)), 2),
+    },
+}
+
+
+def _plain(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Chuyển kiểu numpy về kiểu Python (để JSON hóa và làm khóa cache ổn định)"""
+    return {key: (value.item() if isinstance(value, np.generic) else value) for key, value in params.items()}
+
+
+def sample_candidates(n_iter: int, seed: int = 42) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Các bộ siêu tham số cần thử cho từng base model (bộ mặc định luôn là ứng viên đầu tiên)
+
+    Args:
+        n_iter: Số bộ ngẫu nhiên mỗi base model
+        seed: Seed ngẫu nhiên
+
+    Returns:
+        Dict tên base model → danh sách bộ siêu tham số (không trùng)
+    """
+    rng = np.random.default_rng(seed)
+    candidates = {}
+    for learner in BASE_LEARNERS:
+        seen = [dict(DEFAULT_BASE_PARAMS[learner])]
+        for _ in range(n_iter * 3):
+            if len(seen) > n_iter:
+                break
+            params = _plain(SEARCH_SPACES[learner](rng))
+            if params not in seen:
+                seen.append(params)
+        candidates[learner] = seen
+    return candidates
+
+
+def evaluate_candidate(
+    learner: str,
+    params: Dict[str, Any],
+    X: np.ndarray,
+    y: np.ndarray,
+    fold_ids: np.ndarray,
+    fingerprint: str,
+    cache_dir: str
+) -> Dict[str, Any]:
+    """
+    Dự báo OOF + AUC + độ trễ dự báo 1 dòng của một ứng viên (chạy trong process worker, có cache)
+
+    Returns:
+        Dict learner, params, oof, auc, latency_ms, fit_seconds, cached
+    """
+    cache = OOFCache(cache_dir)
+    cached = cache.get_oof(fingerprint, learner, params)
+    if cached is not None:
+        oof = cached['oof']
+        latency_ms = float(cached['latency_ms'][0])
+        fit_seconds = float(cached['fit_seconds'][0])
+    else:
+        oof = np.empty(len(y), dtype=np.float64)
+        fit_seconds = 0.0
+        estimator = None
+        for fold in np.unique(fold_ids):
+            train_mask = fold_ids != fold
+            estimator = make_base_learner(learner, params, n_jobs=1)
+            start = time.perf_counter()
+            estimator.fit(X[train_mask], y[train_mask])
+            fit_seconds += time.perf_counter() - start
+            oof[~train_mask] = estimator.predict_proba(X[~train_mask])[:, 1]
+
+        # Độ trễ dự báo 1 dòng (như /predict), đo trên mô hình của fold cuối
+        row = pd.DataFrame(X[:1], columns=MODEL_COLS)
+        estimator.predict_proba(row)
+        timings = []
+        for _ in range(LATENCY_REPEATS):
+            start = time.perf_counter()
+            estimator.predict_proba(row)
+            timings.append(time.perf_counter() - start)
+        latency_ms = float(np.median(timings) * 1000)
+        cache.put_oof(fingerprint, learner, params, oof, latency_ms=latency_ms, fit_seconds=fit_seconds)
+
+    return {
+        'learner': learner,
+        'params': params,
+        'oof': oof,
+        'auc': float(roc_auc_score(y, oof)),
+        'latency_ms': latency_ms,
+        'fit_seconds': fit_seconds,
+        'cached': cached is not None,
+    }
+
+
+def meta_oof_auc(meta_features: np.ndarray, y: np.ndarray, fold_ids: np.ndarray, C: float = 1.0) -> float:
+    """
+    AUC của meta-learner (LogisticRegression) trên ma trận OOF, đánh giá theo cùng các fold
+
+    Args:
+        meta_features: Ma trận OOF (n_samples × số base model)
+        y: Nhãn
+        fold_ids: Fold của từng dòng
+        C: Hệ số regularization của meta-learner
+
+    Returns:
+        AUC
+    """
+    predictions = np.empty(len(y), dtype=np.float64)
+    for fold in np.unique(fold_ids):
+        train_mask = fold_ids != fold
+        meta = LogisticRegression(random_state=42, max_iter=1000, C=C)
+        meta.fit(meta_features[train_mask], y[train_mask])
+        predictions[~train_mask] = meta.predict_proba(meta_features[~train_mask])[:, 1]
+    return float(roc_auc_score(y, predictions))
+
+
+def pareto_front(points: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Các điểm không bị trội: không có điểm nào vừa nhanh hơn (hoặc bằng) vừa có AUC cao hơn"""
+    front = []
+    best_auc = -np.inf
+    for point in sorted(points, key=lambda item: (item['latency_ms'], -item['auc'])):
+        if point['auc'] > best_auc:
+            front.append(point)
+            best_auc = point['auc']
+    return front
+
+
+def _tuning_workers() -> int:
+    return int(os.getenv("TUNE_WORKERS", os.cpu_count() or 1))
+
+
+def run_tuning(
+    df: pd.DataFrame,
+    n_iter: int = DEFAULT_N_ITER,
+    seed: int = 42,
+    progress_callback: Optional[Callable[[int, str], None]] = None,
+    cache_dir: str = None
+) -> Dict[str, Any]:
+    """
+    Random search siêu tham số cho 3 base models, trả về Pareto front AUC - độ trễ của stack
+
+    Args:
+        df: Dữ liệu huấn luyện (X_1 → X_14 + 'default'), dùng phần train giống CreditRiskModel.train
+        n_iter: Số bộ siêu tham số ngẫu nhiên mỗi base model (ngoài bộ mặc định)
+        seed: Seed ngẫu nhiên
+        progress_callback: Hàm nhận (phần trăm, mô tả bước)
+        cache_dir: Thư mục cache OOF (None = OOF_CACHE_DIR)
+
+    Returns:
+        Dict chứa pareto_front, best_auc, default (stack với siêu tham số hiện tại), số ứng viên, thống kê cache
+    """
+    progress = progress_callback or (lambda pct, message: None)
+    started = time.perf_counter()
+
+    missing = [col for col in ['default'] + MODEL_COLS if col not in df.columns]
+    if missing:
+        raise ValueError(f"Thiếu cột: {missing}. Vui lòng kiểm tra lại file CSV.")
+
+    # Cùng cách chia train/test với CreditRiskModel.train: tập test không tham gia tìm kiếm
+    X_train, _, y_train, _ = train_test_split(
+        df[MODEL_COLS], df['default'].astype(int), test_size=0.2, random_state=42, stratify=df['default'].astype(int)
+    )
+    X = X_train.to_numpy(dtype=np.float64)
+    y = y_train.to_numpy(dtype=np.int64)
+
+    cache = OOFCache(cache_dir)
+    fingerprint = dataset_fingerprint(X, y)
+    fold_ids = cache.get_folds(X, y, fingerprint=fingerprint)
+
+    candidates = sample_candidates(n_iter, seed)
+    tasks = [(learner, params) for learner in BASE_LEARNERS for params in candidates[learner]]
+    progress(5, f"Đánh giá {len(tasks)} ứng viên base model")
+
+    results: Dict[str, List[Dict[str, Any]]] = {learner: [None] * len(candidates[learner]) for learner in BASE_LEARNERS}
+    pending = []
+    for learner in BASE_LEARNERS:
+        for index, params in enumerate(candidates[learner]):
+            if cache.get_oof(fingerprint, learner, params) is not None:
+                # Đã có OOF trong cache: đọc ngay, không cần process worker
+                results[learner][index] = evaluate_candidate(learner, params, X, y, fold_ids, fingerprint, cache.cache_dir)
+            else:
+                pending.append((learner, index, params))
+
+    if pending:
+        context = multiprocessing.get_context("spawn")
+        workers = min(_tuning_workers(), len(pending))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = {
+                pool.submit(evaluate_candidate, learner, params, X, y, fold_ids, fingerprint, cache.cache_dir): (learner, index)
+                for learner, index, params in pending
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                learner, index = futures[future]
+                results[learner][index] = future.result()
+                progress(5 + int(75 * done / len(futures)), f"Đã đánh giá {done}/{len(futures)} ứng viên")
+
+    # Ghép tổ hợp: meta-learner chỉ fit trên ma trận OOF (vài ms mỗi tổ hợp)
+    progress(80, "Đánh giá các tổ hợp stack trên ma trận OOF")
+    points = []
+    for combo in itertools.product(*(range(len(results[learner])) for learner in BASE_LEARNERS)):
+        members = [results[learner][index] for learner, index in zip(BASE_LEARNERS, combo)]
+        meta_features = np.column_stack([member['oof'] for member in members])
+        points.append({
+            'combo': combo,
+            'auc': meta_oof_auc(meta_features, y, fold_ids),
+            'latency_ms': sum(member['latency_ms'] for member in members),
+        })
+
+    # Tinh chỉnh lại meta-learner cho các điểm trên Pareto front (không fit lại base models)
+    progress(92, "Tinh chỉnh meta-learner trên Pareto front")
+    front = []
+    for point in pareto_front(points):
+        members = [results[learner][index] for learner, index in zip(BASE_LEARNERS, point['combo'])]
+        meta_features = np.column_stack([member['oof'] for member in members])
+        meta_scores = {C: meta_oof_auc(meta_features, y, fold_ids, C) for C in META_C_GRID}
+        best_C = max(meta_scores, key=meta_scores.get)
+        front.append(_describe_point(point, members, best_C, meta_scores[best_C]))
+
+    default_point = next(point for point in points if point['combo'] == (0,) * len(BASE_LEARNERS))
+    default_members = [results[learner][0] for learner in BASE_LEARNERS]
+    best_point = max(points, key=lambda point: point['auc'])
+    best_members = [results[learner][index] for learner, index in zip(BASE_LEARNERS, best_point['combo'])]
+
+    return {
+        'n_samples': int(len(y)),
+        'n_candidates': {learner: len(candidates[learner]) for learner in BASE_LEARNERS},
+        'n_combinations': len(points),
+        'pareto_front': front,
+        'best_auc': _describe_point(best_point, best_members),
+        'default': _describe_point(default_point, default_members),
+        'base_learners': {
+            learner: [
+                {'params': item['params'], 'auc': round(item['auc'], 4), 'latency_ms': round(item['latency_ms'], 3),
+                 'fit_seconds': round(item['fit_seconds'], 3), 'cached': item['cached']}
+                for item in sorted(results[learner], key=lambda item: -item['auc'])
+            ]
+            for learner in BASE_LEARNERS
+        },
+        'cache': {
+            'dir': cache.cache_dir,
+            'dataset_fingerprint': fingerprint,
+            'cached_candidates': sum(item['cached'] for learner in BASE_LEARNERS for item in results[learner]),
+        },
+        'elapsed_seconds': round(time.perf_counter() - started, 2),
+    }
+
+
+def _describe_point(point: Dict[str, Any], members: List[Dict[str, Any]], meta_C: float = 1.0, auc: float = None) -> Dict[str, Any]:
+    return {
+        'auc': round(point['auc'] if auc is None else auc, 4),
+        'latency_ms': round(point['latency_ms'], 3),
+        'meta_C': meta_C,
+        'base_params': {member['learner']: member['params'] for member in members},
+    }